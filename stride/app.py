@@ -1,8 +1,26 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, jsonify, url_for, redirect, request, abort
+"""ShoeCase Restfull API Server.
+
+Usage:
+    app.py [--production] [--workers=<n>] [--threads=<n>] [--port=<port>]
+
+Options:
+    --production      Serve with multi-process production server instead of development server
+    --workers=<n>     Number of worker processes, defaults to SERVER_WORKERS in config
+    --threads=<n>     Number of threads per worker, defaults to SERVER_THREADS in config
+    --port=<port>     Port to listen on, defaults to PORT in config
+"""
+from docopt import docopt
+from flask import Flask, Response, url_for, redirect, request, abort, stream_with_context, json
 from flask_restful import Resource, Api
+from pymodm.vendor import parse_datetime
 import config
+import matching
+import metrics
 import models
+import ranking
+import responses
+from responses import api_response
 from functools import partial
 
 
@@ -14,9 +32,13 @@ app.config.from_object(config)
 # -------------------------------------------------------------------------
 API_ITEM_URL_KEY = '_api_item_url'
 API_RESULTS_LIMITER = 100
+API_EXPORT_BATCH_SIZE = 1000
+API_INTERNAL_FIELDS = ('doc_version', 'sku_key', 'search_text', '_cls')
 
 
 api = Api(app)
+metrics.instrument_app(app)
+responses.init_app(app)
 
 
 def cap_limit(limit):
@@ -53,7 +75,7 @@ class WebsiteListAPI(Resource):
 
             websites.append(data)
 
-        return jsonify({"websites": websites})
+        return api_response({"websites": websites})
 
 api.add_resource(WebsiteListAPI, '/api/websites', endpoint="websites")
 
@@ -71,7 +93,7 @@ class WebsiteAPI(Resource):
         except:
             abort(404)
 
-        return jsonify(website)
+        return api_response(website)
 
 api.add_resource(WebsiteAPI, '/api/websites/<string:website_id>', endpoint="website")
 
@@ -97,7 +119,7 @@ class WebsiteProductListAPI(Resource):
 
             products.append(data)
 
-        return jsonify({
+        return api_response({
             "limit": limit,
             "products": products,
             "skip": skip,
@@ -114,6 +136,67 @@ WPLA('/api/websites/<string:website_id>/products/<int:skip>/<int:limit>'
     , endpoint="website_products_offset_limited")
 
 
+# -------------------------------------------------------------------------
+# Website Products Export
+# -------------------------------------------------------------------------
+class WebsiteProductExportAPI(Resource):
+    """Stream the full product catalog of a website as newline delimited JSON.
+
+    Query arguments:
+        - fields: comma separated list of fields to include
+        - crawled_after: only include products crawled at or after datetime
+        - crawled_before: only include products crawled before datetime
+
+    Products are read from a single cursor and written one document per line,
+    references are not dereferenced.
+    """
+    def get(self, website_id):
+        try:
+            lookup_args = models.Website.get_lookup_arguments(website_id=website_id)
+        except:
+            abort(404)
+
+        query = {'website': lookup_args['_id']}
+
+        # -------------------------------------------------------------------------
+        # Filter on crawled_at range
+        # -------------------------------------------------------------------------
+        crawled_at = {}
+        for arg, operator in (('crawled_after', '$gte'), ('crawled_before', '$lt')):
+            value = request.args.get(arg)
+            if value:
+                crawled_at[operator] = parse_datetime(value)
+                if crawled_at[operator] is None:
+                    abort(400)
+        if crawled_at:
+            query['crawled_at'] = crawled_at
+
+        # -------------------------------------------------------------------------
+        # Projection of requested fields
+        # -------------------------------------------------------------------------
+        projection = dict([(f, 0) for f in API_INTERNAL_FIELDS])
+        fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+        fields = [f for f in fields if f not in API_INTERNAL_FIELDS]
+        if fields:
+            projection = dict([(f, 1) for f in fields])
+
+        cursor = models.Product._mongometa.collection.find(
+            query, projection=projection, batch_size=API_EXPORT_BATCH_SIZE,
+            )
+
+        def generate():
+            try:
+                for doc in cursor:
+                    yield json.dumps(models.son_to_dict(doc), separators=(',', ':')) + '\n'
+            finally:
+                cursor.close()
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+api.add_resource(WebsiteProductExportAPI, '/api/websites/<string:website_id>/products/export'
+    , endpoint="website_products_export")
+
+
 # -------------------------------------------------------------------------
 # Brands
 # -------------------------------------------------------------------------
@@ -128,7 +211,7 @@ class BrandListAPI(Resource):
             data = brand.to_dict()
             brands.append(data)
 
-        return jsonify({
+        return api_response({
             "brands": brands,
             "limit": limit,
             "skip": skip,
@@ -162,7 +245,7 @@ class BrandProductListAPI(Resource):
 
             products.append(data)
 
-        return jsonify({
+        return api_response({
             "limit": limit,
             "products": products,
             "skip": skip,
@@ -205,18 +288,304 @@ class ProductAPI(Resource):
         except:
             abort(404)
 
-        return jsonify(product)
+        return api_response(product)
 
 api.add_resource(ProductAPI, '/api/product/<string:product_id>', endpoint="product")
 api.add_resource(ProductAPI, '/api/website/<string:website_id>/product/<string:product_id>', endpoint="website_product")
 
 
+def get_website_product_sku(website_id, product_id):
+    """Resolve website and product id or sku into website ObjectId and sku"""
+    website_pk = models.Website.get_lookup_arguments(website_id)['_id']
+    sku = product_id
+    if models.check_is_valid_object_id(product_id):
+        sku = models.Product._mongometa.collection.find_one(
+            {'_id': models.ObjectId(product_id), 'website': website_pk}, projection={'sku': 1}
+            )['sku']
+    return website_pk, sku
+
+
+class ProductPriceHistoryAPI(Resource):
+    """Price history of a website product across crawls as parallel lists"""
+    def get(self, website_id, product_id):
+        try:
+            website_pk, sku = get_website_product_sku(website_id, product_id)
+        except:
+            abort(404)
+
+        history = models.Product.get_price_history(website_pk, sku)
+        if not history['crawled_at']:
+            abort(404)
+
+        history['crawled_at'] = [c.isoformat() for c in history['crawled_at']]
+        history['sku'] = sku
+        history['website'] = str(website_pk)
+
+        return api_response(history)
+
+api.add_resource(ProductPriceHistoryAPI, '/api/website/<string:website_id>/product/<string:product_id>/prices'
+    , endpoint="website_product_prices")
+
+
+class ProductRankHistoryAPI(Resource):
+    """Listing rank history of a website product per category and ordering.
+
+    Query arguments:
+        - category, sorted_by: restrict to one category listing
+    """
+    def get(self, website_id, product_id):
+        try:
+            website_pk, sku = get_website_product_sku(website_id, product_id)
+        except:
+            abort(404)
+
+        history = ranking.get_rank_history(
+            website_pk, sku,
+            category=request.args.get('category'),
+            sorted_by=request.args.get('sorted_by'),
+            )
+        for series in history:
+            series['crawled_at'] = [c.isoformat() for c in series['crawled_at']]
+
+        return api_response({
+            "ranks": history,
+            "sku": sku,
+            "website": str(website_pk),
+            })
+
+api.add_resource(ProductRankHistoryAPI, '/api/website/<string:website_id>/product/<string:product_id>/ranks'
+    , endpoint="website_product_ranks")
+
+
+class WebsiteRankingAPI(Resource):
+    """Top ranked products of a category listing on a crawl day.
+
+    Query arguments:
+        - category, sorted_by: category listing, required
+        - date: crawl day as YYYY-MM-DD, defaults to latest crawl
+        - limit
+    """
+    def get(self, website_id):
+        try:
+            website_pk = models.Website.get_lookup_arguments(website_id)['_id']
+        except:
+            abort(404)
+
+        category = request.args.get('category')
+        sorted_by = request.args.get('sorted_by')
+        if not category:
+            abort(400)
+
+        date = request.args.get('date')
+        if date:
+            crawl_day = parse_datetime('%sT00:00:00' % (date))
+            if crawl_day is None:
+                abort(400)
+        else:
+            crawl_day = ranking.get_latest_crawl_date(website_pk, category, sorted_by)
+            if crawl_day is None:
+                abort(404)
+
+        ranks = ranking.get_top_ranked(
+            website_pk, category, sorted_by, crawl_day,
+            limit=cap_limit(request.args.get('limit', 10, type=int)),
+            )
+
+        return api_response({
+            "category": category,
+            "crawl_date": crawl_day.date().isoformat(),
+            "ranks": [models.son_to_dict(rank) for rank in ranks],
+            "sorted_by": sorted_by,
+            "website": str(website_pk),
+            })
+
+api.add_resource(WebsiteRankingAPI, '/api/websites/<string:website_id>/rankings', endpoint="website_rankings")
+
+
+class ProductMatchesAPI(Resource):
+    """Same product at other websites"""
+    def get(self, website_id, product_id):
+        try:
+            website_pk, sku = get_website_product_sku(website_id, product_id)
+        except:
+            abort(404)
+
+        matches = matching.get_matches(website_pk, sku)
+        if matches is None:
+            abort(404)
+
+        products = []
+        for match in matches:
+            data = models.son_to_dict(match)
+
+            # -------------------------------------------------------------------------
+            # Assign API item URL
+            # -------------------------------------------------------------------------
+            data[API_ITEM_URL_KEY] = url_for('website_product', website_id=data['website'], product_id=data['sku'])
+
+            products.append(data)
+
+        return api_response({
+            "products": products,
+            "sku": sku,
+            "website": str(website_pk),
+            })
+
+api.add_resource(ProductMatchesAPI, '/api/website/<string:website_id>/product/<string:product_id>/matches'
+    , endpoint="website_product_matches")
+
+
+# -------------------------------------------------------------------------
+# Product Stats
+# -------------------------------------------------------------------------
+def get_product_stats(scope, **lookup):
+    """Read precomputed stats document"""
+    query = {'scope': scope, 'website': None, 'brand': None}
+    query.update(lookup)
+    return models.ProductStats._mongometa.collection.find_one(query, projection={'doc_version': 0, 'price_counts': 0})
+
+
+class WebsiteStatsListAPI(Resource):
+    def get(self):
+        results = models.ProductStats._mongometa.collection.find(
+            {'scope': models.ProductStats.SCOPE_WEBSITE}, projection={'doc_version': 0}
+            )
+        return api_response({"stats": [models.son_to_dict(doc) for doc in results]})
+
+api.add_resource(WebsiteStatsListAPI, '/api/stats/websites', endpoint="websites_stats")
+
+
+class WebsiteStatsAPI(Resource):
+    def get(self, website_id):
+        try:
+            lookup_args = models.Website.get_lookup_arguments(website_id=website_id)
+        except:
+            abort(404)
+
+        stats = get_product_stats(models.ProductStats.SCOPE_WEBSITE, website=lookup_args['_id'])
+        if not stats:
+            abort(404)
+
+        return api_response(models.son_to_dict(stats))
+
+api.add_resource(WebsiteStatsAPI, '/api/stats/websites/<string:website_id>', endpoint="website_stats")
+
+
+class BrandStatsAPI(Resource):
+    def get(self, brand_id):
+        try:
+            lookup_args = models.Brand.get_lookup_arguments(brand_id)
+        except:
+            abort(404)
+
+        stats = get_product_stats(models.ProductStats.SCOPE_BRAND, brand=lookup_args['_id'])
+        if not stats:
+            abort(404)
+
+        return api_response(models.son_to_dict(stats))
+
+api.add_resource(BrandStatsAPI, '/api/stats/brands/<string:brand_id>', endpoint="brand_stats")
+
+
+# -------------------------------------------------------------------------
+# Product Search
+# -------------------------------------------------------------------------
+API_SEARCH_PROJECTION = dict([(f, 0) for f in ('listings',) + API_INTERNAL_FIELDS])
+
+
+def parse_bool_arg(value):
+    """Convert query argument into boolean, `None` if not set"""
+    if value is None or value == '':
+        return None
+    return value.lower() in ('1', 'true', 'yes')
+
+
+class ProductSearchAPI(Resource):
+    """Search products.
+
+    Query arguments:
+        - q: text search on name, product type, brand and properties
+        - website, brand: uid or ObjectId
+        - product_type, on_sale
+        - min_price, max_price, min_discount
+        - limit, after: keyset paging, `after` is the `_id` of the last product seen
+    """
+    def get(self):
+        args = request.args
+        limit = cap_limit(args.get('limit', 10, type=int))
+
+        try:
+            query = models.Product.get_search_arguments(
+                text=args.get('q'),
+                website_id=args.get('website'),
+                brand_id=args.get('brand'),
+                product_type=args.get('product_type'),
+                on_sale=parse_bool_arg(args.get('on_sale')),
+                min_price=args.get('min_price', type=float),
+                max_price=args.get('max_price', type=float),
+                min_discount=args.get('min_discount', type=float),
+                after=args.get('after'),
+                )
+        except models.pymodm_errors.DoesNotExist:
+            abort(404)
+        except ValueError:
+            abort(400)
+
+        cursor = models.Product._mongometa.collection.find(
+            query, projection=API_SEARCH_PROJECTION,
+            ).sort([('_id', 1)]).limit(limit)
+
+        products = []
+        for doc in cursor:
+            data = models.son_to_dict(doc)
+
+            # -------------------------------------------------------------------------
+            # Assign API item URL
+            # -------------------------------------------------------------------------
+            data[API_ITEM_URL_KEY] = url_for('product', product_id=data['_id'])
+
+            products.append(data)
+
+        after = products[-1]['_id'] if len(products) == limit else None
+
+        return api_response({
+            "after": after,
+            "limit": limit,
+            "products": products,
+            })
+
+api.add_resource(ProductSearchAPI, '/api/products/search', endpoint="product_search")
+
+
+# -------------------------------------------------------------------------
+# Metrics
+# -------------------------------------------------------------------------
+class MetricsAPI(Resource):
+    def get(self):
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+api.add_resource(MetricsAPI, '/metrics', endpoint="metrics")
+
+
 def main():
     """Main application"""
-    app.run(
-        host=app.config.get('HOST'),
-        port=app.config.get('PORT'),
-        )
+    arguments = docopt(__doc__)
+    if arguments['--port']:
+        app.config['PORT'] = int(arguments['--port'])
+
+    if arguments['--production']:
+        import server
+        server.serve(
+            app,
+            app.config,
+            workers=int(arguments['--workers'] or 0),
+            threads=int(arguments['--threads'] or 0),
+            )
+    else:
+        app.run(
+            host=app.config.get('HOST'),
+            port=app.config.get('PORT'),
+            )
 
 
 if __name__ == '__main__':
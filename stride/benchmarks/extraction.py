@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Provider extraction benchmark suite.
+
+Measures lines per second and peak RSS of `extract_date_line` per provider and
+page type, including JSON decoding and parsing of the page. Every measurement
+runs in its own process, so peak RSS isn't shared between measurements.
+
+Without datasets synthetic datasets of all providers are generated, see
+`benchmarks.synthetic`. Results are compared with the saved baselines, a
+throughput drop or peak RSS growth above the threshold is a regression and
+exits with status 1. Baselines are machine specific, save them on the machine
+the suite runs on.
+
+Usage:
+    extraction.py [options] [(<provider> <dataset>)...]
+
+Options:
+    --repeat=<n>        Number of passes over the lines, the fastest pass counts [default: 5]
+    --products=<n>      Number of products of generated datasets [default: 200]
+    --baseline=<file>   Baselines file, defaults to benchmarks/baselines/extraction.json
+    --threshold=<pct>   Regression threshold in percent [default: 10]
+    --timeout=<s>       Seconds a measurement may take [default: 600]
+    --save              Save results as baselines
+
+Providers: zalando, omoda, ziengs
+"""
+import json
+import os.path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from multiprocessing import Process, Pipe
+from docopt import docopt
+from benchmarks.extraction_plans import PROVIDERS, PAGE_TYPES
+from benchmarks import synthetic
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'extraction.json')
+
+
+def peak_rss_mb():
+    """Peak RSS of the process in MB (ru_maxrss is in KB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class MeasurementError(Exception):
+    pass
+
+
+def measure(name, path, page_type, repeat, conn):
+    """Measure extraction of the lines of page type, runs in a child process.
+
+    Sends the result, or the traceback of a failure.
+    """
+    try:
+        conn.send(("ok", measure_lines(name, path, page_type, repeat)))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def measure_lines(name, path, page_type, repeat):
+    """Result of the extraction of the lines of page type, `None` without lines"""
+    provider = PROVIDERS[name](path)
+    lines = [line for line in provider.read_file() if json.loads(line).get('page_type') == page_type]
+    if not lines:
+        return None
+
+    elapsed = []
+    for _ in range(repeat):
+        started = time.time()
+        for line in lines:
+            provider.extract_date_line(line)
+        elapsed.append(time.time() - started)
+
+    return {
+        "lines": len(lines),
+        "lines_per_second": len(lines) / min(elapsed),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run(name, path, page_type, repeat, timeout):
+    """Result of a measurement in a new process.
+
+    Raises `MeasurementError` when the measurement fails, the process dies
+    or takes longer than `timeout` seconds.
+    """
+    parent_conn, child_conn = Pipe(duplex=False)
+    process = Process(target=measure, args=(name, path, page_type, repeat, child_conn))
+    process.start()
+    # -------------------------------------------------------------------------
+    # Only the child holds the sending end, its exit ends the pipe
+    # -------------------------------------------------------------------------
+    child_conn.close()
+    try:
+        if not parent_conn.poll(timeout):
+            process.terminate()
+            raise MeasurementError("timed out after %ss" % (timeout))
+        try:
+            status, result = parent_conn.recv()
+        except EOFError:
+            process.join()
+            raise MeasurementError("process exited with code %s" % (process.exitcode))
+    finally:
+        parent_conn.close()
+    process.join()
+    if status == "error":
+        raise MeasurementError(result)
+    return result
+
+
+def compare(result, baseline, threshold):
+    """Regressions of result compared to baseline"""
+    regressions = []
+    if baseline is None:
+        return regressions
+    if result['lines_per_second'] < baseline['lines_per_second'] * (1 - threshold):
+        regressions.append("lines/s %.1f < %.1f" % (result['lines_per_second'], baseline['lines_per_second']))
+    if result['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + threshold):
+        regressions.append("peak RSS %.1fMB > %.1fMB" % (result['peak_rss_mb'], baseline['peak_rss_mb']))
+    return regressions
+
+
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    repeat = int(arguments['--repeat'])
+    threshold = float(arguments['--threshold']) / 100
+    timeout = float(arguments['--timeout'])
+    baseline_path = arguments['--baseline'] or BASELINE_PATH
+
+    datasets = zip(arguments['<provider>'], arguments['<dataset>'])
+    for name, path in datasets:
+        if name not in PROVIDERS:
+            print "Unknown provider: %s" % (name)
+            sys.exit(1)
+
+    # -------------------------------------------------------------------------
+    # Generate synthetic datasets of all providers without datasets
+    # -------------------------------------------------------------------------
+    tmp_dir = None
+    if not datasets:
+        tmp_dir = tempfile.mkdtemp(prefix='extraction-benchmark-')
+        for name in synthetic.PROVIDERS:
+            path = os.path.join(tmp_dir, 'crawl_%s.synthetic.jl' % (name))
+            synthetic.write_dataset(path, name, products=int(arguments['--products']))
+            datasets.append((name, path))
+
+    baselines = {}
+    if os.path.isfile(baseline_path):
+        with open(baseline_path, 'r') as baseline_file:
+            baselines = json.load(baseline_file)
+
+    results = {}
+    regressed = False
+    failed = False
+    try:
+        for name, path in datasets:
+            for page_type in PAGE_TYPES:
+                try:
+                    result = run(name, path, page_type, repeat, timeout)
+                except MeasurementError as e:
+                    failed = True
+                    print "%s %s FAILED: %s" % (name.ljust(8), page_type.ljust(16), e)
+                    continue
+                if result is None:
+                    continue
+                key = "%s %s" % (name, page_type)
+                results[key] = result
+
+                regressions = compare(result, baselines.get(key), threshold)
+                regressed = regressed or bool(regressions)
+                print "%s %s lines: %5s %8.1f lines/s peak RSS: %6.1fMB %s" % (
+                    name.ljust(8),
+                    page_type.ljust(16),
+                    result['lines'],
+                    result['lines_per_second'],
+                    result['peak_rss_mb'],
+                    "REGRESSION: %s" % ('; '.join(regressions)) if regressions else (
+                        'ok' if key in baselines else 'no baseline'),
+                    )
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    if arguments['--save']:
+        baselines.update(results)
+        if not os.path.isdir(os.path.dirname(os.path.abspath(baseline_path))):
+            os.makedirs(os.path.dirname(os.path.abspath(baseline_path)))
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+        print "Baselines saved to %s" % (baseline_path)
+
+    if regressed or failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Extraction plan benchmarks.
+
+Runs the provider extraction with compiled plans and with interpreted plans,
+which evaluate every selector with BeautifulSoup `select` as the providers did
+before the specs. Outputs must be identical, timings are reported per provider
+and page type. Pages are parsed once up front, only extraction is timed.
+
+Usage:
+    extraction_plans.py [--repeat=<n>] (<provider> <dataset>)...
+
+Options:
+    --repeat=<n>    Number of passes over the pages [default: 5]
+
+Providers: zalando, omoda, ziengs
+"""
+import json
+import sys
+import timeit
+import bs4 as BeautifulSoup
+from docopt import docopt
+from providers.zalando.zalando import ZalandoProvider
+from providers.omoda.omoda import OmodaProvider
+from providers.ziengs.ziengs import ZiengsProvider
+
+
+PROVIDERS = {
+    'zalando': ZalandoProvider,
+    'omoda': OmodaProvider,
+    'ziengs': ZiengsProvider,
+}
+
+PAGE_TYPES = ['product_detail', 'product_listing']
+
+
+def interpreted_provider(Provider, path):
+    """Provider running its specs without compiled selectors"""
+    provider = Provider(path)
+    provider.detail_plan = Provider.detail_spec.compile(interpreted=True)
+    provider.listing_plan = Provider.listing_spec.compile(interpreted=True)
+    return provider
+
+
+def parse_pages(provider):
+    """Parse dataset lines per page type"""
+    pages = dict([(page_type, []) for page_type in PAGE_TYPES])
+    for line in provider.read_file():
+        entry = json.loads(line)
+        if entry.get('page_type') not in pages or 'body' not in entry:
+            continue
+        entry['htmlx'] = BeautifulSoup.BeautifulSoup(entry['body'], 'lxml')
+        entry['_parser_error'] = False
+        pages[entry['page_type']].append(entry)
+    return pages
+
+
+def extract(provider, page_type, entries):
+    """Extract data of all entries"""
+    if page_type == 'product_detail':
+        return [provider.extract_product_detail_info(entry) for entry in entries]
+    return [provider.extract_product_listing_items(entry) for entry in entries]
+
+
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    repeat = int(arguments['--repeat'])
+
+    for name, path in zip(arguments['<provider>'], arguments['<dataset>']):
+        if name not in PROVIDERS:
+            print "Unknown provider: %s" % (name)
+            sys.exit(1)
+        Provider = PROVIDERS[name]
+        compiled = Provider(path)
+        interpreted = interpreted_provider(Provider, path)
+        pages = parse_pages(compiled)
+
+        for page_type in PAGE_TYPES:
+            entries = pages[page_type]
+            if not entries:
+                continue
+            if extract(compiled, page_type, entries) != extract(interpreted, page_type, entries):
+                print "%s %s: outputs differ" % (name, page_type)
+                sys.exit(1)
+
+            interpreted_time = timeit.timeit(lambda: extract(interpreted, page_type, entries), number=repeat)
+            compiled_time = timeit.timeit(lambda: extract(compiled, page_type, entries), number=repeat)
+            print "%s %s pages: %5s interpreted: %7.1f lines/s compiled: %7.1f lines/s speedup: %5.1fx" % (
+                name.ljust(8),
+                page_type.ljust(16),
+                len(entries),
+                len(entries) * repeat / interpreted_time,
+                len(entries) * repeat / compiled_time,
+                interpreted_time / compiled_time,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""API load test.
+
+Seeds a separate database with websites, brands, listing pages and products
+through the models, then drives every REST endpoint for the same duration
+with concurrent clients and reports throughput and latency percentiles per
+endpoint.
+
+Seeding is deterministic for a seed: the same products, listings and request
+paths on every run, so results of runs with the same options are comparable.
+Results can be saved and compared with a previous run.
+
+Usage:
+    loadtest.py [options]
+
+Options:
+    --database=<name>       Database to seed, dropped first [default: shoecase_loadtest]
+    --websites=<n>          Number of websites [default: 3]
+    --brands=<n>            Number of brands [default: 50]
+    --products=<n>          Number of products per website and crawl [default: 2000]
+    --crawls=<n>            Number of crawl days [default: 3]
+    --listings=<n>          Mean number of listings per product [default: 20]
+    --seed=<n>              Random seed [default: 1]
+    --no-seed               Use the seeded database of a previous run
+    --concurrency=<n>       Number of concurrent clients [default: 16]
+    --duration=<seconds>    Seconds to drive each endpoint [default: 10]
+    --endpoints=<names>     Comma separated endpoints to drive, defaults to all
+    --development           Drive the development server instead of the production server
+    --workers=<n>           Production server worker processes [default: 4]
+    --threads=<n>           Production server threads per worker [default: 4]
+    --output=<file>         Save results as JSON
+    --compare=<file>        Compare with results saved by a previous run
+"""
+import json
+import random
+import sys
+import subprocess
+from datetime import datetime, timedelta
+from urllib import urlencode
+from docopt import docopt
+from pymodm import MongoModel
+import config
+import models
+import matching
+import ranking
+import stats as product_stats
+import utils
+from benchmarks.serving import STRIDE_PATH, wait_for_port, drive
+
+
+LOADTEST_SERVER_PORT = 5103
+
+WEBSITES = ['zalando', 'omoda', 'ziengs']
+BRANDS = ['Nike', 'Gabor', 'Dr. Martens', 'Converse', 'Van Bommel', 'Tommy Hilfiger', 'Ecco', 'Adidas', 'Puma', 'Vans']
+TYPES = ['Sneakers', 'Pumps', 'Laarzen', 'Sandalen', 'Veterschoenen', 'Instappers']
+WORDS = ['classic', 'runner', 'suede', 'leather', 'chelsea', 'high', 'low', 'canvas', 'court', 'trail', 'city', 'air']
+CATEGORIES = [['Schoenen', 'Dames'], ['Schoenen', 'Heren'], ['Schoenen', 'Kinderen']]
+ORDERINGS = ['popular', 'price_asc']
+LISTING_PAGE_SIZE = 24
+CRAWL_START = datetime(2016, 5, 1, 23, 15)
+BULK_CREATE_SIZE = 500
+SAMPLE_SIZE = 50
+
+
+# -------------------------------------------------------------------------
+# Seeding
+# -------------------------------------------------------------------------
+def use_database(name):
+    """Reconnect the models to database, dropped and with the model indexes created.
+
+    Indexes are created by pymodm when the models are defined, on the
+    configured database, so they are created again after dropping.
+    """
+    if name == config.MONGO_DBNAME:
+        raise SystemExit("Refusing to seed configured database '%s'" % (name))
+
+    config.MONGO_DBNAME = name
+    models.connect_database()
+
+    database = models.Website._mongometa.collection.database
+    database.client.drop_database(name)
+    for model in vars(models).values():
+        if isinstance(model, type) and issubclass(model, MongoModel) and getattr(model._mongometa, 'indexes', None):
+            model._mongometa.collection.create_indexes(model._mongometa.indexes)
+
+
+def catalogue(rng, brands, products):
+    """Product models shared by the websites, so products are matched across websites"""
+    items = []
+    for i in range(products):
+        brand = rng.choice(brands)
+        items.append({
+            "index": i,
+            "brand": brand,
+            "name": '%s %s %s %s' % (brand.brand, rng.choice(WORDS), rng.choice(WORDS), rng.choice(TYPES)),
+            "type": rng.choice(TYPES),
+            "price": rng.randint(30, 200) + 0.95,
+            "properties": {"materiaal": rng.choice(['leer', 'textiel', 'suede']), "kleur": rng.choice(['zwart', 'wit', 'rood'])},
+        })
+    return items
+
+
+def listing_pages(rng, website, crawled_at, products):
+    """Listing pages of every category and ordering of a crawl"""
+    pages = []
+    pages_per_listing = max(1, products // LISTING_PAGE_SIZE // len(CATEGORIES))
+    for category in CATEGORIES:
+        for ordering in ORDERINGS:
+            for page_number in range(1, pages_per_listing + 1):
+                page = models.ProductListingPage(
+                    page_number=page_number,
+                    page_listing_size=LISTING_PAGE_SIZE,
+                    category=category,
+                    sorted_by=ordering,
+                    url='https://www.%s.nl/%s/?p=%s&sort=%s' % (website.website, '/'.join(category).lower(), page_number, ordering),
+                    crawled_at=crawled_at,
+                    website=website.pk,
+                    )
+                pages.append(page.ensure())
+    return pages
+
+
+def create_products(website, products):
+    """Save products and the ranks of their listings"""
+    product_pks = models.Product.objects.bulk_create(products, full_clean=True)
+    rank_operations = []
+    for product, product_pk in zip(products, product_pks):
+        for listing_item in product.listings:
+            rank_operations.append(ranking.rank_operation(
+                website_pk=website.pk,
+                sku=product.sku,
+                product_pk=product_pk,
+                listing=listing_item.listing,
+                position=listing_item.position,
+                price=listing_item.price,
+                ))
+    ranking.store_ranks(rank_operations)
+
+
+def seed(websites, brands, products, crawls, listings, seed_value):
+    """Seed websites, brands, listing pages, products with listings, ranks, stats and matches"""
+    rng = random.Random(seed_value)
+    brand_models = [
+        models.Brand(brand=BRANDS[i] if i < len(BRANDS) else '%s %s' % (BRANDS[i % len(BRANDS)], i // len(BRANDS))).ensure()
+        for i in range(brands)
+    ]
+    items = catalogue(rng, brand_models, products * 2)
+
+    for w in range(websites):
+        name = WEBSITES[w] if w < len(WEBSITES) else 'shop%s' % (w)
+        website = models.Website(website=name).ensure()
+        selection = rng.sample(items, products)
+        print "[%s] Seeding %s products x %s crawls" % (name, products, crawls)
+
+        for crawl in range(crawls):
+            crawled_at = CRAWL_START + timedelta(days=crawl)
+            pages = listing_pages(rng, website, crawled_at, products)
+            batch = []
+            for item in selection:
+                price = round(item['price'] * rng.uniform(0.9, 1.1), 2)
+                discount = rng.choice([0.0, 0.0, 0.0, 10.0, 25.0])
+                sku = '%s-%06d' % (name.upper(), item['index'])
+
+                # -------------------------------------------------------------------------
+                # Listings: long tail of products listed on many pages
+                # -------------------------------------------------------------------------
+                product_listings = []
+                for page in rng.sample(pages, min(len(pages), int(rng.expovariate(1.0 / listings)))):
+                    product_listings.append(models.ProductListingItem(
+                        position=rng.randint(1, LISTING_PAGE_SIZE),
+                        price=price,
+                        on_sale=discount > 0.0,
+                        discount_percentage=discount,
+                        listing_props={},
+                        listing=page,
+                        ))
+
+                batch.append(models.Product(
+                    sku=sku,
+                    name=item['name'],
+                    product_type=item['type'],
+                    url='https://www.%s.nl/p/%s.html' % (name, sku.lower()),
+                    crawled_at=crawled_at,
+                    price=price,
+                    on_sale=discount > 0.0,
+                    discount_percentage=discount,
+                    properties=item['properties'],
+                    brand=item['brand'],
+                    website=website.pk,
+                    listings=product_listings,
+                    ))
+                if len(batch) >= BULK_CREATE_SIZE:
+                    create_products(website, batch)
+                    batch = []
+            if batch:
+                create_products(website, batch)
+
+        product_stats.refresh_website_stats(website.pk)
+        matching.refresh_website_matches(website.pk)
+    models.bump_import_generation()
+
+
+# -------------------------------------------------------------------------
+# Endpoints
+# -------------------------------------------------------------------------
+def endpoint_paths(rng):
+    """Request paths per endpoint, sampled from the seeded database"""
+    collection = models.Product._mongometa.collection
+    websites = list(models.Website._mongometa.collection.find({}, projection={'website_uid': 1}))
+    brands = list(models.Brand._mongometa.collection.find({}, projection={'brand_uid': 1}))
+    products = list(collection.find({}, projection={'website': 1, 'sku': 1, 'name': 1}).sort([('_id', 1)]))
+    if not products:
+        raise SystemExit("No products found in database '%s'" % (config.MONGO_DBNAME))
+    products = rng.sample(products, min(SAMPLE_SIZE, len(products)))
+    uids = dict([(w['_id'], w['website_uid']) for w in websites])
+
+    def product_paths(suffix=''):
+        return ['/api/website/%s/product/%s%s' % (uids[p['website']], p['sku'], suffix) for p in products]
+
+    return [
+        ('websites', ['/api/websites']),
+        ('website', ['/api/websites/%s' % (w['website_uid']) for w in websites]),
+        ('website_products', ['/api/websites/%s/products/%s/10' % (w['website_uid'], skip) for w in websites for skip in (0, 100, 1000)]),
+        ('website_products_export', ['/api/websites/%s/products/export?fields=sku,price' % (w['website_uid']) for w in websites]),
+        ('brands', ['/api/brands/%s/10' % (skip) for skip in (0, 10, 20)]),
+        ('brand_products', ['/api/brand/%s/products' % (b['brand_uid']) for b in brands]),
+        ('brand_stats', ['/api/stats/brands/%s' % (b['brand_uid']) for b in brands]),
+        ('product', ['/api/product/%s' % (p['_id']) for p in products]),
+        ('website_product', product_paths()),
+        ('website_product_prices', product_paths('/prices')),
+        ('website_product_ranks', product_paths('/ranks')),
+        ('website_product_matches', product_paths('/matches')),
+        ('website_rankings', ['/api/websites/%s/rankings?%s' % (w['website_uid'], urlencode({
+            'category': '/'.join(category), 'sorted_by': ordering})) for w in websites for category in CATEGORIES for ordering in ORDERINGS]),
+        ('websites_stats', ['/api/stats/websites']),
+        ('website_stats', ['/api/stats/websites/%s' % (w['website_uid']) for w in websites]),
+        ('product_search', ['/api/products/search?%s' % (urlencode(filters)) for filters in [
+            {'q': p['name'].split()[1]} for p in products[:10]
+            ] + [{'website': w['website_uid'], 'on_sale': 'true'} for w in websites] + [
+            {'brand': b['brand_uid'], 'min_price': 50} for b in brands[:10]
+            ]]),
+    ]
+
+
+def server_command(arguments):
+    """Command starting the API server on the seeded database"""
+    setup = 'import config; config.MONGO_DBNAME = %r; config.PORT = %s; import app; ' % (
+        config.MONGO_DBNAME, LOADTEST_SERVER_PORT)
+    if arguments['--development']:
+        return [sys.executable, '-c', setup + 'app.app.run(port=%s, use_reloader=False, threaded=True)' % (LOADTEST_SERVER_PORT)]
+    return [sys.executable, '-c', setup + 'import server; server.serve(app.app, app.app.config, workers=%s, threads=%s)' % (
+        int(arguments['--workers']), int(arguments['--threads']))]
+
+
+def summarize(latencies, errors, duration):
+    """Throughput and latency percentiles of an endpoint"""
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / duration,
+        "p50_ms": utils.calcPercentile(latencies, 50),
+        "p90_ms": utils.calcPercentile(latencies, 90),
+        "p99_ms": utils.calcPercentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else None,
+    }
+
+
+def change(value, previous):
+    """Relative change in percent"""
+    if not value or not previous:
+        return ''
+    return '%+6.1f%%' % (100.0 * (value - previous) / previous)
+
+
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    duration = float(arguments['--duration'])
+    concurrency = int(arguments['--concurrency'])
+
+    if arguments['--no-seed']:
+        config.MONGO_DBNAME = arguments['--database']
+        models.connect_database()
+    else:
+        use_database(arguments['--database'])
+        seed(
+            websites=int(arguments['--websites']),
+            brands=int(arguments['--brands']),
+            products=int(arguments['--products']),
+            crawls=int(arguments['--crawls']),
+            listings=float(arguments['--listings']),
+            seed_value=int(arguments['--seed']),
+            )
+
+    endpoints = endpoint_paths(random.Random(int(arguments['--seed'])))
+    if arguments['--endpoints']:
+        names = [name.strip() for name in arguments['--endpoints'].split(',')]
+        endpoints = [(name, paths) for name, paths in endpoints if name in names]
+
+    previous = {}
+    if arguments['--compare']:
+        with open(arguments['--compare'], 'r') as previous_file:
+            previous = json.load(previous_file)['endpoints']
+
+    results = {}
+    process = subprocess.Popen(server_command(arguments), cwd=STRIDE_PATH)
+    try:
+        wait_for_port(LOADTEST_SERVER_PORT)
+        for name, paths in endpoints:
+            latencies, errors = drive(LOADTEST_SERVER_PORT, paths, concurrency, duration)
+            result = results[name] = summarize(latencies, errors, duration)
+            before = previous.get(name, {})
+            print "%s %8.1f req/s p50: %7.2fms p90: %7.2fms p99: %7.2fms errors: %s%s" % (
+                name.ljust(24),
+                result['requests_per_second'],
+                result['p50_ms'] or 0.0,
+                result['p90_ms'] or 0.0,
+                result['p99_ms'] or 0.0,
+                result['errors'],
+                " (req/s %s p50 %s p99 %s)" % (
+                    change(result['requests_per_second'], before.get('requests_per_second')),
+                    change(result['p50_ms'], before.get('p50_ms')),
+                    change(result['p99_ms'], before.get('p99_ms')),
+                    ) if before else '',
+                )
+    finally:
+        process.terminate()
+        process.wait()
+
+    if arguments['--output']:
+        options = dict([(k.lstrip('-'), v) for k, v in arguments.items() if k not in ('--output', '--compare')])
+        with open(arguments['--output'], 'w') as output:
+            json.dump({"options": options, "endpoints": results}, output, indent=2, sort_keys=True)
+        print "Results saved to %s" % (arguments['--output'])
+
+
+if __name__ == "__main__":
+    main()
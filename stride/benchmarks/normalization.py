@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Normalization micro-benchmarks.
+
+Compares the `normalize` functions with the original uncompiled, uncached
+implementations: outputs must be identical for every input, timings are
+reported per function.
+
+Usage:
+    normalization.py [--repeat=<n>] [<dataset>...]
+
+Options:
+    --repeat=<n>    Number of passes over the inputs [default: 200]
+
+Price strings, brand names and property keys found in the dataset (.jl) files
+are added to the built-in inputs.
+"""
+import json
+import re
+import sys
+import timeit
+import unicodedata
+from docopt import docopt
+import normalize
+from normalize import CLEAN_UID_REGEXP, CLEAN_DICT_KEY_REGEXP
+
+
+# -------------------------------------------------------------------------
+# Reference implementations, as they were in `utils`
+# -------------------------------------------------------------------------
+def reference_convert_html_price_to_float(value, default=None):
+    try:
+        if isinstance(value, basestring):
+            value = ".".join([re.sub(r'[^0-9]','', n) for n in re.sub(r',', '.', re.sub(r'[^0-9.,]', '', value)).rsplit('.', 1)])
+        return float(value)
+    except:
+        return default
+
+
+def reference_cleanStringForUID(value):
+    try:
+        if not isinstance(value, unicode):
+            value = unicode(value, 'utf-8')
+        value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
+    except:
+        value = str(value)
+    return re.sub(' +', ' ', CLEAN_UID_REGEXP.sub('', value.lower().strip()))
+
+
+def reference_cleanKeyForDict(value):
+    try:
+        if not isinstance(value, unicode):
+            value = unicode(value, 'utf-8')
+        value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
+    except:
+        value = str(value)
+    return re.sub(' +', '', CLEAN_DICT_KEY_REGEXP.sub('', value.lower().strip()))
+
+
+PRICE_INPUTS = [
+    u'€ 89,95', u'€ 1.089,95', u'\n  € 59,95\n', u'129.95', u'79,-', u'EUR 49.99', u'1,234.56',
+    u'', u'gratis', u'12', 12, 12.5, None, True, '\xe2\x82\xac 39,95', u'€\xa069,95',
+]
+TEXT_INPUTS = [
+    u'Nike', u'  Adidas  Originals ', u'Björn Borg', u'Tommy Hilfiger', u'Gabor  Comfort',
+    u'Materiaal  bovenkant', u'Sluiting:', u'Hakhoogte (cm)', u'Ünïcödé ßhoe', '\xc3\xa9t\xc3\xa9',
+    '\xff\xfe invalid', u'', 42, None, u'Dr. Martens', u'Converse_All-Star',
+]
+
+# -------------------------------------------------------------------------
+# Equal values of different types, checked in both orders with empty caches
+# -------------------------------------------------------------------------
+COLLIDING_INPUTS = [1, True, 1.0, 0, False, 0.0, 'Nike', u'Nike', '12', u'12']
+
+
+def dataset_inputs(paths):
+    """Collect prices and texts from dataset files without parsing html"""
+    price_regexp = re.compile(ur'(?:€|&euro;)\s*[0-9.,]+-?')
+    text_regexp = re.compile(r'"brand"\s*:\s*"([^"]+)"|itemprop="brand"[^>]*content="([^"]+)"')
+    prices, texts = [], []
+    for path in paths:
+        with open(path) as datasrc:
+            for line in datasrc:
+                body = json.loads(line).get('body', u'')
+                prices.extend(price_regexp.findall(body))
+                texts.extend([a or b for a, b in text_regexp.findall(body)])
+    return prices, texts
+
+
+def check_identical(name, reference, optimized, inputs):
+    """Compare outputs, exit on first difference"""
+    for value in inputs:
+        expected, result = reference(value), optimized(value)
+        if type(expected) != type(result) or expected != result:
+            print "%s differs for %r: %r != %r" % (name, value, expected, result)
+            sys.exit(1)
+
+
+def measure(name, reference, optimized, inputs, repeat, batch=None):
+    """Print timing of reference and optimized function over inputs"""
+    reference_time = timeit.timeit(lambda: [reference(v) for v in inputs], number=repeat)
+    optimized_time = timeit.timeit(lambda: [optimized(v) for v in inputs], number=repeat)
+    line = "%s reference: %7.3fs normalize: %7.3fs speedup: %5.1fx" % (
+        name.ljust(28), reference_time, optimized_time, reference_time / optimized_time,
+        )
+    if batch:
+        batch_time = timeit.timeit(lambda: batch(inputs), number=repeat)
+        line = line + " batch: %7.3fs speedup: %5.1fx" % (batch_time, reference_time / batch_time)
+    print line
+
+
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    repeat = int(arguments['--repeat'])
+
+    prices, texts = dataset_inputs(arguments['<dataset>'])
+    prices = PRICE_INPUTS + prices
+    texts = TEXT_INPUTS + texts
+
+    for inputs in (COLLIDING_INPUTS, list(reversed(COLLIDING_INPUTS))):
+        for memo in (normalize._parse_price_memo, normalize.clean_string_for_uid, normalize.clean_key_for_dict):
+            memo.clear()
+        check_identical('convert_html_price_to_float',
+                        reference_convert_html_price_to_float, normalize.convert_html_price_to_float, inputs)
+        check_identical('cleanStringForUID',
+                        reference_cleanStringForUID, normalize.clean_string_for_uid, inputs)
+        check_identical('cleanKeyForDict',
+                        reference_cleanKeyForDict, normalize.clean_key_for_dict, inputs)
+
+    check_identical('convert_html_price_to_float',
+                    reference_convert_html_price_to_float, normalize.convert_html_price_to_float, prices)
+    check_identical('cleanStringForUID',
+                    reference_cleanStringForUID, normalize.clean_string_for_uid, texts)
+    check_identical('cleanKeyForDict',
+                    reference_cleanKeyForDict, normalize.clean_key_for_dict, texts)
+    if normalize.convert_html_prices(prices) != [reference_convert_html_price_to_float(p) for p in prices]:
+        print "convert_html_prices differs"
+        sys.exit(1)
+    print "outputs identical for %s prices and %s texts" % (len(prices), len(texts))
+
+    measure('convert_html_price_to_float',
+            reference_convert_html_price_to_float, normalize.convert_html_price_to_float, prices, repeat,
+            batch=normalize.convert_html_prices)
+    measure('cleanStringForUID',
+            reference_cleanStringForUID, normalize.clean_string_for_uid, texts, repeat)
+    measure('cleanKeyForDict',
+            reference_cleanKeyForDict, normalize.clean_key_for_dict, texts, repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Product search latency benchmark.
+
+Runs representative searches through the API against the configured database
+and checks the p95 latency against `SEARCH_LATENCY_TARGET_MS`. Every search is
+also explained to make sure none of them falls back to a collection scan, and
+that filtered searches examine at most `SEARCH_MAX_EXAMINED_RATIO` index keys
+per returned product and fetch no documents they don't return. Text searches
+fetch all text matches to sort them, only their latency is checked.
+
+Usage:
+    search.py [--repeat=<n>]
+
+Options:
+    --repeat=<n>    Number of requests per search [default: 50]
+"""
+import sys
+import time
+from urllib import urlencode
+from docopt import docopt
+from app import app
+import config
+import models
+import utils
+
+
+def sample_filters():
+    """Pick existing filter values from the database to search with"""
+    collection = models.Product._mongometa.collection
+    product = collection.find_one(
+        {'name': {'$exists': True}}, projection={'name': 1, 'product_type': 1, 'website': 1, 'brand': 1},
+        )
+    if not product:
+        raise SystemExit("No products found in database '%s'" % (config.MONGO_DBNAME))
+
+    website = str(product['website'])
+    brand = str(product['brand'])
+    product_type = product.get('product_type') or None
+    word = max(product['name'].split(), key=len)
+
+    # -------------------------------------------------------------------------
+    # Brand of another website, mostly a rare or empty combination
+    # -------------------------------------------------------------------------
+    other = collection.find_one({'website': {'$ne': product['website']}}, projection={'brand': 1}) or product
+    other_brand = str(other['brand'])
+
+    return [
+        {'q': word},
+        {'q': word, 'website': website},
+        {'website': website},
+        {'website': website, 'on_sale': 'true'},
+        {'website': website, 'min_price': 50, 'max_price': 100},
+        {'website': website, 'on_sale': 'true', 'min_discount': 20},
+        {'brand': brand},
+        {'brand': brand, 'min_price': 50},
+        {'product_type': product_type},
+        {'on_sale': 'true', 'min_discount': 30},
+        {'website': website, 'brand': brand},
+        {'website': website, 'brand': other_brand},
+        {'website': website, 'product_type': product_type},
+        {'brand': brand, 'product_type': product_type},
+        {'website': website, 'brand': brand, 'product_type': product_type, 'on_sale': 'true'},
+    ]
+
+
+def find_stages(plan):
+    """Collect all stage names of an explained query plan"""
+    stages = [plan.get('stage')]
+    for key in ('inputStage', 'inputStages'):
+        children = plan.get(key, [])
+        for child in children if isinstance(children, list) else [children]:
+            stages.extend(find_stages(child))
+    return stages
+
+
+def explain(filters):
+    """Explain the query of a search.
+
+    Returns list of stages of the winning plan and the execution stats
+    """
+    query = models.Product.get_search_arguments(
+        text=filters.get('q'),
+        website_id=filters.get('website'),
+        brand_id=filters.get('brand'),
+        product_type=filters.get('product_type'),
+        on_sale=filters.get('on_sale') == 'true' if 'on_sale' in filters else None,
+        min_price=filters.get('min_price'),
+        max_price=filters.get('max_price'),
+        min_discount=filters.get('min_discount'),
+        )
+    plan = models.Product._mongometa.collection.find(query).sort([('_id', 1)]).limit(10).explain()
+    return find_stages(plan['queryPlanner']['winningPlan']), plan['executionStats']
+
+
+def check_examined(filters, stats, max_ratio):
+    """Check keys and documents examined by a filtered search relative to the returned products"""
+    if filters.get('q'):
+        return True
+    returned = stats['nReturned']
+    return stats['totalKeysExamined'] <= max_ratio * max(returned, 1) and \
+        stats['totalDocsExamined'] <= returned
+
+
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    repeat = int(arguments['--repeat'])
+    target = config.SEARCH_LATENCY_TARGET_MS
+    max_ratio = config.SEARCH_MAX_EXAMINED_RATIO
+
+    client = app.test_client()
+    failed = False
+    for filters in sample_filters():
+        url = '/api/products/search?%s' % (urlencode(dict([(k, v) for k, v in filters.items() if v is not None])))
+
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            response = client.get(url)
+            timings.append((time.time() - start) * 1000.0)
+            if response.status_code != 200:
+                raise SystemExit("%s returned %s" % (url, response.status_code))
+
+        p50 = utils.calcPercentile(timings, 50)
+        p95 = utils.calcPercentile(timings, 95)
+        stages, stats = explain(filters)
+        scan = 'COLLSCAN' in stages
+        examined = check_examined(filters, stats, max_ratio)
+        status = 'ok' if p95 <= target and not scan and examined else 'FAIL'
+        failed = failed or status != 'ok'
+
+        print "[%s] p50: %7.2fms p95: %7.2fms returned: %s keys: %s docs: %s plan: %s %s" % (
+            status.rjust(4), p50, p95,
+            stats['nReturned'], stats['totalKeysExamined'], stats['totalDocsExamined'],
+            '>'.join(reversed(stages)), url,
+            )
+
+    print "target p95: %sms, examined per returned product: %s" % (target, max_ratio)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Throughput comparison of the development server and the production server.
+
+Both servers are started on the configured database and driven with the same
+requests for the same duration.
+
+Usage:
+    serving.py [--concurrency=<n>] [--duration=<seconds>] [--workers=<n>] [--threads=<n>]
+
+Options:
+    --concurrency=<n>       Number of concurrent clients [default: 16]
+    --duration=<seconds>    Seconds to drive each server [default: 20]
+    --workers=<n>           Production server worker processes [default: 4]
+    --threads=<n>           Production server threads per worker [default: 4]
+"""
+import os.path
+import sys
+import socket
+import subprocess
+import threading
+import time
+import httplib
+from docopt import docopt
+import utils
+
+
+DEV_SERVER_PORT = 5101
+PRODUCTION_SERVER_PORT = 5102
+
+REQUEST_PATHS = [
+    '/api/websites',
+    '/api/brands',
+    '/api/brands/10/50',
+]
+
+STRIDE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_port(port, timeout=30.0):
+    """Wait until server accepts connections"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1.0).close()
+            return
+        except socket.error:
+            time.sleep(0.2)
+    raise SystemExit("Server on port %s did not start" % (port))
+
+
+def drive(port, paths, concurrency, duration):
+    """Request paths round-robin from concurrent clients. Returns list of latencies in ms"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(offset):
+        connection = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+        timings = []
+        failed = 0
+        i = offset
+        while time.time() < deadline:
+            path = paths[i % len(paths)]
+            i = i + 1
+            start = time.time()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed = failed + 1
+            except (httplib.HTTPException, socket.error):
+                failed = failed + 1
+                connection.close()
+                connection = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+            timings.append((time.time() - start) * 1000.0)
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors)
+
+
+def benchmark(name, command, port, concurrency, duration):
+    """Start server, drive it and print throughput"""
+    process = subprocess.Popen(command, cwd=STRIDE_PATH)
+    try:
+        wait_for_port(port)
+        latencies, errors = drive(port, REQUEST_PATHS, concurrency, duration)
+    finally:
+        process.terminate()
+        process.wait()
+
+    print "%s: %8.1f req/s p50: %7.2fms p99: %7.2fms errors: %s" % (
+        name.ljust(12),
+        len(latencies) / float(duration),
+        utils.calcPercentile(latencies, 50),
+        utils.calcPercentile(latencies, 99),
+        errors,
+        )
+
+
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    concurrency = int(arguments['--concurrency'])
+    duration = float(arguments['--duration'])
+
+    # -------------------------------------------------------------------------
+    # Development server without reloader, the reloader would fork a child
+    # process that outlives terminate()
+    # -------------------------------------------------------------------------
+    benchmark('development', [
+        sys.executable, '-c', 'import app; app.app.run(port=%s, use_reloader=False)' % (DEV_SERVER_PORT),
+        ], DEV_SERVER_PORT, concurrency, duration)
+
+    benchmark('production', [
+        sys.executable, 'app.py', '--production', '--port=%s' % (PRODUCTION_SERVER_PORT),
+        '--workers=%s' % (arguments['--workers']), '--threads=%s' % (arguments['--threads']),
+        ], PRODUCTION_SERVER_PORT, concurrency, duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Structured data fast path benchmarks.
+
+Extracts the detail pages of datasets with and without the structured data
+fast path, including the parsing of the page. Outputs must be identical,
+the share of pages served by the fast path and the timings are reported per
+provider.
+
+Usage:
+    structured_data.py [--repeat=<n>] (<provider> <dataset>)...
+
+Options:
+    --repeat=<n>    Number of passes over the pages [default: 3]
+
+Providers: zalando, omoda, ziengs
+"""
+import json
+import sys
+import timeit
+from docopt import docopt
+from benchmarks.extraction_plans import PROVIDERS
+
+
+def detail_lines(provider):
+    """Dataset lines of detail pages"""
+    return [line for line in provider.read_file() if json.loads(line).get('page_type') == 'product_detail']
+
+
+def extract(provider, lines):
+    """Extracted data of all lines"""
+    return [provider.extract_date_line(line)['extracted_data'] for line in lines]
+
+
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    repeat = int(arguments['--repeat'])
+
+    for name, path in zip(arguments['<provider>'], arguments['<dataset>']):
+        if name not in PROVIDERS:
+            print "Unknown provider: %s" % (name)
+            sys.exit(1)
+        fast = PROVIDERS[name](path)
+        full = PROVIDERS[name](path)
+        full.structured_fast_path = False
+
+        lines = detail_lines(fast)
+        if not lines:
+            continue
+        if extract(fast, lines) != extract(full, lines):
+            print "%s: outputs differ" % (name)
+            sys.exit(1)
+        served = len([line for line in lines if fast.extract_date_line(line)['htmlx'] is None])
+
+        full_time = timeit.timeit(lambda: extract(full, lines), number=repeat)
+        fast_time = timeit.timeit(lambda: extract(fast, lines), number=repeat)
+        print "%s pages: %5s fast path: %5.1f%% full document: %7.1f lines/s fast path: %7.1f lines/s speedup: %5.1fx" % (
+            name.ljust(8),
+            len(lines),
+            100.0 * served / len(lines),
+            len(lines) * repeat / full_time,
+            len(lines) * repeat / fast_time,
+            full_time / fast_time,
+            )
+
+
+if __name__ == "__main__":
+    main()
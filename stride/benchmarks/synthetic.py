@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""Synthetic crawl generator.
+
+Writes dataset (.jl) files with detail and listing pages of a generated
+product catalogue, in the DOM structures the providers select on: site
+header, navigation and footer, scripts, sale prices, missing optional
+elements, listing pages linking to the detail pages. Output is
+deterministic for a seed.
+
+Usage:
+    synthetic.py [--products=<n>] [--listing-size=<n>] [--seed=<n>] [--output=<dir>] [<provider>...]
+
+Options:
+    --products=<n>       Number of products per provider [default: 200]
+    --listing-size=<n>   Number of products per listing page [default: 24]
+    --seed=<n>           Random seed [default: 1]
+    --output=<dir>       Directory to write crawl_<provider>.synthetic.jl files to [default: ../dataset]
+
+Providers: zalando, omoda, ziengs (default all)
+"""
+import json
+import os.path
+import random
+import sys
+from cgi import escape
+from docopt import docopt
+
+
+CRAWLED_AT = '2016-05-30T23:15:20'
+
+BRANDS = [u'Nike', u'Gabor', u'Dr. Martens', u'Converse', u'Van Bommel', u'Tommy Hilfiger', u'Björn Borg', u'Ecco']
+TYPES = [u'Sneakers', u'Pumps', u'Laarzen', u'Sandalen', u'Veterschoenen', u'Instappers']
+COLORS = [u'Zwart', u'Wit', u'Rood', u'Blauw', u'Cognac', u'Grijs', u'Taupe', u'Groen']
+MATERIALS = [u'Leer', u'Suède', u'Textiel', u'Synthetisch', u'Nubuck']
+CATEGORIES = [[u'Schoenen', u'Dames'], [u'Schoenen', u'Heren'], [u'Schoenen', u'Kinderen', u'Sale']]
+ORDERINGS = [u'popular', u'price_asc', u'price_desc', u'new']
+
+PROVIDERS = ['zalando', 'omoda', 'ziengs']
+
+
+# -------------------------------------------------------------------------
+# Catalogue
+# -------------------------------------------------------------------------
+def catalogue(rng, provider, products):
+    """Generate products, every product has one or more colors"""
+    items = []
+    for i in range(products):
+        brand = rng.choice(BRANDS)
+        article_type = rng.choice(TYPES)
+        price = rng.randint(30, 180) + rng.choice([0.0, 0.5, 0.95, 0.99])
+        on_sale = rng.random() < 0.3
+        items.append({
+            "index": i,
+            "sku": "%s%06d" % (provider[:2].upper(), i),
+            "brand": brand,
+            "type": article_type,
+            "name": u"%s %s %s" % (brand, article_type, i),
+            "slug": "%s-%s-%s" % (brand.lower().replace(' ', '-').replace('.', ''), article_type.lower(), i),
+            "price": price,
+            "old_price": round(price * rng.choice([1.2, 1.3, 1.5]), 2) if on_sale else None,
+            "colors": rng.sample(COLORS, rng.randint(1, 5)),
+            "material": rng.choice(MATERIALS),
+        })
+    return items
+
+
+def html_price(value):
+    """Format price like the shops do: € 59,95"""
+    return (u"€ %.2f" % (value)).replace('.', ',')
+
+
+def page(rng, site, head, content):
+    """Wrap content in a shop page with header, navigation and footer"""
+    nav = u''.join([
+        u'<li class="nav-item"><a href="/%s/%s/">%s</a><ul class="sub">%s</ul></li>' % (
+            category[1].lower(), t.lower(), t,
+            u''.join([u'<li><a href="/%s/%s/%s/">%s</a></li>' % (category[1].lower(), t.lower(), b.lower(), escape(b)) for b in BRANDS]),
+            )
+        for category in CATEGORIES for t in TYPES
+    ])
+    footer = u''.join([u'<div class="footer-col"><h4>%s</h4><p>%s</p></div>' % (t, u' '.join([rng.choice(MATERIALS) for _ in range(40)])) for t in TYPES])
+    return (
+        u'<!DOCTYPE html><html lang="nl"><head><meta charset="utf-8"><title>%s</title>'
+        u'<link rel="stylesheet" href="/static/%s.css"><script>window.dataLayer = [{"page": "%s"}];</script>%s</head>'
+        u'<body><!-- header --><header id="header"><a class="logo" href="/">%s</a><form class="search"><input name="q" type="text"></form>'
+        u'<nav><ul class="nav">%s</ul></nav></header><main>%s</main><footer>%s</footer>'
+        u'<script src="/static/%s.js"></script><script>var tracking = {"id": %s};</script></body></html>'
+    ) % (site, site, site, head, site, nav, content, footer, site, rng.randint(1, 10 ** 6))
+
+
+# -------------------------------------------------------------------------
+# Zalando
+# -------------------------------------------------------------------------
+def zalando_detail(rng, product):
+    url = u'https://www.zalando.nl/%s.html' % (product['slug'])
+    structured_data = json.dumps({"@type": "Product", "sku": product['sku'], "name": product['name'], "brand": product['brand']})
+    head = u'<meta name="twitter:data1" content="%s"><script type="application/ld+json">%s</script>' % (
+        html_price(product['price']), structured_data)
+    old = u'<span id="articleOldPrice">%s</span>' % (html_price(product['old_price'])) if product['old_price'] else u''
+    properties = [
+        u'Materiaal bovenkant: %s' % (product['material']),
+        u'Kleur:\n %s' % (u', '.join(product['colors'])),
+        u'Artikelnummer: %s' % (product['sku']),
+        u'Pasvorm: Valt normaal',
+    ]
+    content = u'<div class="article"><h1>%s</h1><div class="price">%s %s</div><div id="productDetails">' \
+        u'<div class="content"><ul>%s</ul></div><div class="content care"><ul><li>Onderhoud: Niet wassen</li></ul></div></div></div>' % (
+            escape(product['name']), html_price(product['price']), old,
+            u''.join([u'<li>%s</li>' % (escape(p)) for p in properties]))
+    return url, page(rng, 'zalando', head, content)
+
+
+def zalando_listing(rng, products, page_number):
+    items = []
+    for product in products:
+        old = u'<div class="catalogArticlesList_price-old">%s</div>' % (html_price(product['old_price'])) if product['old_price'] else u''
+        special = u'<div class="specialPrice">%s</div>' % (html_price(product['price'])) if product['old_price'] else u''
+        items.append(
+            u'<li class="catalogArticlesList_item" data-sku="%s"><div class="catalogArticlesList_content">'
+            u'<a class="catalogArticlesList_productBox" href="/%s.html"><img src="/img/%s.jpg">'
+            u'<div class="catalogArticlesList_brandName">%s</div><div class="catalogArticlesList_articleName">%s</div>'
+            u'<div class="catalogArticlesList_priceBox"><div class="catalogArticlesList_price">%s</div>%s%s</div>'
+            u'<span class="sku">%s</span></a></div></li>' % (
+                product['sku'], product['slug'], product['sku'], escape(product['brand']), escape(product['name']),
+                html_price(product['old_price'] or product['price']), old, special, product['sku']))
+    content = u'<div class="catalog"><ul class="catalogArticlesList">%s</ul><div class="pager">%s</div></div>' % (
+        u''.join(items), page_number)
+    return page(rng, 'zalando', u'', content)
+
+
+# -------------------------------------------------------------------------
+# Omoda
+# -------------------------------------------------------------------------
+def omoda_detail(rng, product):
+    url = u'https://www.omoda.nl/%s/' % (product['slug'])
+    old = u'<del>%s</del>' % (html_price(product['old_price'])) if product['old_price'] else u''
+    rows = [
+        (u'Categorie', None, product['type'], None),
+        (u'Materiaal', u'material', product['material'], None),
+        (u'Kleur', u'color', product['colors'][0].lower(), product['colors'][0]),
+        (u'Hakhoogte', None, u'%s cm' % (rng.randint(0, 9)), None),
+        (u'Voering', None, u'', None),
+    ]
+    content = u'<div class="artikel"><meta itemprop="sku" content="%s"><h1 itemprop="name">%s</h1><h2 itemprop="brand">%s</h2>' \
+        u'<div id="artikel-prijs"><meta itemprop="price" content="%.2f">%s<span>%s</span></div>' \
+        u'<div class="productspecificatie"><table class="detail-kenmerken"><tbody>%s</tbody></table></div></div>' % (
+            product['sku'], escape(product['name']), escape(product['brand']), product['price'], old, html_price(product['price']),
+            u''.join([
+                u'<tr><th>%s</th><td%s%s>%s</td></tr>' % (
+                    title,
+                    u' itemprop="%s"' % (itemprop) if itemprop else u'',
+                    u' content="%s"' % (escape(value, True)) if value else u'',
+                    escape(text))
+                for title, itemprop, text, value in rows
+            ]))
+    return url, page(rng, 'omoda', u'', content)
+
+
+def omoda_listing(rng, products, page_number):
+    items = []
+    for position, product in enumerate(products, start=1):
+        google_data = json.dumps({"id": product['sku'], "name": product['name'], "brand": product['brand'], "price": "%.2f" % (product['price'])})
+        if product['old_price']:
+            prijs = u'<span class="prijs"><del>%s</del><ins>%s</ins></span>' % (html_price(product['old_price']), html_price(product['price']))
+        else:
+            prijs = u'<span class="prijs">%s</span>' % (html_price(product['price']))
+        badge = u'<span class="badge"><span class="badge-label">Sale</span></span>' if product['old_price'] else u''
+        items.append(
+            u'<li class="artikel" data-artikel="%s" data-position="%s"><div class="product">'
+            u'<a href="https://www.omoda.nl/%s/" data-google="%s"><img src="/img/%s.jpg"><strong class="merk">%s</strong>'
+            u'<em class="soort">%s</em>%s</a></div>%s</li>' % (
+                product['sku'], position, product['slug'], escape(google_data, True), product['sku'],
+                escape(product['brand']), product['type'], prijs, badge))
+    content = u'<div class="overzicht"><ul id="products">%s</ul><div class="paginering">%s</div></div>' % (
+        u''.join(items), page_number)
+    return page(rng, 'omoda', u'', content)
+
+
+# -------------------------------------------------------------------------
+# Ziengs, every color of a product has its own detail page
+# -------------------------------------------------------------------------
+def ziengs_color_id(product, color):
+    return '%s%s' % (product['index'], COLORS.index(color))
+
+
+def ziengs_detail(rng, product, color):
+    url = u'https://www.ziengs.nl/%s-%s.html' % (product['slug'], color.lower())
+    head = u'<meta itemprop="category" content="Schoenen"><meta itemprop="brand" content="%s"><meta itemprop="price" content="%s">' % (
+        escape(product['brand'], True), (u'%.2f' % (product['price'])).replace('.', ','))
+    properties = [(u'Materiaal', u' %s ' % (product['material'])), (u'Categorie', product['type']), (u'Kleur', color)]
+    content = u'<input id="hdnProductId" type="hidden" value="%s%s"><h1 itemprop="name">%s</h1>' \
+        u'<div id="detailBottom"><div class="omschrijving"><h3>Omschrijving</h3><p>%s</p></div>' \
+        u'<div class="kenmerken"><h3>Extra kenmerken</h3><dl>%s</dl></div></div>' % (
+            product['sku'], ziengs_color_id(product, color), escape(product['name']),
+            u' '.join([rng.choice(MATERIALS) for _ in range(30)]),
+            u''.join([u'<dt>%s</dt>\n<dd>%s</dd>' % (title, escape(value)) for title, value in properties]))
+    return url, page(rng, 'ziengs', head, content)
+
+
+def ziengs_listing(rng, products, page_number):
+    items = []
+    for product in products:
+        colors = product['colors']
+        uls = u''.join([
+            u'<ul data-colorid="%s"><li><a href="../../%s-%s.html" title="%s"><img src="/img/%s.jpg"></a></li></ul>' % (
+                ziengs_color_id(product, color), product['slug'], color.lower(), color, ziengs_color_id(product, color))
+            for color in colors
+        ])
+        divs = u''.join([
+            u'<div data-colorid="%s"><a class="title">%s</a><span class="price">%s</span></div>' % (
+                ziengs_color_id(product, color), escape(product['name']), html_price(product['price']))
+            for color in colors
+        ])
+        offer = u'<span class="offerText">%s</span>' % (html_price(product['old_price'])) if product['old_price'] else u''
+        items.append(u'<div class="%s"><div class="colorDivItem">%s</div><div class="content">%s%s</div></div>' % (
+            'item vanvoor' if product['old_price'] else 'item', uls, divs, offer))
+    content = u'<div class="productList">%s</div><div class="paging">%s</div>' % (u''.join(items), page_number)
+    return page(rng, 'ziengs', u'', content)
+
+
+# -------------------------------------------------------------------------
+# Dataset
+# -------------------------------------------------------------------------
+def detail_pages(rng, provider, product):
+    """(url, body) of the detail pages of a product"""
+    if provider == 'zalando':
+        return [zalando_detail(rng, product)]
+    elif provider == 'omoda':
+        return [omoda_detail(rng, product)]
+    return [ziengs_detail(rng, product, color) for color in product['colors']]
+
+
+def listing_page(rng, provider, products, page_number):
+    if provider == 'zalando':
+        return zalando_listing(rng, products, page_number)
+    elif provider == 'omoda':
+        return omoda_listing(rng, products, page_number)
+    return ziengs_listing(rng, products, page_number)
+
+
+def generate(provider, products=200, listing_size=24, seed=1):
+    """Generate dataset lines of a provider.
+
+    Detail pages of all products and listing pages of every category, in crawl
+    order: shuffled like a crawler visits them.
+    """
+    rng = random.Random('%s-%s' % (provider, seed))
+    items = catalogue(rng, provider, products)
+    entries = []
+
+    for product in items:
+        for url, body in detail_pages(rng, provider, product):
+            entries.append({
+                "page_type": "product_detail",
+                "page_url": url,
+                "crawled_at": CRAWLED_AT,
+                "body": body,
+            })
+
+    for category in CATEGORIES:
+        ordering = rng.choice(ORDERINGS)
+        listed = rng.sample(items, len(items) // len(CATEGORIES) or len(items))
+        for page_number, start in enumerate(range(0, len(listed), listing_size), start=1):
+            entries.append({
+                "page_type": "product_listing",
+                "page_url": u'https://www.%s.nl/%s/?p=%s&sort=%s' % (provider, u'/'.join(category).lower(), page_number, ordering),
+                "page_number": page_number,
+                "product_category": category,
+                "ordering": ordering,
+                "crawled_at": CRAWLED_AT,
+                "body": listing_page(rng, provider, listed[start:start + listing_size], page_number),
+            })
+
+    rng.shuffle(entries)
+    for entry in entries:
+        yield json.dumps(entry, sort_keys=True)
+
+
+def write_dataset(path, provider, products=200, listing_size=24, seed=1):
+    """Write generated dataset to path. Returns number of lines"""
+    lines = 0
+    with open(path, 'w') as dataset:
+        for line in generate(provider, products=products, listing_size=listing_size, seed=seed):
+            dataset.write(line + '\n')
+            lines = lines + 1
+    return lines
+
+
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    providers = arguments['<provider>'] or PROVIDERS
+
+    for provider in providers:
+        if provider not in PROVIDERS:
+            print "Unknown provider: %s" % (provider)
+            sys.exit(1)
+        path = os.path.join(arguments['--output'], 'crawl_%s.synthetic.jl' % (provider))
+        lines = write_dataset(path, provider,
+            products=int(arguments['--products']),
+            listing_size=int(arguments['--listing-size']),
+            seed=int(arguments['--seed']),
+            )
+        print "%s: %s lines written to %s" % (provider.ljust(8), lines, path)
+
+
+if __name__ == "__main__":
+    main()
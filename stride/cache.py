@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+
+class ResolverCache(object):
+    """Per-process TTL cache for resolved lookup values.
+
+    Entries are bound to a generation; when `generation_loader` reports a new
+    generation all entries are dropped. The generation is polled at most every
+    `generation_poll_interval` seconds. Misses are cached as `None` with the
+    shorter `negative_ttl`.
+    """
+
+    def __init__(self, ttl, negative_ttl, generation_loader=None, generation_poll_interval=5.0,
+                 max_entries=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.generation_loader = generation_loader
+        self.generation_poll_interval = generation_poll_interval
+        self.max_entries = max_entries
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked_at = 0.0
+
+    def check_generation(self, now):
+        """Drop all entries if generation changed since last poll"""
+        if not self.generation_loader or now - self._generation_checked_at < self.generation_poll_interval:
+            return
+
+        self._generation_checked_at = now
+        generation = self.generation_loader()
+        if generation != self._generation:
+            with self._lock:
+                self._entries.clear()
+                self._generation = generation
+
+    def get(self, key, loader):
+        """Get cached value of key or load it with `loader()`"""
+        now = time.time()
+        self.check_generation(now)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        value = loader()
+        expires_at = now + (self.ttl if value is not None else self.negative_ttl)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (value, expires_at)
+        return value
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
@@ -11,17 +11,94 @@ MONGO_DBNAME = 'shoecase'
 # -------------------------------------------------------------------------
 DEBUG = True
 
+# -------------------------------------------------------------------------
+# Response Encoding. Compact JSON, gzip responses from min size (bytes)
+# -------------------------------------------------------------------------
+JSONIFY_PRETTYPRINT_REGULAR = False
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+RESPONSE_COMPRESSION_LEVEL = 6
+
 # -------------------------------------------------------------------------
 # Application HTTP Server
 # -------------------------------------------------------------------------
 HOST = '0.0.0.0'
 PORT = 5000
 
+# -------------------------------------------------------------------------
+# Production Server (app.py --production)
+# -------------------------------------------------------------------------
+SERVER_WORKERS = 4
+SERVER_THREADS = 4
+SERVER_KEEPALIVE = 5
+SERVER_GRACEFUL_TIMEOUT = 30
+
+# -------------------------------------------------------------------------
+# Metrics of the production server workers are merged through files in
+# this directory, a temporary directory if not set. Workers write their
+# file at most every flush interval (seconds)
+# -------------------------------------------------------------------------
+METRICS_MULTIPROCESS_DIR = None
+METRICS_FLUSH_INTERVAL = 1.0
+
+# -------------------------------------------------------------------------
+# Website/Brand uid lookup cache (seconds)
+# -------------------------------------------------------------------------
+RESOLVER_CACHE_TTL = 300
+RESOLVER_NEGATIVE_CACHE_TTL = 10
+RESOLVER_GENERATION_POLL_INTERVAL = 5
+
+# -------------------------------------------------------------------------
+# Search latency target (p95 in milliseconds) checked by benchmarks.search
+# -------------------------------------------------------------------------
+SEARCH_LATENCY_TARGET_MS = 50
+
+# -------------------------------------------------------------------------
+# Index keys and documents a filtered search may examine per returned
+# product (at least one), checked by benchmarks.search
+# -------------------------------------------------------------------------
+SEARCH_MAX_EXAMINED_RATIO = 10
+
 # -------------------------------------------------------------------------
 # Set Server Name if needed
 # -------------------------------------------------------------------------
 # SERVER_NAME = '%s:%s' % (HOST, PORT)
 
+# -------------------------------------------------------------------------
+# Logging. Queued: log files are written from a background thread.
+# Rate limit: (burst, seconds) of log records with the same message
+# -------------------------------------------------------------------------
+LOG_QUEUED = True
+LOG_QUEUE_SIZE = 10000
+LOG_STRUCTURED = False
+LOG_RATE_LIMIT = (20, 60)
+
+# -------------------------------------------------------------------------
+# Dead-letter store of failed import entries, per provider directory.
+# Failures are written per batch, new failures are dropped above max bytes
+# -------------------------------------------------------------------------
+DEADLETTER_DIR = '../tmp/deadletter'
+DEADLETTER_BATCH_SIZE = 100
+DEADLETTER_MAX_BYTES = 512 * 1024 * 1024
+
+# -------------------------------------------------------------------------
+# Import profile reports: stage timings and slowest lines per provider and
+# pass. Stacks are sampled every interval (CPU seconds) with `--sample`
+# -------------------------------------------------------------------------
+IMPORT_PROFILE_DIR = '../tmp/profiles'
+IMPORT_PROFILE_SLOWEST = 10
+IMPORT_PROFILE_SAMPLE_INTERVAL = 0.005
+
+# -------------------------------------------------------------------------
+# Import memory watermark, checked every interval of lines. Above the
+# watermark buffered dead letters are flushed, the dead-letter batch is
+# halved and cyclic garbage is collected before the next line. `None`
+# disables the check. Once crossed, it acts again after RSS grew by the
+# margin, the batch is restored below the watermark
+# -------------------------------------------------------------------------
+IMPORT_RSS_WATERMARK_MB = 1024
+IMPORT_RSS_CHECK_INTERVAL = 50
+IMPORT_RSS_WATERMARK_MARGIN_MB = 128
+
 # -------------------------------------------------------------------------
 # Dataset Configuration
 # -------------------------------------------------------------------------
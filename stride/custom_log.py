@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
+import atexit
+import json
 import logging
 import os.path
+import threading
+import time
 from datetime import datetime
+from Queue import Queue, Full
 import warnings
+import config
 
 
 class MyFormatter(logging.Formatter):
@@ -19,8 +25,170 @@ class MyFormatter(logging.Formatter):
         return s
 
 
-def prepare_logger(name, filename, log_dir='../logs'):
-    """Generate Logger"""
+# -------------------------------------------------------------------------
+# Attributes of every LogRecord, all other attributes are `extra` fields
+# -------------------------------------------------------------------------
+RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__.keys()) | set(['message', 'asctime'])
+
+
+class StructuredFormatter(MyFormatter):
+    """Log Formatter writing records as JSON lines, including `extra` fields"""
+
+    def __init__(self, source):
+        super(StructuredFormatter, self).__init__()
+        self.source = source
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "source": self.source,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=unicode)
+
+
+class RateLimitFilter(logging.Filter):
+    """Allow at most `burst` records with the same message template per `interval` seconds.
+
+    The number of suppressed records is added to the first record of the next interval.
+    """
+
+    def __init__(self, burst, interval):
+        super(RateLimitFilter, self).__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, basestring) else type(record.msg))
+        now = time.time()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                    record.msg = "%s [%s similar messages suppressed]" % (record.msg, suppressed)
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class QueueHandler(logging.Handler):
+    """Handler putting records on a queue for the `QueueListener` thread.
+
+    Records are queued unformatted, message formatting happens in the listener.
+    When the queue is full records are dropped instead of blocking.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class QueueListener(object):
+    """Background thread passing queued records to the handlers"""
+    _sentinel = None
+
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name='log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Flush queued records and stop thread"""
+        if self._thread is not None:
+            self.queue.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+        for handler in self.handlers:
+            handler.flush()
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        handler.handleError(record)
+
+
+def queued_loggers():
+    """Loggers writing from a `QueueListener` thread"""
+    loggers = logging.Logger.manager.loggerDict.values()
+    return [logger for logger in loggers if getattr(logger, 'log_listener', None) is not None]
+
+
+def restart_listeners():
+    """Restart the listener threads of queued loggers in a forked process.
+
+    Threads don't survive a fork, and the inherited queue and handler locks
+    can be held by the listener thread of the parent. The child gets a new
+    queue, new handler locks and a new listener thread. Forked processes that
+    exit without running `atexit` must call `stop_listeners` before exiting.
+    """
+    for logger in queued_loggers():
+        listener = logger.log_listener
+        queue = Queue(maxsize=listener.queue.maxsize)
+        for handler in logger.handlers + listener.handlers:
+            handler.createLock()
+            if isinstance(handler, QueueHandler):
+                handler.queue = queue
+        listener.queue = queue
+        listener._thread = None
+        listener.start()
+
+
+def stop_listeners():
+    """Flush queued records and stop the listener threads"""
+    for logger in queued_loggers():
+        logger.log_listener.stop()
+
+
+def prepare_logger(name, filename, log_dir='../logs', queued=None, structured=None, rate_limit=None):
+    """Generate Logger
+
+    params:
+        - queued: write log files from a background thread, defaults to `LOG_QUEUED` in config
+        - structured: write JSON lines, defaults to `LOG_STRUCTURED` in config
+        - rate_limit: (burst, interval) of records with the same message, defaults to
+          `LOG_RATE_LIMIT` in config. `None` disables rate limiting
+    """
+    if queued is None:
+        queued = getattr(config, 'LOG_QUEUED', False)
+    if structured is None:
+        structured = getattr(config, 'LOG_STRUCTURED', False)
+    if rate_limit is None:
+        rate_limit = getattr(config, 'LOG_RATE_LIMIT', None)
+
     if not os.path.isdir(log_dir):
         warnings.warn("No Log Dir: '%s' found" % (log_dir), Warning)
         log_dir = '/tmp/'
@@ -28,9 +196,12 @@ def prepare_logger(name, filename, log_dir='../logs'):
     logger = logging.getLogger(name)
 
     base_name = os.path.basename(filename)
-    log_formatter = MyFormatter(fmt='%%(asctime)s - "%s" - %%(levelname)s - %%(message)s' % (
-        base_name,
-        ))
+    if structured:
+        log_formatter = StructuredFormatter(base_name)
+    else:
+        log_formatter = MyFormatter(fmt='%%(asctime)s - "%s" - %%(levelname)s - %%(message)s' % (
+            base_name,
+            ))
 
     # -------------------------------------------------------------------------
     # Access Logging
@@ -38,7 +209,6 @@ def prepare_logger(name, filename, log_dir='../logs'):
     logger.setLevel(logging.INFO)
     fh = logging.FileHandler(os.path.join(log_dir, '%s.info.log' % (base_name)))
     fh.setFormatter(log_formatter)
-    logger.addHandler(fh)
 
     # -------------------------------------------------------------------------
     # Error Logging
@@ -46,6 +216,22 @@ def prepare_logger(name, filename, log_dir='../logs'):
     efh = logging.FileHandler(os.path.join(log_dir, '%s.err.log' % (base_name)))
     efh.setFormatter(log_formatter)
     efh.setLevel(logging.ERROR)
-    logger.addHandler(efh)
+
+    if queued:
+        # -------------------------------------------------------------------------
+        # File handlers run in the listener thread, flushed at exit
+        # -------------------------------------------------------------------------
+        queue = Queue(maxsize=getattr(config, 'LOG_QUEUE_SIZE', 10000))
+        listener = QueueListener(queue, [fh, efh])
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(QueueHandler(queue))
+        logger.log_listener = listener
+    else:
+        logger.addHandler(fh)
+        logger.addHandler(efh)
+
+    if rate_limit:
+        logger.addFilter(RateLimitFilter(*rate_limit))
 
     return logger
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Dead-letter store of failed dataset entries.
+
+Every provider has a directory with two append-only files, records of
+replayed lines are removed with `resolve`:
+    - records.jl: a JSON line per failure with the error, provider, dataset
+      path, line offset, extractor version and the sha1 of the page body
+    - bodies.jl.gz: a JSON line per distinct page body, gzip compressed
+
+Bodies are stored once per sha1, listing pages failing for several items
+share one body. Failures are buffered and written per batch, every batch of
+bodies is appended as a new gzip member. Once the files reach the size cap
+new failures are counted as dropped instead of written.
+"""
+import gzip
+import hashlib
+import json
+import os.path
+from datetime import datetime
+import config
+
+
+RECORDS_FILENAME = 'records.jl'
+BODIES_FILENAME = 'bodies.jl.gz'
+
+
+class DeadLetterStore(object):
+    """Dead-letter store of a provider.
+
+    params:
+        - provider: provider instance the entries are read by
+        - directory: root directory of the stores, defaults to `DEADLETTER_DIR` in config
+        - batch_size: failures buffered before writing, defaults to `DEADLETTER_BATCH_SIZE` in config
+        - max_bytes: size cap of the store files, defaults to `DEADLETTER_MAX_BYTES` in config.
+          The cap can be exceeded by at most one batch
+    """
+
+    def __init__(self, provider, directory=None, batch_size=None, max_bytes=None):
+        if directory is None:
+            directory = getattr(config, 'DEADLETTER_DIR', '../tmp/deadletter')
+        if batch_size is None:
+            batch_size = getattr(config, 'DEADLETTER_BATCH_SIZE', 100)
+        if max_bytes is None:
+            max_bytes = getattr(config, 'DEADLETTER_MAX_BYTES', 512 * 1024 * 1024)
+
+        self.provider = provider
+        self.directory = os.path.abspath(os.path.join(directory, provider.get_provider_uid()))
+        self.records_path = os.path.join(self.directory, RECORDS_FILENAME)
+        self.bodies_path = os.path.join(self.directory, BODIES_FILENAME)
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+
+        self.written = 0
+        self.dropped = 0
+        self._records = []
+        self._bodies = []
+        self._hashes = set([record['body_sha1'] for record in self.records() if record.get('body_sha1')])
+        self._size = self._file_sizes()
+
+    def _file_sizes(self):
+        return sum([os.path.getsize(path) for path in (self.records_path, self.bodies_path) if os.path.isfile(path)])
+
+    def add(self, entry, error, key=None):
+        """Add failed entry.
+
+        params:
+            - entry: dataset entry as read by the provider
+            - error: exception or message of the failure
+            - key: identifies the failing part of the entry, e.g. the listing item
+
+        Returns `False` when the store is full and the failure is dropped.
+        """
+        if self._size >= self.max_bytes:
+            self.dropped = self.dropped + 1
+            return False
+
+        body = entry.get('body')
+        body_sha1 = None
+        if body is not None:
+            body_sha1 = hashlib.sha1(body.encode('utf-8')).hexdigest()
+            if body_sha1 not in self._hashes:
+                self._hashes.add(body_sha1)
+                self._bodies.append({"sha1": body_sha1, "body": body})
+
+        if isinstance(error, Exception):
+            error = "%s: %s" % (type(error).__name__, error)
+
+        self._records.append({
+            "time": datetime.utcnow().isoformat(),
+            "provider": self.provider.get_provider_uid(),
+            "extractor_version": self.provider.extractor_version,
+            "source": self.provider.source_file_path,
+            "line_offset": entry.get('_line_offset'),
+            "page_type": entry.get('page_type'),
+            "page_url": entry.get('page_url'),
+            "key": key,
+            "error": error,
+            "body_sha1": body_sha1,
+        })
+
+        if len(self._records) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Append buffered failures to the store files"""
+        if not self._records:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        if self._bodies:
+            bodies = gzip.open(self.bodies_path, 'ab')
+            try:
+                for body in self._bodies:
+                    bodies.write(json.dumps(body) + '\n')
+            finally:
+                bodies.close()
+
+        with open(self.records_path, 'ab') as records:
+            for record in self._records:
+                records.write(json.dumps(record, default=unicode) + '\n')
+
+        self.written = self.written + len(self._records)
+        self._records = []
+        self._bodies = []
+        self._size = self._file_sizes()
+
+    def close(self):
+        """Flush buffered failures"""
+        self.flush()
+
+    def resolve(self, offsets, before):
+        """Remove records of the lines at `offsets` of the provider dataset written before `before` (ISO time).
+
+        Used after replaying the lines, the records file is rewritten without
+        them; bodies are kept. Records of other dataset files of the provider
+        are kept.
+        """
+        self.flush()
+        offsets = set(offsets)
+        source = self.provider.source_file_path
+        kept = [
+            record for record in self.records()
+            if record.get('source') != source or record.get('line_offset') not in offsets or record.get('time') >= before
+        ]
+        if not os.path.isdir(self.directory):
+            return
+        partial_path = self.records_path + '.partial'
+        with open(partial_path, 'wb') as records:
+            for record in kept:
+                records.write(json.dumps(record, default=unicode) + '\n')
+        os.rename(partial_path, self.records_path)
+        self._size = self._file_sizes()
+
+    def records(self):
+        """Iterate over stored failure records"""
+        if not os.path.isfile(self.records_path):
+            return
+        with open(self.records_path, 'rb') as records:
+            for line in records:
+                yield json.loads(line)
+
+    def bodies(self, sha1s=None):
+        """Iterate over stored (sha1, body) pairs, optionally limited to `sha1s`"""
+        if not os.path.isfile(self.bodies_path):
+            return
+        bodies = gzip.open(self.bodies_path, 'rb')
+        try:
+            for line in bodies:
+                body = json.loads(line)
+                if sha1s is None or body['sha1'] in sha1s:
+                    yield body['sha1'], body['body']
+        finally:
+            bodies.close()
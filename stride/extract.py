@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Extract Datasets without a database.
+
+Runs the providers over the datasets and writes the normalized products and
+listing pages as JSON lines, the records the importer stores. Never imports
+`models`, so no Mongo connection is needed.
+
+Records are written in the order of the websites, their dataset files and
+the lines of each file, also with several workers. Output files ending with
+`.gz` are gzip compressed.
+
+Usage:
+    extract.py [--output=<file>] [--workers=<n>] [--chunk-size=<n>] [<website>...]
+
+Arguments:
+    <website>           Website to extract, optionally with the files or globs of its datasets
+                        as `website:path[,path...]`. Defaults to all websites with the
+                        dataset paths in config
+
+Options:
+    --output=<file>     Output file, `-` writes to stdout [default: -]
+    --workers=<n>       Number of processes extracting lines, 1 extracts in this process [default: 1]
+    --chunk-size=<n>    Number of lines sent to a worker at once [default: 20]
+
+Websites: ziengs, omoda, zalando
+"""
+import glob
+import gzip
+import json
+import sys
+import traceback
+from collections import namedtuple, OrderedDict
+from itertools import imap
+from multiprocessing import Pool
+from docopt import docopt
+import utils
+from providers.zalando.zalando import ZalandoProvider
+from providers.omoda.omoda import OmodaProvider
+from providers.ziengs.ziengs import ZiengsProvider
+from config import (ZIENGS_PROVIDER_DATASETS_FILEPATH,
+                    OMODA_PROVIDER_DATASETS_FILEPATH,
+                    ZALANDO_PROVIDER_DATASETS_FILEPATH,)
+
+
+Dataset = namedtuple('Dataset', 'provider website data_source_path')
+
+
+datasets = [
+    Dataset(ZiengsProvider, 'ziengs', ZIENGS_PROVIDER_DATASETS_FILEPATH),
+    Dataset(OmodaProvider, 'omoda', OMODA_PROVIDER_DATASETS_FILEPATH),
+    Dataset(ZalandoProvider, 'zalando', ZALANDO_PROVIDER_DATASETS_FILEPATH,),
+]
+
+
+def parse_datasets(specs):
+    """Datasets of `website[:path[,path...]]` specs, paths can be globs.
+
+    A website without paths uses its dataset path in config, no specs select
+    all websites. Raises `ValueError` for unknown websites and paths matching
+    no files.
+    """
+    providers = OrderedDict([(dataset.website, dataset) for dataset in datasets])
+    selected = []
+    for spec in specs or providers.keys():
+        website_name, _, paths = spec.partition(':')
+        if website_name not in providers:
+            raise ValueError("Unknown website: %s" % (website_name))
+        if not paths:
+            selected.append(providers[website_name])
+            continue
+        for pattern in paths.split(','):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise ValueError("No datasets found for %s: %s" % (website_name, pattern))
+            selected.extend([Dataset(providers[website_name].provider, website_name, path) for path in matches])
+    return selected
+
+
+# -------------------------------------------------------------------------
+# Normalized records, shared with the importer
+# -------------------------------------------------------------------------
+def product_props(entry):
+    """Product of an extracted detail page entry.
+
+    The brand is the brand name and `crawled_at` the time string of the dataset.
+    """
+    item = entry['extracted_data']['item']
+    return {
+        "brand": item['brand_name'],
+        "crawled_at": entry['crawled_at'],
+        "discount_percentage": item['discount_percentage'],
+        "name": item['article_name'],
+        "on_sale": item['on_sale'],
+        "price": item['sale_price'],
+        "product_type": item['article_type'],
+        "properties": item['extra_props'],
+        "sku": item['sku'],
+        "url": entry['page_url'],
+    }
+
+
+def listing_page_props(entry):
+    """Listing page of an extracted listing page entry, `crawled_at` is the time string of the dataset"""
+    extracted_data = entry['extracted_data']
+    return {
+        "page_number": entry['page_number'],
+        "page_listing_size": extracted_data.get('number_of_items', len(extracted_data['items'])),
+        "category": entry['product_category'],
+        "sorted_by": entry['ordering'],
+        "url": entry['page_url'],
+        "crawled_at": entry['crawled_at'],
+    }
+
+
+def listing_item_props(item, position):
+    """Listing item at `position` of a listing page.
+
+    `page_position` counts the products of the page like the page listing
+    size, variants of a product share it.
+    """
+    return {
+        "position": position,
+        "page_position": item.get('page_position'),
+        "price": item['sale_price'],
+        "on_sale": item['on_sale'],
+        "discount_percentage": item['discount_percentage'],
+        "listing_props": item['listing_props'],
+    }
+
+
+def entry_record(entry, website_name):
+    """JSON record of an extracted entry, `None` for unparsable entries.
+
+    Values are normalized like the importer stores them, without `None`
+    values and cleaned like `models.Product.clean`. Listing items without
+    detail page are skipped like the importer does, items missing data have
+    their error instead of the listing fields.
+    """
+    if not entry['extract_ok']:
+        return None
+
+    if entry['page_type'] == 'product_detail':
+        record = utils.removeNoneValuesFromDict(product_props(entry))
+        utils.normalizeProductValues(record, brand_name=record.get('brand'))
+    elif entry['page_type'] == 'product_listing':
+        record = utils.removeNoneValuesFromDict(listing_page_props(entry))
+        items = []
+        for i, item in enumerate(entry['extracted_data']['items']):
+            detail_page_url = item.get('detail_page_url')
+            if not detail_page_url:
+                continue
+            try:
+                listing_item = utils.normalizeSaleValues(listing_item_props(item, i + 1))
+            except KeyError as e:
+                listing_item = {"position": i + 1, "error": "Missing %s" % (e)}
+            listing_item['detail_page_url'] = detail_page_url
+            items.append(listing_item)
+        record['items'] = items
+    else:
+        return None
+
+    record['type'] = entry['page_type']
+    record['website'] = website_name
+    return record
+
+
+# -------------------------------------------------------------------------
+# Extraction workers
+# -------------------------------------------------------------------------
+_worker = {}
+
+
+def init_worker(provider_class, data_source_path, website_name):
+    """Create the provider of the dataset in a worker process"""
+    _worker['provider'] = provider_class(data_source_path)
+    _worker['website'] = website_name
+
+
+def extract_line(numbered_line):
+    """JSON line of the record of a dataset line, `None` when the line can't be extracted.
+
+    Errors are written to stderr with the line number.
+    """
+    i, line = numbered_line
+    provider = _worker['provider']
+    try:
+        entry = provider.extract_date_line(line)
+        record = entry_record(entry, _worker['website'])
+        provider.release_entry(entry)
+    except Exception:
+        sys.stderr.write("[%s] line %s: %s" % (_worker['website'], i, traceback.format_exc()))
+        return None
+    if record is None:
+        return None
+    record['line'] = i
+    return json.dumps(record, sort_keys=True, separators=(',', ':'))
+
+
+def extract(datasets, output, workers=1, chunk_size=20):
+    """Write the records of datasets to the `output` file object.
+
+    Returns the number of (written, failed) lines.
+    """
+    total_written, total_failed = 0, 0
+    for dataset in datasets:
+        written, failed = 0, 0
+        provider = dataset.provider(dataset.data_source_path)
+        lines = enumerate(provider.read_file(), start=1)
+        init_args = (dataset.provider, dataset.data_source_path, dataset.website)
+
+        pool = None
+        if workers > 1:
+            pool = Pool(workers, initializer=init_worker, initargs=init_args)
+            records = pool.imap(extract_line, lines, chunk_size)
+        else:
+            init_worker(*init_args)
+            records = imap(extract_line, lines)
+
+        try:
+            for record in records:
+                if record is None:
+                    failed = failed + 1
+                    continue
+                output.write(record + '\n')
+                written = written + 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        sys.stderr.write("[%s] Extracted %s (written: %s / failed: %s)\n" % (
+            dataset.website, dataset.data_source_path, written, failed))
+        total_written = total_written + written
+        total_failed = total_failed + failed
+    return total_written, total_failed
+
+
+# -------------------------------------------------------------------------
+# Standalone runner
+# -------------------------------------------------------------------------
+def main():
+    """Main Application"""
+    arguments = docopt(__doc__)
+    try:
+        selected = parse_datasets(arguments['<website>'])
+    except ValueError as e:
+        print e
+        sys.exit(1)
+
+    path = arguments['--output']
+    if path == '-':
+        output = sys.stdout
+    elif path.endswith('.gz'):
+        output = gzip.open(path, 'wb')
+    else:
+        output = open(path, 'wb')
+
+    try:
+        extract(selected, output, workers=int(arguments['--workers']), chunk_size=int(arguments['--chunk-size']))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,154 @@
 # -*- coding: utf-8 -*-
+"""Import Datasets.
+
+Usage:
+    importer.py [--sample] [--workers=<n>] [--batch-size=<n>] [<website>...]
+    importer.py reprocess [--stale] [<website>...]
+    importer.py reprocess <website> --offsets=<file>
+
+Arguments:
+    <website>           Website to import or reprocess, optionally with the files or globs of
+                        its datasets as `website:path[,path...]`. Defaults to all websites
+                        with the dataset paths in config. Offsets are replayed in one file
+
+Options:
+    --workers=<n>       Number of websites imported at the same time in separate processes,
+                        1 imports in this process [default: 3]
+    --batch-size=<n>    Number of lines between progress updates of a website [default: 20]
+    --sample            Sample stacks of the slowest lines for the profile report
+    --stale             Only replay dead-letter records of an older extractor version
+    --offsets=<file>    Replay the lines at the byte offsets in the file, one per line,
+                        instead of the dead-letter records
+
+Websites: ziengs, omoda, zalando
+"""
 import os.path
+import gc
 import json
-from collections import namedtuple
-from providers.zalando.zalando import ZalandoProvider
-from providers.omoda.omoda import OmodaProvider
-from providers.ziengs.ziengs import ZiengsProvider
+import resource
+import sys
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from multiprocessing import Process, Queue
+from Queue import Empty
+from docopt import docopt
 import models
+import matching
+import ranking
+import stats as product_stats
 import utils
+import metrics
+import profiling
+from deadletter import DeadLetterStore
+from extract import datasets, parse_datasets, product_props, listing_page_props, listing_item_props
 from pymodm.vendor import parse_datetime
-import codecs
-from custom_log import prepare_logger
-from config import (ZIENGS_PROVIDER_DATASETS_FILEPATH,
-                    OMODA_PROVIDER_DATASETS_FILEPATH,
-                    ZALANDO_PROVIDER_DATASETS_FILEPATH,)
+from custom_log import prepare_logger, restart_listeners, stop_listeners
+import config
 
 
 logger = prepare_logger(__name__, __file__)
 
 
-Dataset = namedtuple('Dataset', 'provider website data_source_path')
+def rss_mb():
+    """Current RSS of the process in MB, `None` without /proc"""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / (1024.0 * 1024.0)
+    except (IOError, OSError):
+        return None
 
 
-datasets = [
-    Dataset(ZiengsProvider, 'ziengs', ZIENGS_PROVIDER_DATASETS_FILEPATH),
-    Dataset(OmodaProvider, 'omoda', OMODA_PROVIDER_DATASETS_FILEPATH),
-    Dataset(ZalandoProvider, 'zalando', ZALANDO_PROVIDER_DATASETS_FILEPATH,),
-]
+class MemoryWatermark(object):
+    """Keep the import of a website under an RSS watermark.
 
+    Every `interval` lines the RSS is checked, above the watermark the
+    buffered dead letters are flushed, the dead-letter batch size is halved
+    and the cyclic garbage is collected before the next line is read. Freed
+    memory is rarely returned to the OS, so once crossed the watermark only
+    acts again when RSS grew by `margin_mb` since the last crossing; the
+    batch size is restored when RSS falls back under the watermark.
 
-def writeErrorFile(eid, contents):
-    """Write contents to error file to analyze"""
-    epath = os.path.abspath('../tmp/error-%s.html' % eid)
-    logger.error("Writing error to file: %s" % (epath))
-
-    with codecs.open(epath, 'w', 'utf-8') as efile:
-        efile.write(contents)
-
+    params:
+        - dead_letters: `DeadLetterStore` of the website
+        - watermark_mb: defaults to `IMPORT_RSS_WATERMARK_MB` in config, `None` disables the check
+        - interval: defaults to `IMPORT_RSS_CHECK_INTERVAL` in config
+        - margin_mb: defaults to `IMPORT_RSS_WATERMARK_MARGIN_MB` in config
+    """
 
-def importer(datasets):
+    def __init__(self, dead_letters, watermark_mb=None, interval=None, margin_mb=None):
+        if watermark_mb is None:
+            watermark_mb = getattr(config, 'IMPORT_RSS_WATERMARK_MB', None)
+        if interval is None:
+            interval = getattr(config, 'IMPORT_RSS_CHECK_INTERVAL', 50)
+        if margin_mb is None:
+            margin_mb = getattr(config, 'IMPORT_RSS_WATERMARK_MARGIN_MB', 128)
+        self.dead_letters = dead_letters
+        self.watermark_mb = watermark_mb
+        self.interval = interval
+        self.margin_mb = margin_mb
+        self.crossed = 0
+        self.threshold_mb = watermark_mb
+        self.batch_size = dead_letters.batch_size
+
+    def check(self, line):
+        """Release memory when RSS is above the watermark"""
+        if self.watermark_mb is None or line % self.interval != 0:
+            return
+        rss = rss_mb()
+        if rss is None:
+            return
+        if rss < self.watermark_mb:
+            self.threshold_mb = self.watermark_mb
+            self.dead_letters.batch_size = self.batch_size
+            return
+        if rss < self.threshold_mb:
+            return
+
+        self.crossed = self.crossed + 1
+        self.threshold_mb = rss + self.margin_mb
+        self.dead_letters.flush()
+        self.dead_letters.batch_size = max(1, self.dead_letters.batch_size // 2)
+        gc.collect()
+        logger.warning("RSS %.0fMB above watermark %sMB @ line %s, released %.0fMB",
+            rss, self.watermark_mb, line, rss - (rss_mb() or rss))
+
+
+def print_progress(website_name, pass_idx, loop, line, num_of_lines, ok, failed):
+    """Print import progress of a website"""
+    ilen = len(str(num_of_lines))
+    print "[%s] %s-pass (%s) @ line %s of %s [%s%%] (ok:%s / fail:%s)" % (
+        website_name,
+        pass_idx,
+        loop,
+        str(line).rjust(ilen),
+        num_of_lines,
+        str(utils.calcPercentage(line, num_of_lines, round_whole=True)).rjust(3),
+        str(ok).rjust(ilen),
+        str(failed).rjust(ilen),
+        )
+
+
+def importer(datasets, profiler=None, progress=print_progress, batch_size=20, refresh=True):
     """Import Datasets. 
 
     The importer will run 2-passes over the datasets.
     - First pass will parse and extract "product_detail" information. 
     - Second pass will parse and extract "product_listing" information
 
-    During executing the function will print out it's progress.
+    During executing the function reports it's progress to `progress` every
+    `batch_size` lines and every 2 procent.
+
+    Failed entries are kept in the dead-letter store of the provider, see `deadletter`.
+
+    A `profiling.StageProfiler` times the stages of every line per provider and pass.
 
+    With `refresh` the precomputed data of a website is refreshed after each
+    dataset, see `refresh_website`.
+
+    Returns the import stats per dataset path.
     """
+    results = {}
     for dataset in datasets:
         Provider = dataset.provider
         data_source_path = os.path.abspath(dataset.data_source_path)
@@ -59,51 +161,70 @@ def importer(datasets):
         # First Pass
         # -------------------------------------------------------------------------
         provider = Provider(data_source_path)
+        dead_letters = DeadLetterStore(provider)
+        memory = MemoryWatermark(dead_letters)
         num_of_lines = provider.count_lines()
-        ilen = len(str(num_of_lines))
 
-        logger.info("Start importing %s for %s" % (data_source_path, website_name))
+        logger.info("Start importing %s for %s", data_source_path, website_name, extra={'website': website_name})
 
         ok, failed = 0, 0
         progress_percentage_hit = []
         for pass_idx, loop in enumerate(['product_detail', 'product_listing'], start=1):
             print("[%s] Looping %s-pass %s" % (website_name, pass_idx, loop))
+            if profiler is not None:
+                profiler.begin(website_name, loop)
 
             reader = provider.read_entry()
             for i, entry in enumerate(reader, start=1):
-                if entry.get('page_type') != loop:
+                if entry_pass(entry) != loop:
+                    with profiling.stage('release'):
+                        provider.release_entry(entry)
+                    memory.check(i)
+                    if profiler is not None:
+                        profiler.end_line(**line_info(i, entry))
                     continue
                 try:
-                    if process_entry(entry, website_pk=website_pk):
+                    if process_entry(entry, website_pk=website_pk, dead_letters=dead_letters):
                         ok = ok + 1
                     else:
                         failed = failed + 1
                 except Exception as e:
                     failed = failed + 1
-                    logger.error("Exception: \n%s\n" % (e))
+                    logger.error("Exception: \n%s\n", e, extra={'website': website_name, 'line': i})
+                    dead_letters.add(entry, e)
 
                 # -------------------------------------------------------------------------
-                # Show Progress every 10th item or every 2 procent
+                # Release parse tree and body, bounds memory to the current line
+                # -------------------------------------------------------------------------
+                with profiling.stage('release'):
+                    provider.release_entry(entry)
+                memory.check(i)
+
+                # -------------------------------------------------------------------------
+                # Show Progress every batch of lines or every 2 procent
                 # -------------------------------------------------------------------------
                 progress_percentage = utils.calcPercentage(i, num_of_lines, round_whole=True)
-                if i%20 == 0 or (
+                if i%batch_size == 0 or (
                     progress_percentage%2 == 0 and progress_percentage not in progress_percentage_hit
                     ) or i == num_of_lines:
-                    print "[%s] %s-pass (%s) @ line %s of %s [%s%%] (ok:%s / fail:%s)" % (
-                        website_name, 
-                        pass_idx, 
-                        loop, 
-                        str(i).rjust(ilen), 
-                        num_of_lines,
-                        str(progress_percentage).rjust(3),
-                        str(ok).rjust(ilen),
-                        str(failed).rjust(ilen),
-                        )
+                    progress(website_name, pass_idx, loop, i, num_of_lines, ok, failed)
                     progress_percentage_hit.append(progress_percentage)
+
+                if profiler is not None:
+                    profiler.end_line(**line_info(i, entry))
+        dead_letters.close()
+        if dead_letters.written or dead_letters.dropped:
+            logger.error("Dead letters of %s: %s written to %s, %s dropped (store full)",
+                website_name,
+                dead_letters.written,
+                dead_letters.directory,
+                dead_letters.dropped,
+                )
         stats = {
             "total": ok + failed,
             "ok": ok,
             "failed": failed,
+            "watermark_crossed": memory.crossed,
             }
 
         msg = "Finished importing %s for %s:\nok: %s failed: %s total: %s" % (
@@ -115,14 +236,290 @@ def importer(datasets):
             )
         logger.info(msg)
         print msg
+        results[data_source_path] = stats
+
+        if refresh:
+            if profiler is not None:
+                profiler.begin(website_name, 'refresh')
+            refresh_website(website_name, website_pk)
+            if profiler is not None:
+                profiler.end_line()
+    return results
+
+
+def entry_pass(entry):
+    """Pass an entry is processed in, lines of unknown page types fail in the first pass"""
+    page_type = entry.get('page_type')
+    if page_type not in ('product_detail', 'product_listing'):
+        return 'product_detail'
+    return page_type
+
+
+def line_info(i, entry):
+    """Identification of a dataset line in the profile report"""
+    return {
+        "line": i,
+        "offset": entry.get('_line_offset'),
+        "page_type": entry.get('page_type'),
+        "page_url": entry.get('page_url'),
+    }
+
+
+def refresh_website(website_name, website_pk):
+    """Refresh precomputed data of an imported website"""
+    # -------------------------------------------------------------------------
+    # Absolute listing positions, first pages may be imported after later pages
+    # -------------------------------------------------------------------------
+    print("[%s] Refreshing listing ranks" % (website_name))
+    with profiling.stage('ranks'):
+        ranking.refresh_absolute_positions(website_pk)
+
+    # -------------------------------------------------------------------------
+    # Rebuild precomputed stats of imported website
+    # -------------------------------------------------------------------------
+    print("[%s] Refreshing product stats" % (website_name))
+    with profiling.stage('stats'):
+        product_stats.refresh_website_stats(website_pk)
+
+    # -------------------------------------------------------------------------
+    # Match products with other websites
+    # -------------------------------------------------------------------------
+    print("[%s] Matching products with other websites" % (website_name))
+    with profiling.stage('matching'):
+        matching.refresh_website_matches(website_pk)
+
+    # -------------------------------------------------------------------------
+    # Invalidate uid lookup caches of running API processes
+    # -------------------------------------------------------------------------
+    models.bump_import_generation()
+
+
+# -------------------------------------------------------------------------
+# Concurrent import
+# -------------------------------------------------------------------------
+def import_worker(website_datasets, messages, batch_size, slowest, sample_interval):
+    """Import the datasets of a website in a forked process.
+
+    Progress, the import stats and the profiled passes are put on the
+    `messages` queue.
+    """
+    metrics.reset_pid()
+    restart_listeners()
+    models.connect_database()
+
+    website_name = website_datasets[0].website
+    profiler = profiling.StageProfiler(slowest=slowest, sample_interval=sample_interval)
+    profiler.start()
+    try:
+        def progress(*args):
+            messages.put(('progress', args))
+        results = importer(website_datasets, profiler=profiler, progress=progress, batch_size=batch_size, refresh=False)
+        profiler.stop()
+        messages.put(('done', website_name, results, profiler.passes))
+    except Exception:
+        profiler.stop()
+        messages.put(('error', website_name, traceback.format_exc(), profiler.passes))
+    finally:
+        stop_listeners()
+
+
+def print_combined_progress(progress):
+    """Print the last progress of every website on one line"""
+    print " | ".join([
+        "[%s] %s-pass %s%% (ok:%s / fail:%s)" % (
+            website_name,
+            pass_idx,
+            str(utils.calcPercentage(line, num_of_lines, round_whole=True)).rjust(3),
+            ok,
+            failed,
+            )
+        for website_name, (pass_idx, loop, line, num_of_lines, ok, failed) in progress.items()
+    ])
+
+
+def concurrent_importer(datasets, workers, profiler, batch_size=20):
+    """Import the datasets of every website in a separate process.
+
+    At most `workers` websites are imported at the same time, a website
+    imports its datasets in order. The precomputed data of the websites is
+    refreshed after all imports finished, matching reads the products of all
+    websites.
+
+    Returns the websites that failed to import.
+    """
+    by_website = OrderedDict()
+    for dataset in datasets:
+        by_website.setdefault(dataset.website, []).append(dataset)
+
+    messages = Queue()
+    pending = by_website.values()
+    running = {}
+    progress = OrderedDict()
+    failed = []
+    while pending or running:
+        while pending and len(running) < workers:
+            website_datasets = pending.pop(0)
+            process = Process(target=import_worker, args=(
+                website_datasets, messages, batch_size, profiler.slowest, profiler.sample_interval,
+                ))
+            process.start()
+            running[website_datasets[0].website] = process
+
+        try:
+            message = messages.get(timeout=1)
+        except Empty:
+            # -------------------------------------------------------------------------
+            # Workers killed before reporting, e.g. by the OOM killer
+            # -------------------------------------------------------------------------
+            for website_name, process in running.items():
+                if not process.is_alive() and process.exitcode != 0:
+                    running.pop(website_name)
+                    failed.append(website_name)
+                    logger.error("Import of %s exited with code %s", website_name, process.exitcode)
+                    print "[%s] Import exited with code %s" % (website_name, process.exitcode)
+            continue
+
+        if message[0] == 'progress':
+            website_name = message[1][0]
+            progress[website_name] = message[1][1:]
+            print_combined_progress(progress)
+            continue
+
+        kind, website_name, result, passes = message
+        running.pop(website_name).join()
+        profiler.passes.extend(passes)
+        if kind == 'error':
+            failed.append(website_name)
+            logger.error("Import of %s failed:\n%s", website_name, result)
+            print "[%s] Import failed:\n%s" % (website_name, result)
+
+    for website_name in by_website.keys():
+        if website_name in failed:
+            continue
+        profiler.begin(website_name, 'refresh')
+        refresh_website(website_name, models.Website(website=website_name).ensure().pk)
+        profiler.end_line()
+    return failed
+
+
+def dead_letter_offsets(dead_letters, stale=False):
+    """Line offsets of the dead-letter records of the provider dataset.
+
+    params:
+        - stale: only records of an older extractor version than the provider's
+    """
+    provider = dead_letters.provider
+    return set([
+        record['line_offset'] for record in dead_letters.records()
+        if record.get('line_offset') is not None and record.get('source') == provider.source_file_path and (
+            not stale or record.get('extractor_version') < provider.extractor_version
+            )
+    ])
+
+
+def reprocess(datasets, stale=False, offsets=None):
+    """Replay failed or flagged lines of datasets.
+
+    The lines at `offsets`, or at the offsets of the dead-letter records when
+    `None`, are read by seeking straight to them and re-extracted with the
+    current provider. Like the importer detail lines are processed before
+    listing lines. Only results differing from the stored products and
+    listings are written.
+
+    Dead-letter records of the replayed lines are replaced by the failures of
+    the replay.
+    """
+    for dataset in datasets:
+        website_name = dataset.website
+        website_pk = models.Website(website=website_name).ensure().pk
 
+        provider = dataset.provider(os.path.abspath(dataset.data_source_path))
+        dead_letters = DeadLetterStore(provider)
+        started = datetime.utcnow().isoformat()
+        line_offsets = offsets if offsets is not None else dead_letter_offsets(dead_letters, stale=stale)
+        if not line_offsets:
+            print("[%s] No lines to reprocess" % (website_name))
+            continue
 
-def process_entry(entry, website_pk):
+        ok, failed = 0, 0
+        for pass_idx, loop in enumerate(['product_detail', 'product_listing'], start=1):
+            print("[%s] Reprocessing %s lines %s-pass %s" % (website_name, len(line_offsets), pass_idx, loop))
+            for entry in provider.read_entry_at(line_offsets):
+                if entry_pass(entry) != loop:
+                    provider.release_entry(entry)
+                    continue
+                try:
+                    if process_entry(entry, website_pk=website_pk, dead_letters=dead_letters, update_changed=True):
+                        ok = ok + 1
+                    else:
+                        failed = failed + 1
+                except Exception as e:
+                    failed = failed + 1
+                    logger.error("Exception: \n%s\n", e, extra={'website': website_name, 'offset': entry['_line_offset']})
+                    dead_letters.add(entry, e)
+                provider.release_entry(entry)
+
+        dead_letters.close()
+        dead_letters.resolve(line_offsets, before=started)
+
+        msg = "Finished reprocessing %s lines of %s for %s:\nok: %s failed: %s" % (
+            len(line_offsets),
+            provider.source_file_path,
+            website_name,
+            ok,
+            failed,
+            )
+        logger.info(msg)
+        print msg
+
+        refresh_website(website_name, website_pk)
+
+
+def save_changed_product(product):
+    """Save new product or set the changed fields of the existing product.
+
+    Fields of the existing product without value in the product are unset.
+    Products are identified by their `ensure_fields` like `ensure` does.
+    Returns the saved or existing product.
+    """
+    with profiling.stage('validate'):
+        product.full_clean()
+    son = product.to_son()
+    collection = models.Product._mongometa.collection
+    with profiling.stage('lookup'):
+        existing = collection.find_one(dict([(k, son.get(k)) for k in models.Product.ensure_fields]))
+    if existing is None:
+        with profiling.stage('write'):
+            return product.save()
+
+    # -------------------------------------------------------------------------
+    # Fields without value in the new result are removed, e.g. values the
+    # extractor no longer finds
+    # -------------------------------------------------------------------------
+    changed = dict([(k, v) for k, v in son.items() if k not in ('_id', 'listings') and existing.get(k) != v])
+    removed = dict([(k, '') for k in existing if k not in ('_id', 'listings') and k not in son])
+    if changed or removed:
+        update = {}
+        if changed:
+            update['$set'] = changed
+        if removed:
+            update['$unset'] = removed
+        with profiling.stage('write'):
+            collection.update_one({'_id': existing['_id']}, update)
+        logger.debug("Product updated: %s [%s]", son.get('sku'), ', '.join(sorted(changed.keys() + removed.keys())))
+    product.pk = existing['_id']
+    return product
+
+
+def process_entry(entry, website_pk, dead_letters=None, update_changed=False):
     """Process entry data.
 
     params:
         - entry: parsed dataset line
         - website_pk: website Mongo <ObjectId> reference
+        - dead_letters: `DeadLetterStore` keeping unparsable entries and failed listing items
+        - update_changed: update existing products and listing items that changed
+          instead of keeping them, used by `reprocess`
 
     The function will process the entry data based on the "page type: product_detail or product_listing".
 
@@ -132,34 +529,21 @@ def process_entry(entry, website_pk):
 
     """
     if not entry['extract_ok']:
+        if dead_letters is not None:
+            dead_letters.add(entry, entry.get('extract_error') or "Page could not be parsed")
         return False
 
     extracted_data = entry['extracted_data']
 
     if entry['page_type'] == 'product_detail':
-        item = extracted_data['item']
-        brand = item['brand_name']
-        if brand:
+        props = product_props(entry)
+        if props['brand']:
             try:
-                brand = models.Brand(brand=brand).ensure()
+                props['brand'] = models.Brand(brand=props['brand']).ensure()
             except:
                 raise
-
-        props = {
-            "brand": brand,
-            "crawled_at": parse_datetime(entry['crawled_at']),
-            "discount_percentage": item['discount_percentage'],
-            "name": item['article_name'],
-            "on_sale": item['on_sale'],
-            "price": item['sale_price'],
-            "product_type": item['article_type'],
-            "properties": item['extra_props'],
-            "sku": item['sku'],
-            "url": entry['page_url'],
-            "website": website_pk,
-            # path=None,
-            # listings=[],
-        }
+        props['crawled_at'] = parse_datetime(props['crawled_at'])
+        props['website'] = website_pk
         # print(props)
         ## Clean None values
         props = utils.removeNoneValuesFromDict(props)
@@ -167,34 +551,25 @@ def process_entry(entry, website_pk):
         p = models.Product(**props)
         try:
             # p.save()
-            p.ensure()
+            if update_changed:
+                save_changed_product(p)
+            else:
+                p.ensure()
         except models.DuplicateKeyError as error:
-            logger.debug("Item already exists: %s - %s - %s [%s]" % (
+            logger.debug("Item already exists: %s - %s - %s [%s]",
                 props.get("sku"),
                 props.get("name"),
                 props.get("url"),
                 props.get("crawled_at"),
-                ))
+                )
             return False
-        except Exception as e:
-            writeErrorFile('detail-%s' % (website_pk), entry['body'])
-            raise e
 
     elif entry['page_type'] == 'product_listing':
         status = True
 
-        number_of_items = extracted_data['number_of_items']
-        # number_of_items = len(extracted_data['items'])
-
-        props = {
-            "page_number": entry['page_number'],
-            "page_listing_size": number_of_items,
-            "category": entry['product_category'],
-            "sorted_by": entry['ordering'],
-            "url": entry['page_url'],
-            "crawled_at": parse_datetime(entry['crawled_at']),
-            "website": website_pk,
-        }
+        props = listing_page_props(entry)
+        props['crawled_at'] = parse_datetime(props['crawled_at'])
+        props['website'] = website_pk
 
         props = utils.removeNoneValuesFromDict(props)
 
@@ -210,6 +585,15 @@ def process_entry(entry, website_pk):
         except:
             raise
 
+        # -------------------------------------------------------------------------
+        # Keep listing items the extractor failed on
+        # -------------------------------------------------------------------------
+        for failed_item in extracted_data.get('failed_items', []):
+            logger.error(failed_item['error'])
+            if dead_letters is not None:
+                dead_letters.add(entry, failed_item['error'],
+                    key='listing-%s-position-%s' % (pl_pk, failed_item['page_position']))
+
         # -------------------------------------------------------------------------
         # Assign Items
         # -------------------------------------------------------------------------
@@ -217,6 +601,7 @@ def process_entry(entry, website_pk):
         not_found_products = 0
         listing_added_total = 0
         insufficent_data = 0
+        rank_operations = []
         for i, item in enumerate(extracted_data['items']):
             # -------------------------------------------------------------------------
             # Find Item first
@@ -230,35 +615,48 @@ def process_entry(entry, website_pk):
             # Find matching Product based on detail_page_url
             # -------------------------------------------------------------------------
             try:
-                product = models.Product.objects.get({'path': detail_page_url})
+                with profiling.stage('lookup'):
+                    product = models.Product.objects.get({'path': detail_page_url})
             except models.Product.DoesNotExist:
-                logger.debug("No Product match found for %s" % (detail_page_url))
+                logger.debug("No Product match found for %s", detail_page_url)
                 not_found_products = not_found_products + 1
                 continue
 
             try:
-                li_props = {
-                    "position": i+1,
-                    "price": item['sale_price'],
-                    "on_sale": item['on_sale'],
-                    "discount_percentage": item['discount_percentage'],
-                    "listing_props": item['listing_props'],
-                    "listing": pl_pk,
-                }
+                li_props = listing_item_props(item, i+1)
+                li_props['listing'] = pl_pk
                # -------------------------------------------------------------------------
                 # Create Listing Item
                 # -------------------------------------------------------------------------
-                li = models.ProductListingItem(**li_props)
+                with profiling.stage('validate'):
+                    li = models.ProductListingItem(**li_props)
             except Exception as e:
-                writeErrorFile('listing-%s' % (pl_pk), entry['body'])
+                if dead_letters is not None:
+                    dead_letters.add(entry, e, key='listing-%s-%s' % (pl_pk, i))
                 logger.error(e)
                 insufficent_data = insufficent_data + 1
                 continue
 
-            if any([True for l in product.listings if l.listing._id == pl_pk]):
-                # print("Listing already added to product")
-                listing_added_total = listing_added_total + 1
-                continue
+            # -------------------------------------------------------------------------
+            # Track listing rank of product
+            # -------------------------------------------------------------------------
+            rank_operations.append(ranking.rank_operation(
+                website_pk=website_pk,
+                sku=product.sku,
+                product_pk=product.pk,
+                listing=pl,
+                # Page position counts products like the page listing size, variants share it
+                position=li.page_position or li.position,
+                price=li.price,
+                ))
+
+            existing = [l for l in product.listings if l.listing._id == pl_pk]
+            if existing:
+                if not update_changed or existing[0].to_son() == li.to_son():
+                    # print("Listing already added to product")
+                    listing_added_total = listing_added_total + 1
+                    continue
+                product.listings.remove(existing[0])
 
             # -------------------------------------------------------------------------
             # Add New Listing ot Product listings
@@ -266,23 +664,28 @@ def process_entry(entry, website_pk):
             product.listings.append(li)
 
             try:
-                product.save()
+                with profiling.stage('write'):
+                    product.save()
                 listing_added_total = listing_added_total + 1
             except Exception as e:
                 logger.error(e)
 
-                writeErrorFile('listing-%s-%s' % (pl_pk, i), entry['body'])
+                if dead_letters is not None:
+                    dead_letters.add(entry, e, key='listing-%s-%s' % (pl_pk, i))
+
+        with profiling.stage('write'):
+            ranking.store_ranks(rank_operations)
 
         # -------------------------------------------------------------------------
         # Debug stats
         # -------------------------------------------------------------------------
-        logger.debug("""%s: stats (ok:%s/missing:%s/nodata:%s/total:%s)""" % (
+        logger.debug("""%s: stats (ok:%s/missing:%s/nodata:%s/total:%s)""",
             utils.get_url_path(entry['page_url']),
             listing_added_total,
             not_found_products,
             insufficent_data,
             total_items,
-            ))
+            )
 
         return True
     else:
@@ -297,8 +700,60 @@ def process_entry(entry, website_pk):
 # -------------------------------------------------------------------------
 def main():
     """Main Application"""
+    arguments = docopt(__doc__)
+
+    if arguments['reprocess']:
+        try:
+            selected = parse_datasets(arguments['<website>'])
+        except ValueError as e:
+            print e
+            sys.exit(1)
+
+        offsets = None
+        if arguments['--offsets']:
+            if len(selected) != 1:
+                print "Offsets are replayed in one dataset file, %s selected" % (len(selected))
+                sys.exit(1)
+            with open(arguments['--offsets'], 'r') as offsets_file:
+                offsets = set([int(line) for line in offsets_file if line.strip()])
+
+        logger.info("Start reprocess task")
+        reprocess(selected,
+            stale=arguments['--stale'],
+            offsets=offsets,
+            )
+        return
+
+    try:
+        selected = parse_datasets(arguments['<website>'])
+    except ValueError as e:
+        print e
+        sys.exit(1)
+    workers = int(arguments['--workers'])
+    batch_size = int(arguments['--batch-size'])
+
     logger.info("Start import task")
-    importer(datasets)
+    profiler = profiling.StageProfiler(
+        slowest=getattr(config, 'IMPORT_PROFILE_SLOWEST', 10),
+        sample_interval=getattr(config, 'IMPORT_PROFILE_SAMPLE_INTERVAL', 0.005) if arguments['--sample'] else None,
+        )
+    profiler.start()
+    failed = []
+    try:
+        if workers > 1:
+            failed = concurrent_importer(selected, workers, profiler, batch_size=batch_size)
+        else:
+            importer(selected, profiler=profiler, batch_size=batch_size)
+    finally:
+        profiler.stop()
+        print profiler.summary()
+        report_path = profiler.write(getattr(config, 'IMPORT_PROFILE_DIR', '../tmp/profiles'))
+        logger.info("Import profile written to %s", report_path)
+        print "Import profile written to %s" % (report_path)
+
+    if failed:
+        print "Failed to import: %s" % (', '.join(failed))
+        sys.exit(1)
 
 
 if __name__ == "__main__":
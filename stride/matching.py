@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Cross-website product matching.
+
+Products are only compared within blocks: same normalized brand, a shared
+name token and a nearby price band. Pairs within a block are scored on name
+token overlap and price difference. Every refresh recomputes the clusters of
+the website products, so clusters split again when products stop matching,
+and a cluster holds at most one product per website.
+"""
+import math
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+import models
+import utils
+
+
+PRICE_BAND_RATIO = 1.25
+MATCH_THRESHOLD = 0.6
+NAME_WEIGHT = 0.8
+PRICE_WEIGHT = 0.2
+MIN_TOKEN_LENGTH = 2
+BULK_WRITE_SIZE = 1000
+
+
+def name_tokens(name, brand_uid=None):
+    """Normalized name tokens, without the brand tokens"""
+    brand_tokens = set(brand_uid.split()) if brand_uid else set()
+    return sorted(set([
+        t for t in utils.cleanStringForUID(name or '').split()
+        if len(t) >= MIN_TOKEN_LENGTH and t not in brand_tokens
+    ]))
+
+
+def price_band(price):
+    """Logarithmic price band"""
+    if not price or price <= 0:
+        return None
+    return int(math.floor(math.log(price, PRICE_BAND_RATIO)))
+
+
+def block_keys(brand_uid, tokens, band):
+    """Block keys of a product"""
+    if not brand_uid or band is None:
+        return []
+    return ['%s|%s|%s' % (brand_uid, token, band) for token in tokens]
+
+
+def candidate_block_keys(brand_uid, tokens, band):
+    """Block keys to find candidates with, including neighbouring price bands"""
+    if band is None:
+        return []
+    keys = []
+    for b in (band - 1, band, band + 1):
+        keys.extend(block_keys(brand_uid, tokens, b))
+    return keys
+
+
+def score(a, b):
+    """Score similarity of two match entries between 0.0 and 1.0"""
+    tokens_a, tokens_b = set(a['tokens']), set(b['tokens'])
+    if not tokens_a or not tokens_b:
+        return 0.0
+    name_score = len(tokens_a & tokens_b) / float(len(tokens_a | tokens_b))
+
+    price_a, price_b = a.get('price') or 0.0, b.get('price') or 0.0
+    price_score = 0.0
+    if price_a > 0 and price_b > 0:
+        price_score = 1.0 - abs(price_a - price_b) / max(price_a, price_b)
+
+    return NAME_WEIGHT * name_score + PRICE_WEIGHT * price_score
+
+
+def latest_website_products(website_pk, fields=('sku', 'name', 'brand', 'price')):
+    """Stream latest crawled version of every website sku with `fields`.
+
+    Sorting on (sku_key, crawled_at) is served by `sku_history_idx`
+    """
+    projection = dict([(field, 1) for field in fields])
+    projection['sku_key'] = 1
+    cursor = models.Product._mongometa.collection.find(
+        {'website': website_pk},
+        projection=projection,
+        batch_size=BULK_WRITE_SIZE,
+        ).sort([('website', 1), ('sku_key', 1), ('crawled_at', 1)])
+
+    latest = None
+    for doc in cursor:
+        if latest is not None and latest.get('sku_key') != doc.get('sku_key'):
+            yield latest
+        latest = doc
+    if latest is not None:
+        yield latest
+
+
+def store_website_entries(website_pk):
+    """Upsert match entries of all website products, keeping assigned clusters"""
+    brand_uids = dict([
+        (doc['_id'], doc.get('brand_uid'))
+        for doc in models.Brand._mongometa.collection.find(projection={'brand_uid': 1})
+    ])
+
+    collection = models.ProductMatch._mongometa.collection
+    batch = []
+    for product in latest_website_products(website_pk):
+        if not product.get('sku_key'):
+            continue
+        brand_uid = brand_uids.get(product.get('brand'))
+        tokens = name_tokens(product.get('name'), brand_uid)
+        batch.append(UpdateOne(
+            {'website': website_pk, 'sku_key': product['sku_key']},
+            {
+                '$set': {
+                    'sku': product.get('sku'),
+                    'name': product.get('name'),
+                    'brand_uid': brand_uid,
+                    'price': product.get('price'),
+                    'tokens': tokens,
+                    'block_keys': block_keys(brand_uid, tokens, price_band(product.get('price'))),
+                    'doc_version': 1.0,
+                },
+                '$setOnInsert': {'cluster': ObjectId()},
+            },
+            upsert=True,
+            ))
+        if len(batch) >= BULK_WRITE_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+
+
+def cluster_scores(entry, candidates):
+    """Best score per cluster of the candidates passing the match threshold"""
+    scores = {}
+    for candidate in candidates:
+        candidate_score = score(entry, candidate)
+        if candidate_score < MATCH_THRESHOLD:
+            continue
+        if scores.get(candidate['cluster'], 0.0) < candidate_score:
+            scores[candidate['cluster']] = candidate_score
+    return scores
+
+
+def assign_clusters(proposals):
+    """Assign entries to clusters from (score, entry id, cluster) proposals.
+
+    Best scoring proposals are assigned first, every entry joins at most one
+    cluster and every cluster gets at most one entry.
+    """
+    assigned, taken = {}, set()
+    for _, entry_id, cluster in sorted(proposals, key=lambda proposal: -proposal[0]):
+        if entry_id in assigned or cluster in taken:
+            continue
+        assigned[entry_id] = cluster
+        taken.add(cluster)
+    return assigned
+
+
+def refresh_website_matches(website_pk):
+    """Match products of website against products of other websites.
+
+    Recomputes the cluster of every website entry: it joins the best matching
+    cluster of other website entries, keeping at most one entry per website in
+    a cluster, or gets a cluster of its own when no candidate passes the
+    threshold. Returns number of entries that changed cluster.
+    """
+    store_website_entries(website_pk)
+
+    # -------------------------------------------------------------------------
+    # Score clusters of candidates at other websites. Those clusters don't
+    # change during the refresh of this website
+    # -------------------------------------------------------------------------
+    collection = models.ProductMatch._mongometa.collection
+    current = {}
+    proposals = []
+    cursor = collection.find(
+        {'website': website_pk},
+        projection={'tokens': 1, 'price': 1, 'brand_uid': 1, 'cluster': 1},
+        batch_size=BULK_WRITE_SIZE,
+        )
+    for entry in cursor:
+        current[entry['_id']] = entry['cluster']
+        keys = candidate_block_keys(entry.get('brand_uid'), entry['tokens'], price_band(entry.get('price')))
+        if not keys:
+            continue
+        candidates = collection.find(
+            {'block_keys': {'$in': keys}, 'website': {'$ne': website_pk}},
+            projection={'tokens': 1, 'price': 1, 'cluster': 1},
+            )
+        for cluster, cluster_score in cluster_scores(entry, candidates).items():
+            proposals.append((cluster_score, entry['_id'], cluster))
+    assigned = assign_clusters(proposals)
+
+    # -------------------------------------------------------------------------
+    # Unmatched entries keep their cluster when they're alone in it, otherwise
+    # they split off into a new cluster
+    # -------------------------------------------------------------------------
+    changed = 0
+    batch = []
+    for entry_id, cluster in current.iteritems():
+        target = assigned.get(entry_id)
+        if target is None:
+            shared = collection.find_one(
+                {'cluster': cluster, '_id': {'$ne': entry_id}}, projection={'_id': 1},
+                )
+            target = ObjectId() if shared else cluster
+        if target == cluster:
+            continue
+        batch.append(UpdateOne({'_id': entry_id}, {'$set': {'cluster': target}}))
+        changed = changed + 1
+        if len(batch) >= BULK_WRITE_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+    return changed
+
+
+def get_matches(website_pk, sku):
+    """Get match entries of the same product at other websites, one per website"""
+    collection = models.ProductMatch._mongometa.collection
+    entry = collection.find_one(
+        {'website': website_pk, 'sku_key': utils.cleanSKUForLookup(sku)},
+        projection={'cluster': 1, 'tokens': 1, 'price': 1},
+        )
+    if not entry:
+        return None
+
+    # -------------------------------------------------------------------------
+    # Keep best scoring entry per website, clusters of websites that weren't
+    # refreshed since may still hold several
+    # -------------------------------------------------------------------------
+    best = {}
+    matches = collection.find(
+        {'cluster': entry['cluster'], 'website': {'$ne': website_pk}},
+        projection={'website': 1, 'sku': 1, 'name': 1, 'brand_uid': 1, 'price': 1, 'tokens': 1},
+        )
+    for match in matches:
+        match_score = score(entry, match)
+        if match['website'] not in best or best[match['website']][0] < match_score:
+            best[match['website']] = (match_score, match)
+
+    results = []
+    for _, match in sorted(best.values(), key=lambda item: -item[0]):
+        del match['tokens']
+        results.append(match)
+    return results
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""Process metrics rendered in the Prometheus text exposition format.
+
+Metrics are kept per process. In multiprocess mode, like the multiprocess mode
+of the Prometheus client, every process writes its metrics to its own file in
+a directory shared by the workers of the production server, and rendering
+merges the files of all processes, including exited workers. Files are
+written at most every flush interval and when a worker exits, so other
+workers' samples may lag by the flush interval.
+"""
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from pymongo import monitoring
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+
+def format_labels(labels):
+    """Format label pairs as `{key="value",...}`"""
+    return '{%s}' % (','.join([
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels
+    ]))
+
+
+class Metric(object):
+    """Base Metric with label names"""
+    metric_type = ''
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def label_pairs(self, label_values):
+        return zip(self.label_names, label_values)
+
+    def snapshot(self):
+        """Copy of the values by label values"""
+        with self._lock:
+            return dict([(label_values, json.loads(json.dumps(value))) for label_values, value in self._values.items()])
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def render(self, values=None):
+        """Render values, defaults to the values of this process"""
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.metric_type),
+        ]
+        if values is None:
+            values = self.snapshot()
+        for label_values, value in sorted(values.items()):
+            lines.extend(self.render_value(label_values, value))
+        return lines
+
+
+class Counter(Metric):
+    """Monotonic counter"""
+    metric_type = 'counter'
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def merge_value(self, value, other):
+        return value + other
+
+    def render_value(self, label_values, value):
+        return ['%s%s %s' % (self.name, format_labels(self.label_pairs(label_values)), value)]
+
+
+class Histogram(Metric):
+    """Histogram with fixed upper bounds"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, label_values=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def merge_value(self, value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], value[2] + other[2]]
+
+    @contextmanager
+    def time(self, label_values=()):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, label_values)
+
+    def render_value(self, label_values, value):
+        counts, total, count = value
+        labels = self.label_pairs(label_values)
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            lines.append('%s_bucket%s %s' % (self.name, format_labels(labels + [('le', bound)]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, format_labels(labels), repr(total)))
+        lines.append('%s_count%s %s' % (self.name, format_labels(labels), count))
+        return lines
+
+
+PID = os.getpid()
+REGISTRY = []
+
+
+def register(metric):
+    """Add metric to the exposed registry"""
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    """Render all registered metrics in text format, merged over all processes in multiprocess mode"""
+    values = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(values.get(metric.name, {})))
+    return '\n'.join(lines) + '\n'
+
+
+def reset_pid():
+    """Start with empty metrics and a new multiprocess file after fork"""
+    global PID
+    PID = os.getpid()
+    _multiprocess['path'] = None
+    _multiprocess['flushed_at'] = 0.0
+    for metric in REGISTRY:
+        metric.clear()
+
+
+# -------------------------------------------------------------------------
+# Multiprocess Mode
+# -------------------------------------------------------------------------
+_multiprocess = {'directory': None, 'interval': 1.0, 'path': None, 'flushed_at': 0.0}
+_flush_lock = threading.Lock()
+
+
+def enable_multiprocess(directory=None, flush_interval=1.0):
+    """Share metrics of forked processes through files in `directory`.
+
+    Called in the parent process before forking workers. Removes files of
+    earlier runs, a temporary directory is created without `directory`.
+    Returns the directory.
+    """
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='shoecase-metrics-')
+    elif not os.path.isdir(directory):
+        os.makedirs(directory)
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+        os.remove(path)
+    _multiprocess['directory'] = directory
+    _multiprocess['interval'] = flush_interval
+    return directory
+
+
+def process_path():
+    """Metrics file of this process, unique also when pids are reused"""
+    if _multiprocess['path'] is None:
+        _multiprocess['path'] = os.path.join(
+            _multiprocess['directory'], 'metrics_%s_%s.json' % (PID, uuid.uuid4().hex))
+    return _multiprocess['path']
+
+
+def snapshot():
+    """Values of this process by metric name"""
+    return dict([(metric.name, metric.snapshot()) for metric in REGISTRY])
+
+
+def flush(force=False):
+    """Write metrics of this process to its file, at most every flush interval unless forced"""
+    if _multiprocess['directory'] is None:
+        return
+    now = time.time()
+    if not force and now - _multiprocess['flushed_at'] < _multiprocess['interval']:
+        return
+    with _flush_lock:
+        _multiprocess['flushed_at'] = now
+        path = process_path()
+        data = dict([
+            (name, [[list(label_values), value] for label_values, value in values.items()])
+            for name, values in snapshot().items()
+        ])
+        # ---------------------------------------------------------------------
+        # Replace atomically, readers never see a partial file
+        # ---------------------------------------------------------------------
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            json.dump(data, f)
+        os.rename(temp_path, path)
+
+
+def collect():
+    """Values by metric name, merged with the files of other processes in multiprocess mode"""
+    values = snapshot()
+    if _multiprocess['directory'] is None:
+        return values
+
+    own_path = _multiprocess['path']
+    metrics_by_name = dict([(metric.name, metric) for metric in REGISTRY])
+    for path in glob.glob(os.path.join(_multiprocess['directory'], 'metrics_*.json')):
+        if path == own_path:
+            continue
+        try:
+            with open(path, 'rb') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            continue
+        for name, items in data.items():
+            metric = metrics_by_name.get(name)
+            if metric is None:
+                continue
+            merged = values.setdefault(name, {})
+            for label_values, value in items:
+                label_values = tuple(label_values)
+                if label_values in merged:
+                    value = metric.merge_value(merged[label_values], value)
+                merged[label_values] = value
+    return values
+
+
+# -------------------------------------------------------------------------
+# Metric Definitions
+# -------------------------------------------------------------------------
+http_request_duration = register(Histogram(
+    'shoecase_http_request_duration_seconds', 'API request latency',
+    ('endpoint', 'method', 'status'),
+    ))
+http_request_mongo_commands = register(Histogram(
+    'shoecase_http_request_mongo_commands', 'Mongo commands per API request',
+    ('endpoint',), buckets=COUNT_BUCKETS,
+    ))
+mongo_commands = register(Counter(
+    'shoecase_mongo_commands_total', 'Mongo commands',
+    ('command', 'status'),
+    ))
+mongo_command_duration = register(Histogram(
+    'shoecase_mongo_command_duration_seconds', 'Mongo command duration',
+    ('command',),
+    ))
+serialization_duration = register(Histogram(
+    'shoecase_serialization_duration_seconds', 'Time spent in model_to_dict',
+    ('model',),
+    ))
+
+
+# -------------------------------------------------------------------------
+# Mongo Commands
+# -------------------------------------------------------------------------
+_request_state = threading.local()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Count Mongo commands, their duration and the commands of the current request"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event, 'succeeded')
+
+    def failed(self, event):
+        self.record(event, 'failed')
+
+    def record(self, event, status):
+        mongo_commands.inc((event.command_name, status))
+        mongo_command_duration.observe(event.duration_micros / 1000000.0, (event.command_name,))
+        if getattr(_request_state, 'active', False):
+            _request_state.mongo_commands += 1
+
+
+mongo_command_listener = MongoCommandListener()
+
+
+# -------------------------------------------------------------------------
+# Flask Request Instrumentation
+# -------------------------------------------------------------------------
+def instrument_app(app):
+    """Record latency and Mongo commands of every request"""
+    from flask import request
+
+    @app.before_request
+    def start_request_metrics():
+        _request_state.active = True
+        _request_state.mongo_commands = 0
+        _request_state.started_at = time.time()
+
+    @app.after_request
+    def stop_request_metrics(response):
+        if getattr(_request_state, 'active', False):
+            endpoint = request.endpoint or 'unknown'
+            http_request_duration.observe(
+                time.time() - _request_state.started_at,
+                (endpoint, request.method, response.status_code),
+                )
+            http_request_mongo_commands.observe(_request_state.mongo_commands, (endpoint,))
+            _request_state.active = False
+        flush()
+        return response
+
+    return app
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from pymongo import UpdateOne
+import models
+import normalize
+import ranking
+import utils
+from custom_log import prepare_logger
+
+
+logger = prepare_logger(__name__, __file__)
+
+
+BULK_WRITE_SIZE = 1000
+LISTING_PAGE_CACHE_SIZE = 10000
+
+
+def bulk_update(collection, operations, batch_size=BULK_WRITE_SIZE):
+    """Write update operations in batches. Returns number of modified documents"""
+    modified = 0
+    batch = []
+    for operation in operations:
+        batch.append(operation)
+        if len(batch) >= batch_size:
+            modified = modified + collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        modified = modified + collection.bulk_write(batch, ordered=False).modified_count
+    return modified
+
+
+def backfill_product_sku_keys():
+    """Migrate products to doc_version 1.1: store normalized `sku_key` for indexed lookups"""
+    collection = models.Product._mongometa.collection
+    cursor = collection.find(
+        {'sku_key': {'$exists': False}},
+        projection={'sku': 1},
+        batch_size=BULK_WRITE_SIZE,
+        )
+
+    operations = (
+        UpdateOne({'_id': doc['_id']}, {'$set': {
+            'sku_key': utils.cleanSKUForLookup(doc.get('sku')),
+            'doc_version': 1.1,
+            }})
+        for doc in cursor
+    )
+    return bulk_update(collection, operations)
+
+
+def backfill_product_search_text():
+    """Migrate products to doc_version 1.2: store `search_text` for the text index"""
+    brand_names = dict([
+        (doc['_id'], doc.get('brand'))
+        for doc in models.Brand._mongometa.collection.find(projection={'brand': 1})
+    ])
+
+    collection = models.Product._mongometa.collection
+    cursor = collection.find(
+        {'search_text': {'$exists': False}},
+        projection={'brand': 1, 'properties': 1},
+        batch_size=BULK_WRITE_SIZE,
+        )
+
+    operations = (
+        UpdateOne({'_id': doc['_id']}, {'$set': {
+            'search_text': utils.build_search_text(
+                brand_names.get(doc.get('brand')), doc.get('properties')
+                ),
+            'doc_version': 1.2,
+            }})
+        for doc in cursor
+    )
+    return bulk_update(collection, operations)
+
+
+def drop_product_sku_lookup_index():
+    """Drop `sku_lookup_idx`, replaced by the covering `sku_history_idx`"""
+    collection = models.Product._mongometa.collection
+    if 'sku_lookup_idx' in collection.index_information():
+        collection.drop_index('sku_lookup_idx')
+        return 1
+    return 0
+
+
+def backfill_listing_ranks():
+    """Build listing rank index from listings embedded in products.
+
+    Ranks are positioned like the importer does: on the page position of the
+    listing item, counted in products like the page listing size. Listing
+    items stored without page position fall back to their position, like
+    the importer does for items without one. Absolute positions of every
+    website are refreshed afterwards.
+    """
+    listing_page_collection = models.ProductListingPage._mongometa.collection
+
+    def find_listing_page(listing_pk):
+        return listing_page_collection.find_one(
+            {'_id': listing_pk},
+            projection={'page_number': 1, 'page_listing_size': 1, 'category': 1, 'sorted_by': 1, 'crawled_at': 1},
+            )
+    get_listing_page = normalize.BoundedMemo(find_listing_page, max_entries=LISTING_PAGE_CACHE_SIZE)
+
+    cursor = models.Product._mongometa.collection.find(
+        {'listings.0': {'$exists': True}},
+        projection={'sku': 1, 'website': 1, 'listings.listing': 1, 'listings.position': 1,
+                    'listings.page_position': 1, 'listings.price': 1},
+        batch_size=BULK_WRITE_SIZE,
+        )
+
+    websites = set()
+
+    def operations():
+        for doc in cursor:
+            for listing_item in doc['listings']:
+                listing = get_listing_page(listing_item.get('listing'))
+                if not listing:
+                    continue
+                websites.add(doc['website'])
+                yield ranking.rank_operation(
+                    website_pk=doc['website'],
+                    sku=doc['sku'],
+                    product_pk=doc['_id'],
+                    listing=listing,
+                    position=listing_item.get('page_position') or listing_item.get('position') or 1,
+                    price=listing_item.get('price'),
+                    )
+
+    modified = bulk_update(models.ListingRank._mongometa.collection, operations())
+    for website_pk in websites:
+        modified = modified + ranking.refresh_absolute_positions(website_pk)
+    return modified
+
+
+# -------------------------------------------------------------------------
+# Migrations in order of execution. Every migration must be safe to re-run
+# -------------------------------------------------------------------------
+MIGRATIONS = [
+    backfill_product_sku_keys,
+    backfill_product_search_text,
+    drop_product_sku_lookup_index,
+    backfill_listing_ranks,
+]
+
+
+# -------------------------------------------------------------------------
+# Standalone runner
+# -------------------------------------------------------------------------
+def main():
+    """Main Application"""
+    for migration in MIGRATIONS:
+        logger.info("Start migration %s" % (migration.__name__))
+        modified = migration()
+        msg = "Finished migration %s: modified %s" % (migration.__name__, modified)
+        logger.info(msg)
+        print msg
+
+
+if __name__ == "__main__":
+    main()
@@ -6,22 +6,34 @@ from pymodm import (
     connect, 
     errors as pymodm_errors,
     )
+from pymodm.context_managers import no_auto_dereference
 from pymongo import IndexModel, TEXT
 from pymongo.errors import DuplicateKeyError
 from bson.objectid import ObjectId
 from bson.json_util import dumps
 import config
 import utils
-from urlparse import urlparse
+from cache import ResolverCache
+import metrics
+import profiling
 from pymodm.vendor import parse_datetime
-import pdb
-import re
+
+
+def connect_database():
+    """(Re)Create the database connection.
+
+    MongoClient is not fork-safe; forked worker processes must call this again.
+    """
+    connect(
+        utils.convertConfigIntoMongoURI(config),
+        event_listeners=[metrics.mongo_command_listener],
+        )
 
 
 # -------------------------------------------------------------------------
 # Make connection to the database.
 # -------------------------------------------------------------------------
-connect(utils.convertConfigIntoMongoURI(config))
+connect_database()
 
 
 class MongoModel(PyMongoModel):
@@ -31,7 +43,8 @@ class MongoModel(PyMongoModel):
     # -------------------------------------------------------------------------
     def to_dict(self, *args, **kwargs):
         """Convert Mongo item structure into a python dictionary"""
-        return model_to_dict(self, *args, **kwargs)
+        with metrics.serialization_duration.time((self.__class__.__name__,)):
+            return model_to_dict(self, *args, **kwargs)
 
     def to_json(self, *args, **kwargs):
         """Convert Mongo item structure into a json variable"""
@@ -53,19 +66,22 @@ class EnsureEntry(object):
         If entry does not exists the function will create an entry and return the created entry
         """
         try:
-            self.full_clean()
+            with profiling.stage('validate'):
+                self.full_clean()
             ensure_fields = self.__class__.ensure_fields
             lookup_props = self.to_son()
 
             if len(ensure_fields) > 0:
                 lookup_props = dict([i for i in lookup_props.items() if i[0] in ensure_fields])
 
-            item = self.__class__.objects.get(lookup_props)
+            with profiling.stage('lookup'):
+                item = self.__class__.objects.get(lookup_props)
             self.pk = item.pk
             return item
         except pymodm_errors.DoesNotExist as e:
             try:
-                return self.save(*args, **kwargs)
+                with profiling.stage('write'):
+                    return self.save(*args, **kwargs)
             except DuplicateKeyError as e:
                 item = self.__class__.objects.get(self.to_son())
                 self.pk = item.pk
@@ -184,8 +200,7 @@ class Website(
         if check_is_valid_object_id(website_id):
             lookup_args['_id'] = ObjectId(website_id)
         elif isinstance(website_id, basestring):
-            found = cls.objects.get({'website_uid': website_id.lower().strip()})
-            lookup_args['_id'] = found.pk
+            lookup_args['_id'] = resolve_uid(cls, 'website_uid', website_id.lower().strip())
         else:
             raise ValueError("'%s' is not valid website lookup value" % (website_id))
         return lookup_args
@@ -243,8 +258,7 @@ class Brand(
         if check_is_valid_object_id(brand_id):
             lookup_args['_id'] = ObjectId(brand_id)
         elif isinstance(brand_id, basestring):
-            found = cls.objects.get({'brand_uid': brand_id.lower().strip()})
-            lookup_args['_id'] = found.pk
+            lookup_args['_id'] = resolve_uid(cls, 'brand_uid', brand_id.lower().strip())
         else:
             raise ValueError("'%s' is not valid brand lookup value" % (brand_id))
         return lookup_args
@@ -347,8 +361,13 @@ class ProductListingPage(
 
 
 class ProductListingItem(EmbeddedMongoModel):
-    """Embedded Product Listing Model"""
+    """Embedded Product Listing Model.
+
+    `position` counts the listing items of the page including variants,
+    `page_position` counts products like the page listing size.
+    """
     position = fields.IntegerField(required=True, default=1)
+    page_position = fields.IntegerField()
     price = fields.FloatField(required=True)
     on_sale = fields.BooleanField(required=True, default=False)
     discount_percentage = fields.FloatField(default=0.0)
@@ -376,16 +395,14 @@ class ProductListingItem(EmbeddedMongoModel):
         """Custom Clean values."""
 
         # -------------------------------------------------------------------------
-        # Determine if discount was set and that on_sale is correctly set
-        # -------------------------------------------------------------------------
-        if self.discount_percentage and isinstance(self.discount_percentage, float) and self.discount_percentage > 0.0:
-            self.on_sale = True
-
-        # -------------------------------------------------------------------------
-        # Make sure that discount_percentage is zero if not on_sale
+        # Discounted is on sale, not on sale has no discount
         # -------------------------------------------------------------------------
-        if not self.on_sale:
-            self.discount_percentage = 0.0
+        values = utils.normalizeSaleValues({
+            "discount_percentage": self.discount_percentage,
+            "on_sale": self.on_sale,
+        })
+        self.on_sale = values['on_sale']
+        self.discount_percentage = values['discount_percentage']
 
 
 class Product(
@@ -400,6 +417,7 @@ class Product(
     # Model Field Definitions
     # -------------------------------------------------------------------------
     sku = fields.CharField(required=True)
+    sku_key = fields.CharField()  # Normalized sku for indexed lookups
     name = fields.CharField(required=True)
     product_type = fields.CharField(default='')
     url = fields.URLField(required=True)
@@ -409,6 +427,7 @@ class Product(
     on_sale = fields.BooleanField(required=True, default=False)
     discount_percentage = fields.FloatField(default=0.0)
     properties = fields.DictField(required=True, default={})
+    search_text = fields.CharField()  # Brand and property values for the text index
 
     # -------------------------------------------------------------------------
     # Reference Brand Model with Cascade if referenced model is deleted
@@ -433,28 +452,28 @@ class Product(
     # -------------------------------------------------------------------------
     # Document Version to keep track of model migrations
     # -------------------------------------------------------------------------
-    doc_version = fields.FloatField(required=True, default=1.0)
+    doc_version = fields.FloatField(required=True, default=1.2)
 
     def clean(self):
         """Clean Values"""
         # -------------------------------------------------------------------------
-        # Determine if discount was set and that on_sale is correctly set
-        # -------------------------------------------------------------------------
-        if self.discount_percentage and isinstance(self.discount_percentage, float) and self.discount_percentage > 0.0:
-            self.on_sale = True
-
-        # -------------------------------------------------------------------------
-        # Make sure that discount_percentage is zero if not on_sale
-        # -------------------------------------------------------------------------
-        if not self.on_sale:
-            self.discount_percentage = 0.0
-
-        # -------------------------------------------------------------------------
-        # Extract path from url if path wasn't set
-        # -------------------------------------------------------------------------
-        if self.url and not self.path:
-            parsed_url = urlparse(self.url)
-            self.path = parsed_url.path
+        # Sale values, path from url if path wasn't set, normalized sku to lookup
+        # case-insensitive by index and searchable text if brand is available
+        # without dereferencing. Shared with the database-free `extract`
+        # -------------------------------------------------------------------------
+        with no_auto_dereference(Product):
+            brand = self.brand
+        values = utils.normalizeProductValues({
+            "discount_percentage": self.discount_percentage,
+            "on_sale": self.on_sale,
+            "url": self.url,
+            "path": self.path,
+            "sku": self.sku,
+            "properties": self.properties,
+        }, brand_name=brand.brand if isinstance(brand, Brand) else None)
+        for name in ('discount_percentage', 'on_sale', 'path', 'sku_key', 'search_text'):
+            if name in values:
+                setattr(self, name, values[name])
 
         # # -------------------------------------------------------------------------
         # # Clean Extra Properties
@@ -468,12 +487,52 @@ class Product(
         """Meta class for Product Model"""
         collection_name = "products"
 
-        # # -------------------------------------------------------------------------
-        # # Create Unique Index
-        # # -------------------------------------------------------------------------
-        # indexes = [
-        #     IndexModel([('sku', TEXT), ('brand', TEXT), ('website', TEXT)], name="uprod_idx", unique=True),
-        # ]
+        # -------------------------------------------------------------------------
+        # Create Lookup Index
+        # -------------------------------------------------------------------------
+        indexes = [
+            # -------------------------------------------------------------------------
+            # SKU Lookup Index. Also covers the price history projection
+            # -------------------------------------------------------------------------
+            IndexModel(
+                [('website', 1), ('sku_key', 1), ('crawled_at', 1), ('price', 1), ('discount_percentage', 1)],
+                name="sku_history_idx",
+                ),
+
+            # -------------------------------------------------------------------------
+            # Search Indexes. Equality filters first, keyset `_id` second and the
+            # other filters last, so filtered searches are answered from the index.
+            # Common combinations of equality filters have an index of their own,
+            # so rare combinations don't scan the range of a single filter
+            # -------------------------------------------------------------------------
+            IndexModel(
+                [('name', TEXT), ('product_type', TEXT), ('search_text', TEXT)],
+                name="search_text_idx",
+                weights={'name': 10, 'product_type': 5, 'search_text': 1},
+                default_language='none',
+                ),
+            IndexModel([('website', 1), ('_id', 1), ('on_sale', 1), ('price', 1), ('discount_percentage', 1)],
+                name="search_website_idx"),
+            IndexModel([('brand', 1), ('_id', 1), ('on_sale', 1), ('price', 1), ('discount_percentage', 1)],
+                name="search_brand_idx"),
+            IndexModel([('product_type', 1), ('_id', 1), ('on_sale', 1), ('price', 1), ('discount_percentage', 1)],
+                name="search_product_type_idx"),
+            IndexModel([('on_sale', 1), ('_id', 1), ('price', 1), ('discount_percentage', 1)],
+                name="search_on_sale_idx"),
+            IndexModel([('website', 1), ('brand', 1), ('_id', 1), ('product_type', 1), ('on_sale', 1), ('price', 1),
+                        ('discount_percentage', 1)],
+                name="search_website_brand_idx"),
+            IndexModel([('website', 1), ('product_type', 1), ('_id', 1), ('on_sale', 1), ('price', 1),
+                        ('discount_percentage', 1)],
+                name="search_website_product_type_idx"),
+            IndexModel([('website', 1), ('on_sale', 1), ('_id', 1), ('price', 1), ('discount_percentage', 1)],
+                name="search_website_on_sale_idx"),
+            IndexModel([('brand', 1), ('product_type', 1), ('_id', 1), ('on_sale', 1), ('price', 1),
+                        ('discount_percentage', 1)],
+                name="search_brand_product_type_idx"),
+            IndexModel([('brand', 1), ('on_sale', 1), ('_id', 1), ('price', 1), ('discount_percentage', 1)],
+                name="search_brand_on_sale_idx"),
+        ]
 
     # -------------------------------------------------------------------------
     # Helper Functions
@@ -485,16 +544,202 @@ class Product(
         if check_is_valid_object_id(product_id):
             lookup_args['_id'] = ObjectId(product_id)
         elif isinstance(product_id, basestring) and check_is_valid_object_id(website_id):
-            regexp_lookup = r'^(%s)$' % (re.escape(product_id))
-            found = cls.objects.get({
-                'sku': re.compile(regexp_lookup, re.IGNORECASE),
+            # -------------------------------------------------------------------------
+            # Match normalized sku by index, latest crawled product first
+            # -------------------------------------------------------------------------
+            found = cls.objects.raw({
                 'website': ObjectId(website_id),
-                })
+                'sku_key': utils.cleanSKUForLookup(product_id),
+                }).order_by([('crawled_at', -1)]).first()
             lookup_args['_id'] = found.pk
         else:
             raise ValueError("'%s' is not valid product lookup value" % (product_id))
         return lookup_args
 
+    @classmethod
+    def get_price_history(cls, website_pk, sku):
+        """Get price history of sku as parallel lists ordered by crawl time.
+
+        Only indexed fields are projected, so the query is covered by `sku_history_idx`
+        """
+        cursor = cls._mongometa.collection.find(
+            {'website': website_pk, 'sku_key': utils.cleanSKUForLookup(sku)},
+            projection={'_id': 0, 'crawled_at': 1, 'price': 1, 'discount_percentage': 1},
+            ).sort([('crawled_at', 1)])
+
+        history = {
+            "crawled_at": [],
+            "price": [],
+            "discount_percentage": [],
+        }
+        for doc in cursor:
+            history['crawled_at'].append(doc.get('crawled_at'))
+            history['price'].append(doc.get('price'))
+            history['discount_percentage'].append(doc.get('discount_percentage'))
+        return history
+
+    @classmethod
+    def get_search_arguments(cls, text=None, website_id=None, brand_id=None, product_type=None,
+                             on_sale=None, min_price=None, max_price=None, min_discount=None,
+                             after=None):
+        """Convert search filters into product query.
+
+        Results are paged by `_id`; `after` is the `_id` of the last seen product.
+        """
+        query = {}
+        if text:
+            query['$text'] = {'$search': text}
+        if website_id:
+            query['website'] = Website.get_lookup_arguments(website_id)['_id']
+        if brand_id:
+            query['brand'] = Brand.get_lookup_arguments(brand_id)['_id']
+        if product_type:
+            query['product_type'] = product_type
+        if on_sale is not None:
+            query['on_sale'] = on_sale
+
+        price = {}
+        if min_price is not None:
+            price['$gte'] = min_price
+        if max_price is not None:
+            price['$lte'] = max_price
+        if price:
+            query['price'] = price
+
+        if min_discount is not None:
+            query['discount_percentage'] = {'$gte': min_discount}
+
+        if after is not None:
+            if not check_is_valid_object_id(after):
+                raise ValueError("'%s' is not valid search cursor" % (after))
+            query['_id'] = {'$gt': ObjectId(after)}
+        return query
+
+
+
+class ListingRank(MongoModel):
+    """Listing Rank Model.
+
+    Position of a website product in a category listing of a crawl, maintained
+    by `ranking` during the listing import pass.
+    """
+    # -------------------------------------------------------------------------
+    # Model Field Definitions
+    # -------------------------------------------------------------------------
+    website = fields.ReferenceField(Website, required=True, on_delete=fields.ReferenceField.CASCADE)
+    sku_key = fields.CharField(required=True)
+    product = fields.ReferenceField(Product, on_delete=fields.ReferenceField.CASCADE)
+    listing = fields.ReferenceField(ProductListingPage, required=True, on_delete=fields.ReferenceField.CASCADE)
+
+    category = fields.CharField(required=True)
+    sorted_by = fields.CharField()
+    crawled_at = fields.DateTimeField(required=True)
+    crawl_date = fields.DateTimeField(required=True)
+    page_number = fields.IntegerField(required=True, default=1)
+    position = fields.IntegerField(required=True, default=1)
+    absolute_position = fields.IntegerField(required=True, default=1)
+    price = fields.FloatField()
+
+    # -------------------------------------------------------------------------
+    # Document Version to keep track of model migrations
+    # -------------------------------------------------------------------------
+    doc_version = fields.FloatField(required=True, default=1.0)
+
+    class Meta:
+        """Meta class for Listing Rank Model"""
+        collection_name = "listing_ranks"
+
+        indexes = [
+            IndexModel([('listing', 1), ('sku_key', 1)], name="urank_idx", unique=True),
+            IndexModel(
+                [('website', 1), ('sku_key', 1), ('category', 1), ('sorted_by', 1), ('crawled_at', 1)],
+                name="rank_history_idx",
+                ),
+            IndexModel(
+                [('website', 1), ('category', 1), ('sorted_by', 1), ('crawl_date', -1),
+                 ('page_number', 1), ('position', 1)],
+                name="rank_top_idx",
+                ),
+        ]
+
+
+class ProductStats(MongoModel):
+    """Precomputed Product Statistics Model.
+
+    Rebuilt by `stats.refresh_website_stats` after each import, API endpoints
+    only read from this collection. Website brand stats are the partial
+    summaries merged into the brand stats, with the count of every price.
+    """
+    SCOPE_WEBSITE = 'website'
+    SCOPE_BRAND = 'brand'
+    SCOPE_WEBSITE_BRAND = 'website_brand'
+
+    # -------------------------------------------------------------------------
+    # Model Field Definitions
+    # -------------------------------------------------------------------------
+    scope = fields.CharField(required=True, choices=(SCOPE_WEBSITE, SCOPE_BRAND, SCOPE_WEBSITE_BRAND))
+    website = fields.ReferenceField(Website, on_delete=fields.ReferenceField.CASCADE)
+    brand = fields.ReferenceField(Brand, on_delete=fields.ReferenceField.CASCADE)
+
+    total = fields.IntegerField(required=True, default=0)
+    on_sale = fields.IntegerField(required=True, default=0)
+    on_sale_ratio = fields.FloatField(required=True, default=0.0)
+    price_quantiles = fields.DictField()
+    discount_histogram = fields.ListField(field=fields.DictField())
+    price_counts = fields.ListField(field=fields.ListField())
+    refreshed_at = fields.DateTimeField(required=True)
+
+    # -------------------------------------------------------------------------
+    # Document Version to keep track of model migrations
+    # -------------------------------------------------------------------------
+    doc_version = fields.FloatField(required=True, default=1.0)
+
+    class Meta:
+        """Meta class for Product Stats Model"""
+        collection_name = "product_stats"
+
+        # -------------------------------------------------------------------------
+        # Create Unique Index
+        # -------------------------------------------------------------------------
+        indexes = [
+            IndexModel([('scope', 1), ('website', 1), ('brand', 1)], name="ustats_idx", unique=True),
+        ]
+
+
+class ProductMatch(MongoModel):
+    """Product Match Model.
+
+    One entry per website product (sku). Entries sharing `cluster` are the same
+    product at different websites. Maintained by `matching.refresh_website_matches`.
+    """
+    # -------------------------------------------------------------------------
+    # Model Field Definitions
+    # -------------------------------------------------------------------------
+    website = fields.ReferenceField(Website, required=True, on_delete=fields.ReferenceField.CASCADE)
+    sku = fields.CharField(required=True)
+    sku_key = fields.CharField(required=True)
+    name = fields.CharField()
+    brand_uid = fields.CharField()
+    price = fields.FloatField()
+    tokens = fields.ListField(field=fields.CharField())
+    block_keys = fields.ListField(field=fields.CharField())
+    cluster = fields.ObjectIdField(required=True)
+
+    # -------------------------------------------------------------------------
+    # Document Version to keep track of model migrations
+    # -------------------------------------------------------------------------
+    doc_version = fields.FloatField(required=True, default=1.0)
+
+    class Meta:
+        """Meta class for Product Match Model"""
+        collection_name = "product_matches"
+
+        indexes = [
+            IndexModel([('website', 1), ('sku_key', 1)], name="umatch_idx", unique=True),
+            IndexModel([('block_keys', 1)], name="match_block_idx"),
+            IndexModel([('cluster', 1)], name="match_cluster_idx"),
+        ]
+
 
 def model_to_dict(item, **kwargs):
     """Convert Mongo Model entity into python dictionary"""
@@ -559,6 +804,74 @@ def model_to_dict(item, **kwargs):
     return data
 
 
+def son_to_dict(doc, **kwargs):
+    """Convert raw Mongo document into python dictionary without building a model instance"""
+    # -------------------------------------------------------------------------
+    # Boolean to convert ObjectId into string variable instead of ObjectId
+    # -------------------------------------------------------------------------
+    stringify_objectid = kwargs.get('stringify_objectid', True)
+
+    # -------------------------------------------------------------------------
+    # Exclude fields from being included in the python dictionary
+    # -------------------------------------------------------------------------
+    exclude_fields = kwargs.get('exclude_fields', ['doc_version', '_cls'])
+
+    if isinstance(doc, list):
+        return [son_to_dict(i, **kwargs) for i in doc]
+    elif isinstance(doc, dict):
+        data = {}
+        for field_id, field_value in doc.items():
+            if field_id in exclude_fields:
+                continue
+            data[field_id] = son_to_dict(field_value, **kwargs)
+        return data
+    elif isinstance(doc, ObjectId) and stringify_objectid:
+        return str(doc)
+    return doc
+
+
 def check_is_valid_object_id(value):
     """Check if value is a valid ObjectId or valid hex-string"""
     return ObjectId.is_valid(value)
+
+
+# -------------------------------------------------------------------------
+# Import Generation. Bumped after every import to invalidate process caches
+# -------------------------------------------------------------------------
+IMPORT_STATE_COLLECTION = 'import_state'
+
+
+def get_import_generation():
+    """Get current import generation"""
+    state = Website._mongometa.collection.database[IMPORT_STATE_COLLECTION].find_one({'_id': 'generation'})
+    return state['value'] if state else 0
+
+
+def bump_import_generation():
+    """Increase import generation"""
+    Website._mongometa.collection.database[IMPORT_STATE_COLLECTION].update_one(
+        {'_id': 'generation'}, {'$inc': {'value': 1}}, upsert=True,
+        )
+
+
+# -------------------------------------------------------------------------
+# Per-process cache of uid -> ObjectId lookups
+# -------------------------------------------------------------------------
+uid_resolver = ResolverCache(
+    ttl=config.RESOLVER_CACHE_TTL,
+    negative_ttl=config.RESOLVER_NEGATIVE_CACHE_TTL,
+    generation_loader=get_import_generation,
+    generation_poll_interval=config.RESOLVER_GENERATION_POLL_INTERVAL,
+    )
+
+
+def resolve_uid(model, field_id, uid):
+    """Resolve unique id field value into ObjectId. Raises `DoesNotExist` if unknown"""
+    def load():
+        found = model._mongometa.collection.find_one({field_id: uid}, projection={'_id': 1})
+        return found['_id'] if found else None
+
+    pk = uid_resolver.get((model.__name__, uid), load)
+    if pk is None:
+        raise model.DoesNotExist()
+    return pk
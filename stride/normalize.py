@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Text and price normalization.
+
+Patterns are precompiled and results of the repeated inputs (price strings,
+brand names, property keys) are kept in bounded memo caches. Output is
+identical to the original `utils` implementations, see `benchmarks.normalization`.
+"""
+import re
+import unicodedata
+
+
+# -------------------------------------------------------------------------
+# Pre-Compiled Regexp
+# -------------------------------------------------------------------------
+CLEAN_UID_REGEXP = re.compile(r'[^.\ a-zA-Z0-9_-]')
+CLEAN_DICT_KEY_REGEXP = re.compile(r'[^a-zA-Z0-9_-]')
+PRICE_CHARS_REGEXP = re.compile(r'[^0-9.,]')
+NON_DIGIT_REGEXP = re.compile(r'[^0-9]')
+MULTIPLE_SPACES_REGEXP = re.compile(r' +')
+
+DEFAULT_CACHE_SIZE = 4096
+
+_FAILED = object()
+
+
+class BoundedMemo(object):
+    """Memoize single argument function in a cache of at most `max_entries`.
+
+    The cache is emptied when full; the repeated inputs refill it right away.
+    Unhashable values are computed without caching. Values are cached per
+    type, equal values of different types (`1`, `1.0`, `True`, `'a'` and
+    `u'a'`) can have different results.
+    """
+
+    def __init__(self, func, max_entries=DEFAULT_CACHE_SIZE):
+        self.func = func
+        self.max_entries = max_entries
+        self.cache = {}
+
+    def __call__(self, value):
+        key = (type(value), value)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return self.func(value)
+
+        result = self.func(value)
+        if len(self.cache) >= self.max_entries:
+            self.cache.clear()
+        self.cache[key] = result
+        return result
+
+    def clear(self):
+        self.cache.clear()
+
+
+def _parse_price(value):
+    """Parse price value into float, `_FAILED` if not possible"""
+    try:
+        if isinstance(value, basestring):
+            # -------------------------------------------------------------------------
+            # Remove all except [0-9,.]. Replace all comma's with dots. split once on
+            # most right dot. join all entry and remove all remain dots
+            # -------------------------------------------------------------------------
+            value = ".".join([
+                NON_DIGIT_REGEXP.sub('', n) for n in PRICE_CHARS_REGEXP.sub('', value).replace(',', '.').rsplit('.', 1)
+            ])
+        return float(value)
+    except:
+        return _FAILED
+
+_parse_price_memo = BoundedMemo(_parse_price)
+
+
+def convert_html_price_to_float(value, default=None):
+    """Convert value input into float"""
+    result = _parse_price_memo(value)
+    return default if result is _FAILED else result
+
+
+def convert_html_prices(values, default=None):
+    """Convert list of price values into floats in one call"""
+    parse = _parse_price_memo
+    return [default if r is _FAILED else r for r in [parse(v) for v in values]]
+
+
+def _to_ascii(value):
+    """Remove all exotic characters and if possible replace with ascii equivalent"""
+    try:
+        if not isinstance(value, unicode):
+            value = unicode(value, 'utf-8')
+        return unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
+    except:
+        return str(value)
+
+
+def _clean_string_for_uid(value):
+    value = _to_ascii(value)
+
+    # -------------------------------------------------------------------------
+    # Lower Case and remove multiple, leading and trailing spaces
+    # -------------------------------------------------------------------------
+    return MULTIPLE_SPACES_REGEXP.sub(' ', CLEAN_UID_REGEXP.sub('', value.lower().strip()))
+
+clean_string_for_uid = BoundedMemo(_clean_string_for_uid)
+
+
+def _clean_key_for_dict(value):
+    value = _to_ascii(value)
+
+    # -------------------------------------------------------------------------
+    # Lower Case and remove multiple, leading and trailing spaces
+    # -------------------------------------------------------------------------
+    return MULTIPLE_SPACES_REGEXP.sub('', CLEAN_DICT_KEY_REGEXP.sub('', value.lower().strip()))
+
+clean_key_for_dict = BoundedMemo(_clean_key_for_dict)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Import stage profiler.
+
+Code marks its stages with `stage(name)`: JSON decoding, parsing, extraction,
+model validation, Mongo lookups and writes. Stages are only timed while a
+`StageProfiler` is active, otherwise `stage` returns a shared no-op.
+
+The profiler accumulates time and call counts per provider, pass and stage,
+and keeps the slowest lines of every stage. Every dataset line is closed with
+`end_line`, the time of a line not spent in stages is reported as `other`.
+
+With a sample interval a sampling profiler runs on the CPU timer of the
+process, the stack samples are kept for the slowest lines and written as
+collapsed stacks (one `frame;frame;frame count` line per stack, the input of
+flame graph tools).
+"""
+import heapq
+import json
+import os.path
+import signal
+import time
+from datetime import datetime
+
+
+OTHER_STAGE = 'other'
+
+active = None
+
+
+class NullStage(object):
+    """Stage of an inactive profiler"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+def stage(name):
+    """Time a stage of the current line with the active profiler"""
+    if active is None:
+        return NULL_STAGE
+    return Stage(active, name)
+
+
+class Stage(object):
+    __slots__ = ('profiler', 'name', 'started')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.time() - self.started)
+        return False
+
+
+def push_slowest(heap, size, seconds, item):
+    """Keep the `size` slowest items in min-heap"""
+    if len(heap) < size:
+        heapq.heappush(heap, (seconds, item))
+    elif seconds > heap[0][0]:
+        heapq.heapreplace(heap, (seconds, item))
+
+
+class StageProfiler(object):
+    """Profiler of the import stages.
+
+    params:
+        - slowest: number of slowest lines kept per stage
+        - sample_interval: seconds of CPU time between stack samples, `None` disables sampling
+    """
+
+    def __init__(self, slowest=10, sample_interval=None):
+        self.slowest = slowest
+        self.sample_interval = sample_interval
+        self.started_at = None
+        self.passes = []
+        self.current = None
+        self._line_started = None
+        self._line_stages = {}
+        self._samples = {}
+
+    def start(self):
+        """Activate profiler"""
+        global active
+        active = self
+        self.started_at = datetime.utcnow()
+        if self.sample_interval:
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.sample_interval, self.sample_interval)
+
+    def stop(self):
+        """Deactivate profiler"""
+        global active
+        if self.sample_interval:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        active = None
+
+    def begin(self, provider, pass_name):
+        """Start timing the lines of a pass"""
+        self.current = {
+            "provider": provider,
+            "pass": pass_name,
+            "lines": 0,
+            "seconds": 0.0,
+            "stages": {},
+            "slowest": {},
+            "slowest_lines": [],
+        }
+        self.passes.append(self.current)
+        self._reset_line()
+
+    def _reset_line(self):
+        self._line_started = time.time()
+        self._line_stages = {}
+        self._samples = {}
+
+    def record(self, name, seconds):
+        stage_time = self._line_stages.setdefault(name, [0, 0.0])
+        stage_time[0] = stage_time[0] + 1
+        stage_time[1] = stage_time[1] + seconds
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append('%s:%s:%s' % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self._samples[key] = self._samples.get(key, 0) + 1
+
+    def end_line(self, **info):
+        """Close the current line, `info` identifies the line in the report"""
+        seconds = time.time() - self._line_started
+        current = self.current
+        current['lines'] = current['lines'] + 1
+        current['seconds'] = current['seconds'] + seconds
+
+        other = seconds
+        for name, (calls, stage_seconds) in self._line_stages.items():
+            stage_stats = current['stages'].setdefault(name, [0, 0.0])
+            stage_stats[0] = stage_stats[0] + calls
+            stage_stats[1] = stage_stats[1] + stage_seconds
+            push_slowest(current['slowest'].setdefault(name, []), self.slowest, stage_seconds, info)
+            other = other - stage_seconds
+
+        other_stats = current['stages'].setdefault(OTHER_STAGE, [0, 0.0])
+        other_stats[0] = other_stats[0] + 1
+        other_stats[1] = other_stats[1] + max(other, 0.0)
+
+        line = dict(info)
+        line['stages'] = dict([(name, stage_seconds) for name, (calls, stage_seconds) in self._line_stages.items()])
+        if self.sample_interval:
+            line['samples'] = self._samples
+        push_slowest(current['slowest_lines'], self.slowest, seconds, line)
+
+        self._reset_line()
+
+    def report(self):
+        """Machine readable report"""
+        passes = []
+        for current in self.passes:
+            total = current['seconds'] or 1.0
+            passes.append({
+                "provider": current['provider'],
+                "pass": current['pass'],
+                "lines": current['lines'],
+                "seconds": current['seconds'],
+                "stages": dict([
+                    (name, {
+                        "calls": calls,
+                        "seconds": seconds,
+                        "mean_ms": 1000.0 * seconds / calls if calls else 0.0,
+                        "share": seconds / total,
+                    })
+                    for name, (calls, seconds) in current['stages'].items()
+                ]),
+                "slowest": dict([
+                    (name, [dict(info, seconds=seconds) for seconds, info in sorted(heap, reverse=True)])
+                    for name, heap in current['slowest'].items()
+                ]),
+                "slowest_lines": [dict(line, seconds=seconds) for seconds, line in sorted(current['slowest_lines'], reverse=True)],
+            })
+        return {
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "sample_interval": self.sample_interval,
+            "passes": passes,
+        }
+
+    def summary(self):
+        """Printable summary of the report"""
+        out = []
+        for current in self.report()['passes']:
+            out.append("[%s] %s: %s lines in %.2fs" % (current['provider'], current['pass'], current['lines'], current['seconds']))
+            stages = sorted(current['stages'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+            for name, stats in stages:
+                slowest = current['slowest'].get(name)
+                out.append("    %s calls: %7s total: %8.2fs mean: %8.2fms share: %5.1f%%%s" % (
+                    name.ljust(10),
+                    stats['calls'],
+                    stats['seconds'],
+                    stats['mean_ms'],
+                    100.0 * stats['share'],
+                    " slowest: %.1fms line %s" % (1000.0 * slowest[0]['seconds'], slowest[0].get('line')) if slowest else '',
+                    ))
+        return '\n'.join(out)
+
+    def write(self, directory):
+        """Write JSON report, and collapsed stacks of the slowest lines when sampling. Returns report path"""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = 'import-%s' % (self.started_at.strftime('%Y-%m-%dT%H-%M-%S'))
+        report = self.report()
+
+        report_path = os.path.join(directory, '%s.json' % (name))
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True, default=unicode)
+
+        if self.sample_interval:
+            stacks = {}
+            for current in report['passes']:
+                for line in current['slowest_lines']:
+                    for stack, count in line.get('samples', {}).items():
+                        key = '%s;%s;line %s;%s' % (current['provider'], current['pass'], line.get('line'), stack)
+                        stacks[key] = stacks.get(key, 0) + count
+            with open(os.path.join(directory, '%s.stacks' % (name)), 'w') as stacks_file:
+                for stack, count in sorted(stacks.items()):
+                    stacks_file.write('%s %s\n' % (stack, count))
+        return report_path
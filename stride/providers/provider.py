@@ -3,6 +3,7 @@ import codecs
 import bs4 as BeautifulSoup
 import json
 from urlparse import urlparse
+import profiling
 
 
 class UnknownPageTypeException(Exception):
@@ -17,6 +18,23 @@ class BaseProvider(object):
     """
     provider_uid = ''
 
+    # -------------------------------------------------------------------------
+    # Version of the extraction, bump when the extracted data of a page changes
+    # -------------------------------------------------------------------------
+    extractor_version = 1
+
+    # -------------------------------------------------------------------------
+    # Extraction plans, compiled from the `DetailSpec` and `ListingSpec` of the provider
+    # -------------------------------------------------------------------------
+    detail_plan = None
+    listing_plan = None
+
+    # -------------------------------------------------------------------------
+    # Structured data fast path of detail pages, see `providers.stream`
+    # -------------------------------------------------------------------------
+    detail_stream_plan = None
+    structured_fast_path = True
+
     def __init__(self, fpath):
         self.source_file_path = fpath
         self.num_of_lines = None
@@ -35,13 +53,48 @@ class BaseProvider(object):
                 yield line
 
     def read_entry(self):
-        """Read File line by line with UTF-8 encoding; Returns generator with data line"""
-        with codecs.open(self.source_file_path, "r", "utf-8") as datasrc:
+        """Read File line by line with UTF-8 encoding; Returns generator with extracted entries.
+
+        The byte offset of the line in the file is added to the entry as `_line_offset`,
+        lines failing to extract are yielded like `read_line_entry` returns them.
+        """
+        with open(self.source_file_path, "rb") as datasrc:
             while True:
+                offset = datasrc.tell()
                 line = datasrc.readline()
                 if not line:
                     break
-                yield self.extract_date_line(line)
+                yield self.read_line_entry(line, offset)
+
+    def read_entry_at(self, offsets):
+        """Read the lines starting at byte `offsets`, in file order; Returns generator with extracted entries"""
+        with open(self.source_file_path, "rb") as datasrc:
+            for offset in sorted(set(offsets)):
+                datasrc.seek(offset)
+                yield self.read_line_entry(datasrc.readline(), offset)
+
+    def read_line_entry(self, line, offset):
+        """Extract entry of the dataset line at byte `offset`.
+
+        Decode and extraction errors don't raise: the entry is returned with
+        `extract_ok` False and the exception as `extract_error`, keeping the
+        decoded fields and body of the line if any.
+        """
+        try:
+            with profiling.stage('decode'):
+                entry = json.loads(line.decode('utf-8'))
+            if not isinstance(entry, dict):
+                raise ValueError("Line is not a JSON object")
+        except ValueError as error:
+            entry = {"htmlx": None, "extract_ok": False, "extract_error": error}
+        else:
+            try:
+                self.extract_entry(entry)
+            except Exception as error:
+                entry["extract_ok"] = False
+                entry["extract_error"] = error
+        entry['_line_offset'] = offset
+        return entry
 
     def count_lines(self, recount=False):
         """Calculated the number of lines in data source file.
@@ -56,35 +109,58 @@ class BaseProvider(object):
     def extract_date_line(self, date_line):
         """Extract data from line.
 
-        Reads `data_line` param as json entity and converts to python dictionary.
+        Reads `data_line` param as json entity and converts to python dictionary,
+        see `extract_entry`.
+        """
+        with profiling.stage('decode'):
+            entry = json.loads(date_line)
+        return self.extract_entry(entry)
 
-        The `body` value of the data_line_json is parsed by BeautifulSoup with lxml parser.
-        The BeautifulSoup instance of the body will be added to the return entry
+    def extract_entry(self, entry):
+        """Extract data of a decoded dataset line.
 
-        """
-        entry = json.loads(date_line)
+        The `body` value of the entry is parsed by BeautifulSoup with lxml parser.
+        The BeautifulSoup instance of the body will be added to the return entry, except
+        for detail pages extracted by the structured data fast path
 
+        """
         # -------------------------------------------------------------------------
-        # Prepare HTMLX
+        # Structured data fast path, detail pages are only parsed into a
+        # BeautifulSoup instance when fields are missing
         # -------------------------------------------------------------------------
         entry['htmlx'] = None
         entry['_parser_error'] = False
+        if entry.get('page_type') == 'product_detail' and 'body' in entry and \
+                self.structured_fast_path and self.detail_stream_plan is not None:
+            with profiling.stage('stream'):
+                values = self.detail_stream_plan.extract(entry['body'])
+            if values is not None:
+                with profiling.stage('extract'):
+                    entry["extracted_data"] = self.extract_product_detail_values(entry, values)
+                entry["extract_ok"] = True
+                return entry
+
+        # -------------------------------------------------------------------------
+        # Prepare HTMLX
+        # -------------------------------------------------------------------------
         if 'body' in entry:
             try:
-                entry['htmlx'] = BeautifulSoup.BeautifulSoup(entry['body'], 'lxml')
+                with profiling.stage('parse'):
+                    entry['htmlx'] = BeautifulSoup.BeautifulSoup(entry['body'], 'lxml')
             except:
                 entry['_parser_error'] = True
 
         if not entry['_parser_error']:
             epage_type = entry.get('page_type')
-            if epage_type == 'product_detail':
-                extracted_data = self.extract_product_detail_info(entry)
-            elif epage_type == 'product_listing':
-                extracted_data = self.extract_product_listing_items(entry)
-            else:
-                raise UnknownPageTypeException(
-                    "No extractor profile define for page_type: %s" % (epage_type)
-                    )
+            with profiling.stage('extract'):
+                if epage_type == 'product_detail':
+                    extracted_data = self.extract_product_detail_info(entry)
+                elif epage_type == 'product_listing':
+                    extracted_data = self.extract_product_listing_items(entry)
+                else:
+                    raise UnknownPageTypeException(
+                        "No extractor profile define for page_type: %s" % (epage_type)
+                        )
 
             entry["extracted_data"] = extracted_data
             entry["extract_ok"] = True
@@ -93,9 +169,89 @@ class BaseProvider(object):
 
         return entry
 
+    def release_entry(self, entry):
+        """Release the parse tree and body of an extracted entry.
+
+        BeautifulSoup trees are full of reference cycles, without decomposing
+        them they stay in memory until the cyclic garbage collector runs.
+        Decomposing the BeautifulSoup object itself only clears the root, its
+        tag children are decomposed instead; strings at the top level, like
+        the doctype and comments, can't be decomposed and are extracted.
+        """
+        htmlx = entry.get('htmlx')
+        if htmlx is not None:
+            for child in list(htmlx.contents):
+                if isinstance(child, BeautifulSoup.Tag):
+                    child.decompose()
+                else:
+                    child.extract()
+        entry['htmlx'] = None
+        entry.pop('body', None)
+
+    def extract_product_detail_info(self, entry):
+        """Extract Product Detail Data"""
+        docx = entry.get('htmlx', None)
+        if not docx or entry.get('_parser_error', False):
+            return
+
+        return self.extract_product_detail_values(entry, self.detail_plan.extract(docx))
+
+    def extract_product_detail_values(self, entry, values):
+        """Extract Product Detail Data from the field values of the `detail_plan`"""
+        item_info = self.combine_entry_data(
+            entry=entry,
+            item_info=self.parse_product_detail_item(values=values)
+            )
+
+        return {
+            "ok": True,
+            "item": item_info,
+            "errmsg": None,
+        }
+
+    def extract_product_listing_items(self, entry):
+        """Parse Product Listing Data.
+
+        Listing items are found by the `listing_plan`, an item can be expanded
+        into multiple variants: a list of item infos. Items failing to parse are
+        skipped and listed in `failed_items` with their page position and error.
+        """
+        docx = entry.get('htmlx', None)
+        if not docx or entry.get('_parser_error', False):
+            return
+
+        page_position = 0
+        failed = 0
+        processed = 0
+        items = []
+        errmsgs = []
+        failed_items = []
+        for list_item in self.listing_plan.iter_items(docx):
+            page_position = page_position + 1
+            try:
+                item_info = self.parse_product_listing_item(xitem=list_item)
+                for i in (item_info if isinstance(item_info, list) else [item_info]):
+                    i['page_position'] = page_position
+                    items.append(self.combine_entry_data(entry, i))
+                processed = processed + 1
+            except Exception as error:
+                failed = failed + 1
+                errmsgs.append(str(error))
+                failed_items.append({"page_position": page_position, "error": error})
+
+        return {
+            "items": items,
+            "number_of_items": page_position,
+            "failed": failed,
+            "processed": processed,
+            "errmsgs": errmsgs,
+            "failed_items": failed_items,
+        }
+
     def combine_entry_data(self, entry, item_info=None):
         """Combine entry data and item_info to ensure default fields are within the dataset"""
-        item_info = item_info or {}
+        if item_info is None:
+            item_info = {}
 
         page_type = entry.get('page_type')
         if page_type == 'product_listing':
@@ -141,62 +297,177 @@ class BaseProvider(object):
             return default
 
 
+def calc_listing_price_info(price_special, price_listing, price_normal):
+    """Listing price info; a special price lower than the listing price is the listing price"""
+    price_info = {
+        'price_special': price_special,
+        'price_listing': price_listing,
+        'price_normal': price_normal,
+    }
+    if price_special and price_special < price_listing:
+        price_info['price_listing'] = price_special
+
+        if price_normal and price_normal > 0.0:
+            price_info['price_discount'] = (1.0 - (price_special / price_normal)) * 100.0
+
+    return price_info
+
+
+# -------------------------------------------------------------------------
+# Extracted item records
+# -------------------------------------------------------------------------
+MISSING = object()
+
+
+class ItemRecord(object):
+    """Extracted item with dict-like access.
+
+    Fields are slots, records have no per-instance dict. Fields without a
+    default are missing until set, like the keys of a dict. Use `to_dict` where
+    a real dict is needed.
+    """
+    __slots__ = ()
+
+    # -------------------------------------------------------------------------
+    # Default values of fields, `dict` creates a new dict per record
+    # -------------------------------------------------------------------------
+    defaults = {}
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            value = values.get(name, self.defaults.get(name, MISSING))
+            setattr(self, name, dict() if value is dict else value)
+
+    def __getitem__(self, key):
+        value = getattr(self, key, MISSING) if key in self.__slots__ else MISSING
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError("%s has no field %s" % (type(self).__name__, key))
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not MISSING
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, ItemRecord):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.to_dict())
+
+    def get(self, key, default=None):
+        value = getattr(self, key, MISSING) if key in self.__slots__ else MISSING
+        return default if value is MISSING else value
+
+    def keys(self):
+        return [name for name in self.__slots__ if getattr(self, name) is not MISSING]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.keys()]
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def to_dict(self):
+        """Record as dict"""
+        return dict(self.items())
+
+
+class ListingItem(ItemRecord):
+    """Product listing page item"""
+    __slots__ = (
+        'article_name', 'article_type', 'brand_name', 'detail_page_url', 'discount_percentage',
+        'on_sale', 'sale_price', 'sku', 'listing_props', 'website', 'page_position',
+        # Entry data, see `BaseProvider.combine_entry_data`
+        'page_type', 'page_url', 'page_number', 'crawled_at', 'product_category', 'ordering',
+        'page_domain', 'page_path',
+    )
+    defaults = {
+        "article_name": None,
+        "brand_name": None,
+        "detail_page_url": None,
+        "discount_percentage": 0.0,
+        "on_sale": False,
+        "sale_price": None,
+        "sku": None,
+        "listing_props": dict,
+        "website": None,
+    }
+
+
+class DetailItem(ItemRecord):
+    """Product detail page item"""
+    __slots__ = (
+        'article_name', 'article_type', 'brand_name', 'discount_percentage', 'extra_props',
+        'on_sale', 'sale_price', 'sku', 'website',
+        # Entry data, see `BaseProvider.combine_entry_data`
+        'page_type', 'page_url', 'crawled_at', 'page_domain', 'page_path',
+    )
+    defaults = {
+        "article_name": None,
+        "article_type": None,
+        "brand_name": None,
+        "discount_percentage": 0.0,
+        "extra_props": dict,
+        "on_sale": False,
+        "sale_price": None,
+        "sku": None,
+        "website": None,
+    }
+
+
+def as_record(record_class, data, provider_uid):
+    """Record of the item info returned by a parser, a record or a dict"""
+    if isinstance(data, record_class):
+        if data.website is None:
+            data.website = provider_uid
+        return data
+    record = record_class(website=provider_uid)
+    if isinstance(data, dict):
+        record.update(data)
+    return record
+
+
 def product_listing_structure(provider_uid):
     """Decorator:
-    add `provider_uid` and set default data structure for product listing page info
+    add `provider_uid` and return product listing page info as `ListingItem` records
     """
     def product_listing_structure_decorator(func):
         def func_wrapper(*args, **kwargs):
-            structure = {
-                "article_name": None,
-                "brand_name": None,
-                "detail_page_url": None,
-                "discount_percentage": 0.0,
-                "on_sale": False,
-                "sale_price": None,
-                "sku": None,
-                "listing_props": {},
-                "website": provider_uid,
-            }
-
             data = func(*args, **kwargs)
             if isinstance(data, list):
-                ret_data = []
-                for d in data:
-                    if isinstance(d, dict):
-                        clone = dict(structure)
-                        clone.update(d)
-                        ret_data.append(clone)
-                return ret_data
-            elif isinstance(data, dict):
-                structure.update(data)
-            return structure
+                return [
+                    as_record(ListingItem, d, provider_uid)
+                    for d in data if isinstance(d, (dict, ListingItem))
+                ]
+            return as_record(ListingItem, data, provider_uid)
         return func_wrapper
     return product_listing_structure_decorator
 
 
 def product_detail_structure(provider_uid):
     """Decorator:
-    add `provider_uid` and set default data structure for product detail info
+    add `provider_uid` and return product detail info as a `DetailItem` record
     """
     def product_detail_structure_decorator(func):
         def func_wrapper(*args, **kwargs):
-            structure = {
-                "article_name": None,
-                "article_type": None,
-                "brand_name": None,
-                # "color": None,
-                "discount_percentage": 0.0,
-                "extra_props": {},
-                "on_sale": False,
-                "sale_price": None,
-                "sku": None,
-                # "variants": [],
-                "website": provider_uid,
-            }
-
-            structure.update(func(*args, **kwargs))
-
-            return structure
+            return as_record(DetailItem, func(*args, **kwargs), provider_uid)
         return func_wrapper
     return product_detail_structure_decorator
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""Declarative extraction specs.
+
+Providers describe their pages with a `DetailSpec` or `ListingSpec`: CSS
+selectors of the item containers and items, the fields to read from every
+item (`Field`, `Group`) and the expansion of items into variants
+(`Variants`). A spec is compiled once into an `ExtractionPlan`, which the
+`BaseProvider` extraction engine runs for every page.
+
+Compiled selectors return exactly what BeautifulSoup `select` returns, in the
+same order, but are parsed once and evaluated lazily, so `select_one` stops
+at the first match instead of collecting every match of the document.
+Selector syntax the compiler doesn't cover is left to BeautifulSoup. Tokens
+are parsed with the regular expressions of the BeautifulSoup 4.6 selector,
+kept here instead of relying on its private attributes.
+"""
+import re
+import shlex
+from functools import partial
+from bs4.element import Tag
+import utils
+
+
+DESCENDANT = 'descendant'
+CHILD = 'child'
+
+MATCH_ANY = 'any'
+MATCH_ID = 'id'
+MATCH_CLASSES = 'classes'
+MATCH_ATTRIBUTE = 'attribute'
+MATCH_ATTRIBUTE_VALUE = 'attribute_value'
+
+# -------------------------------------------------------------------------
+# Variant keys are substituted in the selectors of variant fields; keys that
+# would change the tokenizing of the selector are left to BeautifulSoup
+# -------------------------------------------------------------------------
+TEMPLATE_PLACEHOLDER = 'spec-template-value'
+TEMPLATE_VALUE_REGEXP = re.compile(r'^[\w-]*$')
+
+# -------------------------------------------------------------------------
+# Selector tokens as parsed by BeautifulSoup 4.6 `Tag.select`
+# -------------------------------------------------------------------------
+TAG_NAME_REGEXP = re.compile(r'^[a-zA-Z0-9][-.a-zA-Z0-9:_]*$')
+ATTRIBUTE_SELECTOR_REGEXP = re.compile(
+    r'^(?P<tag>[a-zA-Z0-9][-.a-zA-Z0-9:_]*)?\[(?P<attribute>[\w-]+)(?P<operator>[=~\|\^\$\*]?)'
+    r'=?"?(?P<value>[^\]"]*)"?\]$'
+    )
+
+
+def price(default=None):
+    """Transform: convert html price into float"""
+    return partial(utils.convert_html_price_to_float, default=default)
+
+
+# -------------------------------------------------------------------------
+# Selectors
+# -------------------------------------------------------------------------
+def attribute_value(el, attribute):
+    """Attribute value of element, multi-valued attributes joined by spaces like BeautifulSoup compares them"""
+    value = el.get(attribute, None)
+    if isinstance(value, (list, tuple)):
+        value = " ".join(value)
+    return value
+
+
+def _matcher(tag_name, kind, arg):
+    """Create element test of a selector step"""
+    if kind == MATCH_ID:
+        test = lambda el: el.get('id', None) == arg
+    elif kind == MATCH_CLASSES:
+        test = lambda el: arg.issubset(el.get('class', []))
+    elif kind == MATCH_ATTRIBUTE:
+        test = lambda el: el.has_attr(arg)
+    elif kind == MATCH_ATTRIBUTE_VALUE:
+        attribute, value = arg
+        test = lambda el: attribute_value(el, attribute) == value
+    else:
+        test = None
+
+    if tag_name and test is not None:
+        return lambda el: el.name == tag_name and test(el)
+    elif tag_name:
+        return lambda el: el.name == tag_name
+    return test or (lambda el: True)
+
+
+def _parse_token(token):
+    """Parse selector token into (tag_name, kind, arg), in the order BeautifulSoup does.
+
+    Returns None for syntax the compiler doesn't cover.
+    """
+    m = ATTRIBUTE_SELECTOR_REGEXP.match(token)
+    if m is not None:
+        tag_name, attribute, operator, value = m.groups()
+        if operator == '=':
+            return tag_name, MATCH_ATTRIBUTE_VALUE, (attribute, value)
+        elif not operator:
+            return tag_name, MATCH_ATTRIBUTE, attribute
+        return None
+    elif '#' in token:
+        tag_name, tag_id = token.split('#', 1)
+        return tag_name, MATCH_ID, tag_id
+    elif '.' in token:
+        tag_name, klass = token.split('.', 1)
+        return tag_name, MATCH_CLASSES, set(klass.split('.'))
+    elif ':' in token:
+        return None
+    elif token == '*':
+        return None, MATCH_ANY, None
+    elif TAG_NAME_REGEXP.match(token):
+        return token, MATCH_ANY, None
+    return None
+
+
+def _select_steps(context, matchers):
+    """Lazily evaluate selector steps on context elements"""
+    for axis, match, dedupe in matchers:
+        context = _select_step(context, axis, match, dedupe)
+    return iter(context)
+
+
+def _select_step(context, axis, match, dedupe):
+    """Lazily yield matching descendants (or children) of all context elements"""
+    seen = set()
+    for node in context:
+        candidates = node.children if axis is CHILD else node.descendants
+        for candidate in candidates:
+            if not isinstance(candidate, Tag) or not match(candidate):
+                continue
+            if dedupe:
+                if id(candidate) in seen:
+                    continue
+                seen.add(id(candidate))
+            yield candidate
+
+
+class SoupSelector(object):
+    """Selector evaluated by BeautifulSoup `select` on every call"""
+
+    def __init__(self, css, template=False):
+        self.css = css
+        self.template = template
+
+    def bind(self, value, index=None):
+        """Selector with the template placeholder replaced by `value`"""
+        return SoupSelector(self.css % (value))
+
+    def index(self, node):
+        return None
+
+    def select(self, node):
+        return node.select(self.css)
+
+    def select_one(self, node):
+        return node.select_one(self.css)
+
+
+class Selector(object):
+    """Precompiled CSS selector.
+
+    Steps are evaluated left to right like BeautifulSoup does; every step is a
+    generator over the matches of the previous step, so the first match is
+    found without evaluating the rest of the document.
+    """
+
+    def __init__(self, css, steps, template=False):
+        self.css = css
+        self.steps = steps
+        self.template = template
+        self._matchers = [
+            (axis, _matcher(tag_name, kind, arg), index > 0 and axis is DESCENDANT)
+            for index, (axis, tag_name, kind, arg) in enumerate(steps)
+        ]
+        self._template_step = None
+        if template:
+            self._template_step = [
+                index for index, (axis, tag_name, kind, arg) in enumerate(steps)
+                if kind == MATCH_ATTRIBUTE_VALUE and arg[1] == TEMPLATE_PLACEHOLDER
+            ][0]
+
+    def bind(self, value, index=None):
+        """Selector with the template placeholder replaced by `value`.
+
+        With an `index` of the template the matches are read from the index
+        instead of searching the node again.
+        """
+        if not isinstance(value, basestring) or not TEMPLATE_VALUE_REGEXP.match(value):
+            return SoupSelector(self.css % (value))
+        if index is not None:
+            return IndexedSelector(self.css % (value), index.get(value, ()), self._matchers[self._template_step + 1:])
+        steps = []
+        for axis, tag_name, kind, arg in self.steps:
+            if kind == MATCH_ATTRIBUTE_VALUE and arg[1] == TEMPLATE_PLACEHOLDER:
+                arg = (arg[0], value)
+            steps.append((axis, tag_name, kind, arg))
+        return Selector(self.css % (value), steps)
+
+    def index(self, node):
+        """Elements matching the template step of every value, in one walk over `node`.
+
+        Matching an attribute value only filters the matches of the attribute,
+        so the elements of a value are in the order the bound selector finds them.
+        """
+        axis, tag_name, kind, (attribute, value) = self.steps[self._template_step]
+        matchers = self._matchers[:self._template_step] + [
+            (axis, _matcher(tag_name, MATCH_ATTRIBUTE, attribute), self._matchers[self._template_step][2]),
+        ]
+        index = {}
+        for el in _select_steps((node,), matchers):
+            index.setdefault(attribute_value(el, attribute), []).append(el)
+        return index
+
+    def iter(self, node):
+        return _select_steps((node,), self._matchers)
+
+    def select(self, node):
+        return list(self.iter(node))
+
+    def select_one(self, node):
+        return next(self.iter(node), None)
+
+
+class IndexedSelector(Selector):
+    """Bound template selector continuing from the indexed elements of its value.
+
+    The node is ignored, the index was built from it.
+    """
+
+    def __init__(self, css, context, matchers):
+        self.css = css
+        self.template = False
+        self._context = context
+        self._matchers = matchers
+
+    def iter(self, node):
+        return _select_steps(self._context, self._matchers)
+
+
+def compile_selector(css, template=False):
+    """Compile CSS selector.
+
+    Templates have one `%s` placeholder in an attribute value, filled in with `bind`.
+    Selectors the compiler doesn't cover are returned as `SoupSelector`.
+    """
+    source = css % (TEMPLATE_PLACEHOLDER) if template else css
+    try:
+        tokens = shlex.split(source)
+    except ValueError:
+        return SoupSelector(css, template)
+
+    if ',' in source or not tokens or tokens[0] == '>' or tokens[-1] == '>':
+        return SoupSelector(css, template)
+
+    steps = []
+    axis = DESCENDANT
+    for token in tokens:
+        if token == '>':
+            if axis is CHILD:
+                return SoupSelector(css, template)
+            axis = CHILD
+            continue
+        parsed = _parse_token(token)
+        if parsed is None:
+            return SoupSelector(css, template)
+        steps.append((axis,) + parsed)
+        axis = DESCENDANT
+
+    if template and not any([s[2] == MATCH_ATTRIBUTE_VALUE and s[3][1] == TEMPLATE_PLACEHOLDER for s in steps]):
+        return SoupSelector(css, template)
+
+    return Selector(css, steps, template)
+
+
+# -------------------------------------------------------------------------
+# Spec Definitions
+# -------------------------------------------------------------------------
+class Field(object):
+    """Value of the first element matching `selector`.
+
+    params:
+        - attr: attribute to read, the element text when `None`
+        - transform: callable converting the value, e.g. `price()`
+        - default: value for a missing element or attribute
+        - many: list with the values of all matching elements
+        - element: the matching element itself instead of a value
+    """
+
+    def __init__(self, selector, attr=None, transform=None, default=None, many=False, element=False):
+        self.selector = selector
+        self.attr = attr
+        self.transform = transform
+        self.default = default
+        self.many = many
+        self.element = element
+
+    def read(self, el):
+        """Read value of element"""
+        if self.element:
+            return el
+        elif self.attr is None:
+            return getattr(el, 'text', self.default)
+        return getattr(el, 'attrs', {}).get(self.attr, self.default)
+
+    def extractor(self, selector):
+        """Create extract function of the field for a compiled selector"""
+        read = self.read
+        transform = self.transform
+        default = self.default
+
+        if self.many:
+            def extract_many(node):
+                values = [read(el) for el in selector.select(node)]
+                if transform is not None:
+                    values = [transform(value) for value in values]
+                return values
+            return extract_many
+
+        def extract(node):
+            try:
+                value = read(selector.select_one(node))
+            except:
+                value = default
+            if transform is not None:
+                value = transform(value)
+            return value
+        return extract
+
+    def compile(self, compiler):
+        return self.extractor(compiler(self.selector))
+
+
+class Group(object):
+    """Values of `fields` for every element matching `selector`"""
+
+    def __init__(self, selector, fields):
+        self.selector = selector
+        self.fields = fields
+
+    def compile(self, compiler):
+        selector = compiler(self.selector)
+        extractors = dict([(name, field.compile(compiler)) for name, field in self.fields.items()])
+
+        def extract(node):
+            return [FieldValues(el, extractors) for el in selector.select(node)]
+        return extract
+
+
+class Variants(object):
+    """Expand an item into variants.
+
+    `key` is a `many` field listing the variant keys of the item, the `%s` in
+    the selectors of `fields` is replaced by the key of the variant. Every
+    template is evaluated once per item into an index of the elements per key,
+    which all variants read from.
+    """
+
+    def __init__(self, key, fields):
+        self.key = key
+        self.fields = fields
+
+    def compile(self, compiler):
+        keys = self.key.compile(compiler)
+        templates = [
+            (name, field, compiler(field.selector, template=True))
+            for name, field in sorted(self.fields.items())
+        ]
+
+        def extract(node):
+            variants = []
+            indexes = {}
+            for key in keys(node):
+                values = {'key': key}
+                for name, field, template in templates:
+                    if template not in indexes:
+                        indexes[template] = template.index(node)
+                    values[name] = field.extractor(template.bind(key, indexes[template]))(node)
+                variants.append(values)
+            return variants
+        return extract
+
+
+class DetailSpec(object):
+    """Spec of a product detail page, `fields` are read from the document.
+
+    `required` fields must be found by the structured data fast path, see
+    `providers.stream`; pages missing one are extracted from the full document.
+    """
+    containers = None
+    items = None
+    variants = None
+
+    def __init__(self, fields, required=()):
+        self.fields = fields
+        self.required = required
+
+    def compile(self, interpreted=False):
+        """Compile spec into `ExtractionPlan`.
+
+        An interpreted plan runs every selector with BeautifulSoup `select`.
+        """
+        return ExtractionPlan(self, SoupSelector if interpreted else compile_selector)
+
+
+class ListingSpec(DetailSpec):
+    """Spec of a product listing page.
+
+    Items are the elements matching `items` within every element matching
+    `containers`. `fields` and the optional `variants` are read per item.
+    """
+
+    def __init__(self, containers, items, fields, variants=None):
+        super(ListingSpec, self).__init__(fields)
+        self.containers = containers
+        self.items = items
+        self.variants = variants
+
+
+# -------------------------------------------------------------------------
+# Extraction Plan
+# -------------------------------------------------------------------------
+class FieldValues(dict):
+    """Field values of an element, extracted on first access"""
+    __slots__ = ('node', 'extractors')
+
+    def __init__(self, node, extractors):
+        super(FieldValues, self).__init__()
+        self.node = node
+        self.extractors = extractors
+
+    def __missing__(self, name):
+        value = self[name] = self.extractors[name](self.node)
+        return value
+
+
+class ExtractionPlan(object):
+    """Compiled spec, selectors are compiled once and shared between fields"""
+
+    def __init__(self, spec, compiler):
+        compiled = {}
+
+        def compile_once(css, template=False):
+            if (css, template) not in compiled:
+                compiled[(css, template)] = compiler(css, template)
+            return compiled[(css, template)]
+
+        self.spec = spec
+        self.selectors = compiled
+        self.containers = compile_once(spec.containers) if spec.containers else None
+        self.items = compile_once(spec.items) if spec.items else None
+        self.extractors = dict([(name, field.compile(compile_once)) for name, field in spec.fields.items()])
+        if spec.variants is not None:
+            self.extractors['variants'] = spec.variants.compile(compile_once)
+
+    def iter_items(self, docx):
+        """Iterate over item elements of the page"""
+        for container in self.containers.select(docx):
+            for item in self.items.select(container):
+                yield item
+
+    def extract(self, xitem):
+        """Field values of item (or document)"""
+        return FieldValues(xitem, self.extractors)
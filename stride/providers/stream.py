@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+"""Structured data fast path.
+
+Detail pages carry most fields in meta tags and `application/ld+json`
+scripts. A `StreamPlan` evaluates the fields of a detail plan on the events
+of the lxml parser that BeautifulSoup itself is built on, without building
+the BeautifulSoup tree: elements are matched against the compiled selector
+steps while the parser walks the document. Only the subtrees of `element`
+fields are built.
+
+The values are the values the DOM extraction returns. Whenever that can't be
+guaranteed (selectors the compiler doesn't cover, nested contexts of a child
+combinator, parser errors) or a `required` field is missing, `extract` returns
+None and the page is extracted from the full document.
+"""
+import re
+from lxml import etree
+from bs4.builder import HTMLTreeBuilder
+from bs4.element import Tag, NavigableString, Comment, ProcessingInstruction
+from providers.spec import (Selector, Group, CHILD, MATCH_ID, MATCH_CLASSES,
+                            MATCH_ATTRIBUTE, MATCH_ATTRIBUTE_VALUE)
+
+
+ASCII_SPACES = u'\x20\x0a\x09\x0c\x0d'
+
+# -------------------------------------------------------------------------
+# Builder of the `element` field subtrees. `class`-like attributes are split
+# into lists like the BeautifulSoup 4.6 tree builder does, see `split_list_attributes`
+# -------------------------------------------------------------------------
+TREE_BUILDER = HTMLTreeBuilder()
+WHITESPACE_REGEXP = re.compile(r'\s+')
+
+
+def split_list_attributes(name, attrs):
+    """Split the whitespace separated values of `class`-like attributes into lists, in place"""
+    universal = TREE_BUILDER.cdata_list_attributes.get('*', [])
+    tag_specific = TREE_BUILDER.cdata_list_attributes.get(name.lower(), [])
+    for attr, value in attrs.items():
+        if (attr in universal or attr in tag_specific) and isinstance(value, basestring):
+            attrs[attr] = WHITESPACE_REGEXP.split(value)
+    return attrs
+
+
+class StopStreaming(Exception):
+    """Raised from the parser target when all fields are found"""
+    pass
+
+
+class StreamElement(object):
+    """Element of the parser events, tested by the selector matchers like a `Tag`"""
+    __slots__ = ('name', 'attrs')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def has_attr(self, key):
+        return key in self.attrs
+
+
+def step_key(tag_name, kind, arg):
+    """Index key of a selector step: an element must have the key to match the step.
+
+    Keys are the tag name, `#id`, `@attribute` or `.class`; None for steps any
+    element can match.
+    """
+    if tag_name:
+        return tag_name
+    elif kind == MATCH_ID:
+        return '#' + arg
+    elif kind == MATCH_ATTRIBUTE:
+        return '@' + arg
+    elif kind == MATCH_ATTRIBUTE_VALUE:
+        return '@' + arg[0]
+    elif kind == MATCH_CLASSES:
+        return '.' + sorted(arg)[0]
+    return None
+
+
+def element_keys(name, attrs):
+    """Index keys of an element"""
+    keys = [name]
+    if attrs:
+        for attr, value in attrs.items():
+            keys.append('@' + attr)
+            if attr == 'id' and isinstance(value, basestring):
+                keys.append('#' + value)
+            elif attr == 'class' and isinstance(value, list):
+                keys.extend(['.' + c for c in value])
+    return keys
+
+
+class Query(object):
+    """Matching state of a selector within a root element.
+
+    An element is in context level `k` when it matches the first `k + 1`
+    steps; elements in the last level are matches.
+    """
+
+    def __init__(self, selector, on_match, many):
+        self.steps = [(axis, match) for axis, match, _ in selector._matchers]
+        self.keys = [step_key(tag_name, kind, arg) for _, tag_name, kind, arg in selector.steps]
+        if None in self.keys:
+            self.keys = None
+        self.counts = [0] * len(self.steps)
+        self.last = 1 << (len(self.steps) - 1)
+        self.on_match = on_match
+        self.many = many
+        self.done = False
+        self.ambiguous = False
+
+    def levels(self, el, parent_levels):
+        """Bitmask of the context levels of a new element"""
+        mask = 0
+        counts = self.counts
+        for k, (axis, match) in enumerate(self.steps):
+            if k > 0:
+                if axis is CHILD:
+                    if not (parent_levels.get(self, 0) >> (k - 1)) & 1:
+                        continue
+                elif not counts[k - 1]:
+                    continue
+            if match(el):
+                mask |= 1 << k
+
+        for k in range(len(self.steps) - 1):
+            if (mask >> k) & 1 and counts[k] and self.steps[k + 1][0] is CHILD:
+                # -------------------------------------------------------------------------
+                # Nested contexts of a child combinator: BeautifulSoup returns the
+                # children of the outer context first, not in document order
+                # -------------------------------------------------------------------------
+                self.ambiguous = True
+        return mask
+
+    def enter(self, mask):
+        for k in range(len(self.steps)):
+            if (mask >> k) & 1:
+                self.counts[k] += 1
+
+    def leave(self, mask):
+        for k in range(len(self.steps)):
+            if (mask >> k) & 1:
+                self.counts[k] -= 1
+
+
+class TextCapture(object):
+    """Text of an element, the strings of its subtree"""
+
+    def __init__(self, on_value):
+        self.parts = []
+        self.on_value = on_value
+
+    def add_string(self, value, container_class):
+        if container_class is NavigableString:
+            self.parts.append(value)
+
+    def start(self, name, attrs):
+        pass
+
+    def end(self):
+        pass
+
+    def close(self):
+        self.on_value(u''.join(self.parts))
+
+
+class ElementCapture(object):
+    """Subtree of an element, built as BeautifulSoup tags"""
+
+    def __init__(self, name, attrs, on_value):
+        self.root = Tag(None, TREE_BUILDER, name, None, None, attrs)
+        self.stack = [self.root]
+        self.on_value = on_value
+
+    def add_string(self, value, container_class):
+        self.stack[-1].append(container_class(value))
+
+    def start(self, name, attrs):
+        tag = Tag(None, TREE_BUILDER, name, None, None, attrs)
+        self.stack[-1].append(tag)
+        self.stack.append(tag)
+
+    def end(self):
+        self.stack.pop()
+
+    def close(self):
+        self.on_value(self.root)
+
+
+class StreamEntry(object):
+    """Open element of the parser stack"""
+    __slots__ = ('name', 'levels', 'captures', 'queries', 'on_end')
+
+    def __init__(self, name, levels):
+        self.name = name
+        self.levels = levels
+        self.captures = []
+        self.queries = []
+        self.on_end = []
+
+
+class StreamTarget(object):
+    """lxml parser target extracting the fields of a `StreamPlan`.
+
+    Strings are collected and whitespace is collapsed exactly like the
+    BeautifulSoup tree builder does, so texts are identical to the tree.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.values = {}
+        self.found = set()
+        self.queries = []
+        self.index = {}
+        self.unindexed = []
+        self.captures = []
+        self.stack = []
+        self.current_data = []
+        self.preserve_whitespace = 0
+        self.failed = False
+        self.pending = 0
+        self.many = 0
+        for name, field in plan.fields:
+            self.add_field(field, name, self.values, self.stack)
+
+    # -------------------------------------------------------------------------
+    # Field matching
+    # -------------------------------------------------------------------------
+    def add_field(self, field, name, values, owner):
+        """Start matching a field for the elements within `owner` (the stack or an entry)"""
+        selector = self.plan.selectors[field.selector]
+
+        if isinstance(field, Group):
+            rows = values[name] = []
+
+            def on_row(el, entry):
+                row = {}
+                rows.append(row)
+                for sub_name, sub_field in sorted(field.fields.items()):
+                    self.add_field(sub_field, sub_name, row, entry)
+                entry.on_end.append(lambda: self.finish_values(field.fields, row))
+            query = Query(selector, on_row, many=True)
+        else:
+            if field.many:
+                values[name] = []
+
+            def on_match(el, entry):
+                if values is self.values:
+                    self.found.add(name)
+                if field.element:
+                    capture = ElementCapture(el.name, el.attrs, lambda value: set_value(value))
+                elif field.attr is None:
+                    capture = TextCapture(lambda value: set_value(value))
+                else:
+                    set_value(el.attrs.get(field.attr, field.default))
+                    return
+                entry.captures.append(capture)
+                self.captures.append(capture)
+
+            def set_value(value):
+                if field.many:
+                    values[name].append(value)
+                else:
+                    values[name] = value
+
+            query = Query(selector, on_match, many=field.many)
+
+        if query.many:
+            self.many += 1
+        else:
+            self.pending += 1
+        self.queries.append(query)
+        if query.keys is None:
+            self.unindexed.append(query)
+        else:
+            for key in set(query.keys):
+                self.index.setdefault(key, []).append(query)
+        if isinstance(owner, StreamEntry):
+            owner.queries.append(query)
+
+    def remove_query(self, query):
+        """Stop matching query"""
+        self.queries.remove(query)
+        if query.keys is None:
+            self.unindexed.remove(query)
+        else:
+            for key in set(query.keys):
+                self.index[key].remove(query)
+
+    def finish_values(self, fields, values):
+        """Set defaults of missing fields and apply transforms"""
+        for name, field in fields.items():
+            if isinstance(field, Group):
+                continue
+            if field.many:
+                if field.transform is not None:
+                    values[name] = [field.transform(value) for value in values[name]]
+                continue
+            value = values.get(name, field.default)
+            if field.transform is not None:
+                value = field.transform(value)
+            values[name] = value
+
+    # -------------------------------------------------------------------------
+    # Parser target interface
+    # -------------------------------------------------------------------------
+    def flush(self, container_class=NavigableString):
+        if not self.current_data:
+            return
+        value = u''.join(self.current_data)
+        self.current_data = []
+        if not self.preserve_whitespace:
+            strippable = True
+            for i in value:
+                if i not in ASCII_SPACES:
+                    strippable = False
+                    break
+            if strippable:
+                value = u'\n' if u'\n' in value else u' '
+        for capture in self.captures:
+            capture.add_string(value, container_class)
+
+    def start(self, name, attrs, nsmap=None):
+        self.flush()
+        attrs = dict(attrs)
+        if attrs:
+            split_list_attributes(name, attrs)
+        el = StreamElement(name, attrs)
+
+        # -------------------------------------------------------------------------
+        # Only queries with a step indexed by a key of the element can match it
+        # -------------------------------------------------------------------------
+        candidates = list(self.unindexed)
+        index = self.index
+        for key in element_keys(name, attrs):
+            if key in index:
+                candidates.extend(index[key])
+
+        parent_levels = self.stack[-1].levels if self.stack else {}
+        levels = {}
+        matched = []
+        for query in candidates:
+            if query.done or query in levels:
+                continue
+            mask = query.levels(el, parent_levels)
+            levels[query] = mask
+            if mask:
+                query.enter(mask)
+                if mask & query.last:
+                    matched.append(query)
+
+        for capture in self.captures:
+            capture.start(name, attrs)
+
+        entry = StreamEntry(name, levels)
+        self.stack.append(entry)
+        if name in TREE_BUILDER.preserve_whitespace_tags:
+            self.preserve_whitespace += 1
+
+        for query in matched:
+            if query.ambiguous:
+                self.failed = True
+                raise StopStreaming()
+            if not query.many:
+                query.done = True
+                self.pending -= 1
+            query.on_match(el, entry)
+
+    def end(self, name):
+        self.flush()
+        entry = self.stack.pop()
+        if entry.name != name:
+            self.failed = True
+            raise StopStreaming()
+        if name in TREE_BUILDER.preserve_whitespace_tags:
+            self.preserve_whitespace -= 1
+
+        for query, mask in entry.levels.items():
+            if mask:
+                query.leave(mask)
+        for capture in self.captures:
+            if capture not in entry.captures:
+                capture.end()
+        for capture in entry.captures:
+            self.captures.remove(capture)
+            capture.close()
+        for query in entry.queries:
+            self.remove_query(query)
+            if query.many:
+                self.many -= 1
+            elif not query.done:
+                self.pending -= 1
+        for callback in entry.on_end:
+            callback()
+
+        # -------------------------------------------------------------------------
+        # All fields found, skip the rest of the document
+        # -------------------------------------------------------------------------
+        if not self.pending and not self.captures and not self.many:
+            raise StopStreaming()
+
+    def data(self, content):
+        self.current_data.append(content)
+
+    def comment(self, content):
+        self.flush()
+        self.current_data.append(content)
+        self.flush(Comment)
+
+    def pi(self, target, data):
+        self.flush()
+        self.current_data.append(target + ' ' + data)
+        self.flush(ProcessingInstruction)
+
+    def doctype(self, name, pubid, system):
+        self.flush()
+
+    def close(self):
+        self.flush()
+
+
+class StreamPlan(object):
+    """Detail `ExtractionPlan` evaluated on parser events"""
+
+    def __init__(self, plan):
+        self.spec = plan.spec
+        self.fields = sorted(plan.spec.fields.items())
+        self.required = plan.spec.required
+        self.selectors = {}
+        self.streamable = plan.spec.variants is None
+        for name, field in self.fields:
+            for css in self.field_selectors(field):
+                selector = plan.selectors.get((css, False))
+                if not isinstance(selector, Selector):
+                    self.streamable = False
+                self.selectors[css] = selector
+
+    def field_selectors(self, field):
+        yield field.selector
+        if isinstance(field, Group):
+            for sub_field in field.fields.values():
+                for css in self.field_selectors(sub_field):
+                    yield css
+
+    def extract(self, markup):
+        """Field values of the document, None when the full document is needed"""
+        if not self.streamable or not isinstance(markup, unicode):
+            return None
+
+        target = StreamTarget(self)
+        try:
+            parser = etree.HTMLParser(target=target, strip_cdata=False, encoding=None)
+            parser.feed(markup)
+            parser.close()
+        except StopStreaming:
+            pass
+        except Exception:
+            return None
+
+        if target.failed or any([name not in target.found for name in self.required]):
+            return None
+
+        try:
+            target.finish_values(dict(self.fields), target.values)
+        except Exception:
+            return None
+        return target.values
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
-from functools import partial
 import utils
 import json
-import re
-from providers.provider import BaseProvider, product_detail_structure, product_listing_structure
+from providers.provider import (BaseProvider, calc_listing_price_info,
+                                product_detail_structure, product_listing_structure,
+                                DetailItem, ListingItem)
+from providers.spec import DetailSpec, ListingSpec, Field, price
+from providers.stream import StreamPlan
 
 
 PROVIDER_UID = "zalando"
@@ -11,60 +13,24 @@ PROVIDER_UID = "zalando"
 
 class Provider_ProductDetail(BaseProvider):
 
-    item_detail_select_xpaths = {
-        "sale_price": 'meta[name="twitter:data1"]',
-        "old_price": '#articleOldPrice',
-        "properties": "#productDetails div.content > ul > li",
-    }
-
-    def extract_product_detail_info(self, entry):
-        """Extract Product Detail Data"""
-        docx = entry.get('htmlx', None)
-        if not docx or entry.get('_parser_error', False):
-            return
-
-        # -------------------------------------------------------------------------
-        # Find Main View
-        # -------------------------------------------------------------------------
-        errmsg = None
-        item_info = None
-        try:
-            item_info = self.combine_entry_data(
-                entry=entry, 
-                item_info=self.parse_product_detail_item(xitem=docx)
-                )
-            status = True
-        except Exception as error:
-            status = False
-            errmsg = str(error)
-            raise
-
-        return {
-            "ok": status,
-            "item": item_info,
-            "errmsg": errmsg,
-        }
+    detail_spec = DetailSpec(fields={
+        "structured_data": Field('script[type="application/ld+json"]', transform=json.loads),
+        "sale_price": Field('meta[name="twitter:data1"]', attr='content', transform=price()),
+        "old_price": Field('#articleOldPrice', transform=price(default=0.0)),
+        "properties": Field('#productDetails div.content > ul > li', many=True, default=''),
+    }, required=('structured_data', 'sale_price'))
+    detail_plan = detail_spec.compile()
+    detail_stream_plan = StreamPlan(detail_plan)
 
     @product_detail_structure(PROVIDER_UID)
-    def parse_product_detail_item(self, xitem):
-        """Parse HTML for Product Detail Data"""
-        item_info = {}
-        status = True
-
-        # -------------------------------------------------------------------------
-        # Creating shorthands
-        # -------------------------------------------------------------------------
-        pricing = utils.convert_html_price_to_float
-        xpaths = self.item_detail_select_xpaths.get
-        get_xpath_text = partial(self.get_select_path_text, xitem=xitem, default=None)
-        get_xpath_attr = partial(self.get_select_path_attr, xitem=xitem, default=None)
+    def parse_product_detail_item(self, values):
+        """Parse field values of the `detail_plan` into Product Detail Data"""
+        item_info = DetailItem()
 
         # -------------------------------------------------------------------------
         # Extract Data from script application/ld+json
         # -------------------------------------------------------------------------
-        raw_detail_info = json.loads(
-            get_xpath_text(xpath='script[type="application/ld+json"]')
-        )
+        raw_detail_info = values['structured_data']
 
         item_info['sku'] = raw_detail_info.get('sku')
         item_info['article_name'] = raw_detail_info.get('name')
@@ -73,15 +39,10 @@ class Provider_ProductDetail(BaseProvider):
         # -------------------------------------------------------------------------
         # Extract From Metadata
         # -------------------------------------------------------------------------
-        item_info['sale_price'] = pricing(get_xpath_attr(
-            xpath=xpaths('sale_price'),
-            attr='content'))
-        old_price = pricing(get_xpath_text(
-            xpath=xpaths('old_price'),
-            ), default=0.0)
+        item_info['sale_price'] = values['sale_price']
         item_info['discount_percentage'] = utils.calcDiscountPercentage(
             new_price=item_info['sale_price'],
-            old_price=old_price
+            old_price=values['old_price']
             )
         item_info['on_sale'] = item_info['discount_percentage'] > 0.0
 
@@ -89,105 +50,62 @@ class Provider_ProductDetail(BaseProvider):
         # Extract Properties
         # -------------------------------------------------------------------------
         extra_props = {}
-        for prop_line in xitem.select(xpaths('properties')):
-            prop_text = getattr(prop_line, 'text', '')
+        for prop_text in values['properties']:
             if not prop_text:
                 continue
 
             try:
-                prop_key, prop_value = re.sub(r'\n', ' ', prop_text).split(":")
+                prop_key, prop_value = prop_text.replace('\n', ' ').split(":")
                 extra_props[utils.cleanKeyForDict(prop_key)] = prop_value.strip()
             except:
                 continue
 
         item_info['extra_props'] = extra_props
 
-
         return item_info
 
 
 class Provider_ProductListing(BaseProvider):
-    item_listing_select_xpaths = {
-        'detail_page_url': 'div.catalogArticlesList_content a.catalogArticlesList_productBox',
-        'brand_name': 'div.catalogArticlesList_content div.catalogArticlesList_brandName',
-        'article_name': 'div.catalogArticlesList_content div.catalogArticlesList_articleName',
-        'price_listing': 'div.catalogArticlesList_content div.catalogArticlesList_priceBox div.catalogArticlesList_price',
-        'price_normal': 'div.catalogArticlesList_content div.catalogArticlesList_priceBox div.catalogArticlesList_price-old',
-        'price_special': 'div.catalogArticlesList_content div.catalogArticlesList_priceBox div.specialPrice',
-        'sku': 'div.catalogArticlesList_content span.sku',
-    }
-
-    def extract_product_listing_items(self, entry):
-        """Parse Product Listing Data"""
-        docx = entry.get('htmlx', None)
-        if not docx or entry.get('_parser_error', False):
-            return
 
-        # -------------------------------------------------------------------------
-        # Find all Article Listings
-        # -------------------------------------------------------------------------
-        list_containers = docx.find_all('ul', {'class': 'catalogArticlesList'})
-        page_position = 0
-        failed = 0
-        processed = 0
-        items = []
-        errmsgs = []
-        for list_container in list_containers:
-            list_items = list_container.find_all('li', {'class': 'catalogArticlesList_item'})
-            for list_item in list_items:
-                page_position = page_position + 1
-                try:
-                    item_info = self.parse_product_listing_item(xitem=list_item)
-                    item_info['page_position'] = page_position
-                    item_info = self.combine_entry_data(entry, item_info)
-
-                    items.append(item_info)
-                    processed + processed + 1
-                except Exception as error:
-                    failed = failed + 1
-                    errmsgs.append(str(error))
-                    raise error
-
-        return {
-            "items": items,
-            "failed": failed,
-            "processed": processed,
-            "errmsgs": errmsgs,
-        }
+    listing_spec = ListingSpec(
+        containers='ul.catalogArticlesList',
+        items='li.catalogArticlesList_item',
+        fields={
+            'detail_page_url': Field('div.catalogArticlesList_content a.catalogArticlesList_productBox', attr='href'),
+            'brand_name': Field('div.catalogArticlesList_content div.catalogArticlesList_brandName'),
+            'article_name': Field('div.catalogArticlesList_content div.catalogArticlesList_articleName'),
+            'price_listing': Field(
+                'div.catalogArticlesList_content div.catalogArticlesList_priceBox div.catalogArticlesList_price',
+                transform=price()),
+            'price_normal': Field(
+                'div.catalogArticlesList_content div.catalogArticlesList_priceBox div.catalogArticlesList_price-old',
+                transform=price()),
+            'price_special': Field(
+                'div.catalogArticlesList_content div.catalogArticlesList_priceBox div.specialPrice',
+                transform=price()),
+            'sku': Field('div.catalogArticlesList_content span.sku'),
+        })
+    listing_plan = listing_spec.compile()
 
     @product_listing_structure(PROVIDER_UID)
     def parse_product_listing_item(self, xitem):
         """Parse HTML for Listed Product Data"""
-        item_info = {}
+        item_info = ListingItem()
+        values = self.listing_plan.extract(xitem)
 
-        # -------------------------------------------------------------------------
-        # Creating shorthands
-        # -------------------------------------------------------------------------
-        xpaths = self.item_listing_select_xpaths.get
-        pricing = utils.convert_html_price_to_float
-        get_xpath_text = partial(self.get_select_path_text, xitem=xitem, default=None)
-        get_xpath_attr = partial(self.get_select_path_attr, xitem=xitem, default=None)
-
-        item_info['detail_page_url'] = get_xpath_attr(
-            xpath=xpaths('detail_page_url'),
-            attr='href')
-        item_info['sku'] = get_xpath_text(xpath=xpaths('sku'))
-        item_info['article_name'] = get_xpath_text(xpath=xpaths('article_name'))
-        item_info['brand_name'] = get_xpath_text(xpath=xpaths('brand_name'))
+        item_info['detail_page_url'] = values['detail_page_url']
+        item_info['sku'] = values['sku']
+        item_info['article_name'] = values['article_name']
+        item_info['brand_name'] = values['brand_name']
 
         # -------------------------------------------------------------------------
         # Extract Pricing Info
         # -------------------------------------------------------------------------
-        price_info = {}
-        price_info['price_special'] = pricing(get_xpath_text(xpath=xpaths('price_special')))
-        price_info['price_listing'] = pricing(get_xpath_text(xpath=xpaths('price_listing')))
-        price_info['price_normal'] = pricing(get_xpath_text(xpath=xpaths('price_normal')))
-
-        if price_info['price_special'] and price_info['price_special'] < price_info['price_listing']:
-            price_info['price_listing'] = price_info['price_special']
-
-            if price_info['price_normal'] and price_info['price_normal'] > 0.0:
-                price_info['price_discount'] = (1.0 - (price_info['price_special'] / price_info['price_normal']) ) * 100.0
+        price_info = calc_listing_price_info(
+            price_special=values['price_special'],
+            price_listing=values['price_listing'],
+            price_normal=values['price_normal'],
+            )
 
         item_info['sale_price'] = price_info['price_listing']
 
@@ -207,3 +125,4 @@ class ZalandoProvider(
     ):
     """Zalando Provider"""
     provider_uid = PROVIDER_UID
+    extractor_version = 1
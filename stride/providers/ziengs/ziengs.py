@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
-from functools import partial
 import utils
-import json
 import re
-from providers.provider import BaseProvider, product_detail_structure, product_listing_structure
+from providers.provider import (BaseProvider, product_detail_structure, product_listing_structure,
+                                DetailItem, ListingItem)
+from providers.spec import DetailSpec, ListingSpec, Field, Variants, price
+from providers.stream import StreamPlan
 
 
 PROVIDER_UID = "ziengs"
@@ -11,70 +12,32 @@ PROVIDER_UID = "ziengs"
 
 class Provider_ProductDetail(BaseProvider):
 
-    item_detail_select_xpaths = {
-        "sku": '#hdnProductId',
-        "article_name": 'h1[itemprop="name"]',
-        "article_type": 'meta[itemprop="category"]',
-        "brand_name": 'meta[itemprop="brand"]',
-        "sale_price": 'meta[itemprop="price"]',
-    }
-
-    def extract_product_detail_info(self, entry):
-        """Extract Product Detail Data"""
-        docx = entry.get('htmlx', None)
-        if not docx or entry.get('_parser_error', False):
-            return
-
-        # -------------------------------------------------------------------------
-        # Find Main View
-        # -------------------------------------------------------------------------
-        errmsg = None
-        item_info = None
-        try:
-            item_info = self.combine_entry_data(
-                entry=entry, 
-                item_info=self.parse_product_detail_item(xitem=docx)
-                )
-            status = True
-        except Exception as error:
-            status = False
-            errmsg = str(error)
-            raise
-
-        return {
-            "ok": status,
-            "item": item_info,
-            "errmsg": errmsg,
-        }
+    detail_spec = DetailSpec(fields={
+        "sku": Field('#hdnProductId', attr='value'),
+        "article_name": Field('h1[itemprop="name"]'),
+        "article_type": Field('meta[itemprop="category"]', attr='content'),
+        "brand_name": Field('meta[itemprop="brand"]', attr='content'),
+        "sale_price": Field('meta[itemprop="price"]', attr='content', transform=price()),
+        "props_blocks": Field('#detailBottom > div', many=True, element=True),
+    }, required=('sku', 'sale_price'))
+    detail_plan = detail_spec.compile()
+    detail_stream_plan = StreamPlan(detail_plan)
 
     @product_detail_structure(PROVIDER_UID)
-    def parse_product_detail_item(self, xitem):
-        """Parse HTML for Product Detail Data"""
-        item_info = {}
-        status = True
-
-        # -------------------------------------------------------------------------
-        # Creating shorthands
-        # -------------------------------------------------------------------------
-        xpaths = self.item_detail_select_xpaths.get
-        pricing = utils.convert_html_price_to_float
-        get_xpath_text = partial(self.get_select_path_text, xitem=xitem, default=None)
-        get_xpath_attr = partial(self.get_select_path_attr, xitem=xitem, default=None)
+    def parse_product_detail_item(self, values):
+        """Parse field values of the `detail_plan` into Product Detail Data"""
+        item_info = DetailItem()
 
-        item_info['sku'] = get_xpath_attr(xpath=xpaths('sku'), attr='value')
-        item_info['article_name'] = get_xpath_text(xpath=xpaths('article_name'))
-        item_info['article_type'] = get_xpath_attr(xpath=xpaths('article_type'), attr='content')
-        item_info['brand_name'] = get_xpath_attr(xpath=xpaths('brand_name'), attr='content')
+        item_info['sku'] = values['sku']
+        item_info['article_name'] = values['article_name']
+        item_info['article_type'] = values['article_type']
+        item_info['brand_name'] = values['brand_name']
 
         # -------------------------------------------------------------------------
-        # Extract From Metadata
+        # Extract From Metadata. Detail pages show no old price
         # -------------------------------------------------------------------------
-        item_info['sale_price'] = pricing(get_xpath_attr(
-            xpath=xpaths('sale_price'),
-            attr='content'))
-        old_price = pricing(get_xpath_text(
-            xpath=xpaths('old_price'),
-            ), default=0.0)
+        item_info['sale_price'] = values['sale_price']
+        old_price = 0.0
         item_info['discount_percentage'] = utils.calcDiscountPercentage(
             new_price=item_info['sale_price'],
             old_price=old_price
@@ -89,12 +52,12 @@ class Provider_ProductDetail(BaseProvider):
         }
         try:
             props_container = [
-                x for x in xitem.select('#detailBottom > div h3') if x.text == 'Extra kenmerken'
+                x for block in values['props_blocks'] for x in block.find_all('h3') if x.text == 'Extra kenmerken'
             ][0].parent
         except:
             props_container = None
         if props_container:
-            for prop_els in props_container.select('dl'):
+            for prop_els in props_container.find_all('dl'):
                 citer = prop_els.children
                 data = {}
                 while True:
@@ -129,112 +92,50 @@ class Provider_ProductDetail(BaseProvider):
 
 
 class Provider_ProductListing(BaseProvider):
-    item_listing_select_xpaths = {
-        'detail_page_url': 'div.product > a',
-        'brand_name': 'div.product > a > strong.merk',
-        'article_type': 'div.product > a > em.soort',
-        'price_listing': 'div.product > a > span.prijs',
-        'price_special': 'div.product > a > span.prijs > ins',
-        'price_normal': 'div.product > a > span.prijs > del',
-    }
-
-    def extract_product_listing_items(self, entry):
-        """Parse Product Listing Data"""
-        docx = entry.get('htmlx', None)
-        if not docx or entry.get('_parser_error', False):
-            return
-
-        # -------------------------------------------------------------------------
-        # Find all Article Listings
-        # -------------------------------------------------------------------------
-        list_containers = docx.find_all('div', {'class': 'productList'})
-        page_position = 0
-        failed = 0
-        processed = 0
-        items = []
-        errmsgs = []
-        for list_container in list_containers:
-            list_items = list_container.find_all('div', {'class': 'item'})
-            for list_item in list_items:
-                page_position = page_position + 1
-                try:
-                    item_info = self.parse_product_listing_item(xitem=list_item)
-                    # -------------------------------------------------------------------------
-                    # Because ziengs has multiple article variants per listing
-                    # the return value can be a list
-                    # -------------------------------------------------------------------------
-                    if isinstance(item_info, list):
-                        for i in item_info:
-                            if isinstance(i, dict):
-                                i['page_position'] = page_position
-                                items.append(
-                                    self.combine_entry_data(entry, i)
-                                )
-                    else:
-                        item_info['page_position'] = page_position
-                        item_info = self.combine_entry_data(entry, item_info)
 
-                        items.append(item_info)
-                    processed + processed + 1
-                except Exception as error:
-                    failed = failed + 1
-                    errmsgs.append(str(error))
-                    raise error
-
-        return {
-            "items": items,
-            "number_of_items": page_position,
-            "failed": failed,
-            "processed": processed,
-            "errmsgs": errmsgs,
-        }
+    listing_spec = ListingSpec(
+        containers='div.productList',
+        items='div.item',
+        fields={
+            'normal_price': Field('div.content > span.offerText', transform=price()),
+        },
+        # -------------------------------------------------------------------------
+        # Ziengs lists every color of an article as a variant
+        # -------------------------------------------------------------------------
+        variants=Variants(
+            key=Field('div.colorDivItem > ul[data-colorid]', attr='data-colorid', many=True),
+            fields={
+                'detail_page_url': Field('div.colorDivItem > ul[data-colorid="%s"] a', attr='href'),
+                'color': Field('div.colorDivItem > ul[data-colorid="%s"] a', attr='title'),
+                'article_name': Field('div.content > div[data-colorid="%s"] > a.title'),
+                'sale_price': Field('div.content > div[data-colorid="%s"] > span.price', transform=price()),
+            }))
+    listing_plan = listing_spec.compile()
 
     @product_listing_structure(PROVIDER_UID)
     def parse_product_listing_item(self, xitem):
         """Parse HTML for Listed Product Data"""
         items = []
-
-        # -------------------------------------------------------------------------
-        # Creating shorthands
-        # -------------------------------------------------------------------------
         xitem_attrs = getattr(xitem, 'attrs', {})
-        pricing = utils.convert_html_price_to_float
-        get_xpath_text = partial(self.get_select_path_text, xitem=xitem, default=None)
-        get_xpath_attr = partial(self.get_select_path_attr, xitem=xitem, default=None)
+        values = self.listing_plan.extract(xitem)
 
-        # -------------------------------------------------------------------------
-        # Get variants
-        # -------------------------------------------------------------------------
-        xvariants = [x.attrs.get('data-colorid') for x in xitem.select('div.colorDivItem > ul') if 'data-colorid' in getattr(x, 'attrs', {})]
-
-        normal_price = pricing(get_xpath_text(xpath='div.content > span.offerText'))
+        normal_price = values['normal_price']
         on_sale = 'vanvoor' in xitem_attrs.get('class', [])
 
         # -------------------------------------------------------------------------
         # Loop Variants and extract data per variant
         # -------------------------------------------------------------------------
-        for xvar in xvariants:
-            item_info = {
-                "on_sale": on_sale,
-            }
+        for variant in values['variants']:
+            item_info = ListingItem(on_sale=on_sale)
             extra_props = {
                 "normal_price": normal_price,
             }
 
-            xlink = getattr(
-                xitem.select_one('div.colorDivItem > ul[data-colorid="%s"] a' % (xvar)), 'attrs',
-                {}
-                )
             item_info['detail_page_url'] = re.sub(r'(../)+', '/',
-                utils.get_url_path(xlink.get('href'))
-                )
-            item_info['article_name'] = get_xpath_text(xpath='div.content > div[data-colorid="%s"] > a.title' % (xvar)
-                )
-            item_info['sale_price'] = pricing(
-                get_xpath_text(
-                    xpath='div.content > div[data-colorid="%s"] > span.price' % (xvar)
-                    )
+                utils.get_url_path(variant['detail_page_url'])
                 )
+            item_info['article_name'] = variant['article_name']
+            item_info['sale_price'] = variant['sale_price']
 
             item_info['discount_percentage'] = utils.calcDiscountPercentage(
                 new_price=item_info['sale_price'],
@@ -244,10 +145,10 @@ class Provider_ProductListing(BaseProvider):
             # -------------------------------------------------------------------------
             # Extra Properties
             # -------------------------------------------------------------------------
-            extra_props['color'] = xlink.get('title')
+            extra_props['color'] = variant['color']
             item_info['listing_props'] = extra_props
 
-            items.append(dict(item_info))
+            items.append(item_info)
 
         return items
 
@@ -259,4 +160,5 @@ class ZiengsProvider(
     ):
     """Ziengs Provider"""
     provider_uid = PROVIDER_UID
+    extractor_version = 1
 
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Listing rank index.
+
+Every listed product is stored with its position in the category listing of
+a crawl, so rank history and top-N listings are single indexed queries.
+"""
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+import models
+import utils
+
+
+CATEGORY_SEPARATOR = ' > '
+BULK_WRITE_SIZE = 1000
+
+
+def category_path(category):
+    """Convert listing category into one path string"""
+    if isinstance(category, (list, tuple)):
+        return CATEGORY_SEPARATOR.join([c for c in category if c])
+    return category or ''
+
+
+def crawl_date(crawled_at):
+    """Crawl day of a crawl timestamp"""
+    return crawled_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def absolute_position(page_number, page_size, position):
+    """Position in the category listing, `page_size` is the size of the first page"""
+    return (page_number - 1) * page_size + position
+
+
+def rank_operation(website_pk, sku, product_pk, listing, position, price=None):
+    """Create upsert operation for the rank of a product on a listing page.
+
+    `listing` is a `ProductListingPage` or its raw document. `position` is the
+    product position on the page, counted in products like the page listing
+    size.
+    """
+    get = listing.get if isinstance(listing, dict) else lambda k: getattr(listing, k, None)
+    page_number = get('page_number') or 1
+    page_listing_size = get('page_listing_size') or 0
+
+    return UpdateOne(
+        {'listing': get('_id'), 'sku_key': utils.cleanSKUForLookup(sku)},
+        {'$set': {
+            'website': website_pk,
+            'product': product_pk,
+            'category': category_path(get('category')),
+            'sorted_by': get('sorted_by'),
+            'crawled_at': get('crawled_at'),
+            'crawl_date': crawl_date(get('crawled_at')),
+            'page_number': page_number,
+            'position': position,
+            # -------------------------------------------------------------------------
+            # Based on the listing size of this page, the first page of the listing
+            # may not be imported yet. Corrected by `refresh_absolute_positions`
+            # -------------------------------------------------------------------------
+            'absolute_position': absolute_position(page_number, page_listing_size, position),
+            'price': price,
+            'doc_version': 1.0,
+        }},
+        upsert=True,
+        )
+
+
+def store_ranks(operations):
+    """Write rank operations"""
+    if operations:
+        models.ListingRank._mongometa.collection.bulk_write(operations, ordered=False)
+
+
+def refresh_absolute_positions(website_pk):
+    """Set absolute positions of the ranks of a website from the first page of their listing.
+
+    Pages of a category listing have the size of the first page except the
+    last one, ranks are written with the size of their own page. Only ranks
+    with a changed absolute position are updated. Returns number of updates.
+    """
+    pages = models.ProductListingPage._mongometa.collection.find(
+        {'website': website_pk, 'page_number': 1},
+        projection={'_id': 0, 'category': 1, 'sorted_by': 1, 'crawled_at': 1, 'page_listing_size': 1},
+        )
+    page_sizes = dict([
+        ((category_path(page.get('category')), page.get('sorted_by'), crawl_date(page['crawled_at'])), page['page_listing_size'])
+        for page in pages
+    ])
+
+    collection = models.ListingRank._mongometa.collection
+    cursor = collection.find(
+        {'website': website_pk, 'page_number': {'$gt': 1}},
+        projection={'category': 1, 'sorted_by': 1, 'crawl_date': 1, 'page_number': 1, 'position': 1,
+                    'absolute_position': 1},
+        batch_size=BULK_WRITE_SIZE,
+        )
+    updated = 0
+    operations = []
+    for rank in cursor:
+        page_size = page_sizes.get((rank['category'], rank.get('sorted_by'), rank['crawl_date']))
+        if not page_size:
+            continue
+        position = absolute_position(rank['page_number'], page_size, rank['position'])
+        if rank.get('absolute_position') != position:
+            operations.append(UpdateOne({'_id': rank['_id']}, {'$set': {'absolute_position': position}}))
+        if len(operations) >= BULK_WRITE_SIZE:
+            collection.bulk_write(operations, ordered=False)
+            updated = updated + len(operations)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        updated = updated + len(operations)
+    return updated
+
+
+def get_rank_history(website_pk, sku, category=None, sorted_by=None):
+    """Rank history of a website sku grouped per category and ordering"""
+    query = {'website': website_pk, 'sku_key': utils.cleanSKUForLookup(sku)}
+    if category is not None:
+        query['category'] = category
+    if sorted_by is not None:
+        query['sorted_by'] = sorted_by
+
+    cursor = models.ListingRank._mongometa.collection.find(
+        query,
+        projection={'_id': 0, 'category': 1, 'sorted_by': 1, 'crawled_at': 1, 'page_number': 1,
+                    'position': 1, 'absolute_position': 1},
+        ).sort([('category', ASCENDING), ('sorted_by', ASCENDING), ('crawled_at', ASCENDING)])
+
+    history = []
+    for doc in cursor:
+        if not history or (history[-1]['category'], history[-1]['sorted_by']) != (doc['category'], doc.get('sorted_by')):
+            history.append({
+                "category": doc['category'],
+                "sorted_by": doc.get('sorted_by'),
+                "crawled_at": [],
+                "absolute_position": [],
+                "page_number": [],
+                "position": [],
+            })
+        for key in ('crawled_at', 'absolute_position', 'page_number', 'position'):
+            history[-1][key].append(doc.get(key))
+    return history
+
+
+def get_latest_crawl_date(website_pk, category, sorted_by):
+    """Latest crawl day of a category listing"""
+    latest = models.ListingRank._mongometa.collection.find_one(
+        {'website': website_pk, 'category': category, 'sorted_by': sorted_by},
+        projection={'_id': 0, 'crawl_date': 1},
+        sort=[('crawl_date', DESCENDING)],
+        )
+    return latest['crawl_date'] if latest else None
+
+
+def get_top_ranked(website_pk, category, sorted_by, crawl_day, limit=10):
+    """Top ranked products of a category listing on a crawl day"""
+    return list(models.ListingRank._mongometa.collection.find(
+        {'website': website_pk, 'category': category, 'sorted_by': sorted_by, 'crawl_date': crawl_day},
+        projection={'_id': 0, 'sku_key': 1, 'product': 1, 'crawled_at': 1, 'page_number': 1,
+                    'position': 1, 'absolute_position': 1, 'price': 1},
+        ).sort([('page_number', ASCENDING), ('position', ASCENDING)]).limit(limit))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Response encodings negotiated by Accept and Accept-Encoding headers.
+
+- JSON (compact) by default
+- MessagePack when the client accepts `application/x-msgpack` and the optional
+  `msgpack` package is installed
+- gzip compression of responses above `RESPONSE_COMPRESSION_MIN_SIZE` when the
+  client accepts gzip with a quality above zero. Streamed responses are
+  compressed while streaming.
+
+MessagePack strings are packed as str, never as bin, so keys and values decode
+to text in every client, and values unknown to MessagePack are encoded like
+the JSON encoder does, e.g. dates as HTTP dates.
+"""
+import zlib
+from flask import Response, current_app, jsonify, request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+
+def msgpack_default(value):
+    """Encode types unknown to MessagePack like the JSON encoder of the app"""
+    try:
+        value = current_app.json_encoder().default(value)
+    except TypeError:
+        return unicode(value)
+    return msgpack_text(value)
+
+
+def msgpack_text(data):
+    """Convert byte strings in data to unicode, `str` would be packed as bin on Python 2"""
+    if isinstance(data, str):
+        return data.decode('utf-8')
+    elif isinstance(data, dict):
+        return dict([(msgpack_text(k), msgpack_text(v)) for k, v in data.iteritems()])
+    elif isinstance(data, (list, tuple)):
+        return [msgpack_text(v) for v in data]
+    return data
+
+
+def accepts_msgpack():
+    """Check if client prefers MessagePack over JSON"""
+    if msgpack is None:
+        return False
+    return request.accept_mimetypes.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def api_response(data):
+    """Encode API data in the negotiated format"""
+    if accepts_msgpack():
+        return Response(
+            msgpack.packb(msgpack_text(data), default=msgpack_default, use_bin_type=True),
+            mimetype=MSGPACK_MIMETYPE,
+            )
+    return jsonify(data)
+
+
+def gzip_stream(chunks, level):
+    """Compress iterable of chunks into gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response):
+    """Gzip response if accepted by client and large enough"""
+    if response.status_code < 200 or response.status_code >= 300 or \
+        'Content-Encoding' in response.headers or \
+        not request.accept_encodings['gzip']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    level = current_app.config.get('RESPONSE_COMPRESSION_LEVEL', 6)
+
+    if response.is_streamed:
+        response.response = gzip_stream(response.response, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        if response.direct_passthrough:
+            return response
+        data = response.get_data()
+        if len(data) < current_app.config.get('RESPONSE_COMPRESSION_MIN_SIZE', 1024):
+            return response
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        response.set_data(compressor.compress(data) + compressor.flush())
+
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def init_app(app):
+    """Register response compression"""
+    app.after_request(compress_response)
+    return app
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from gunicorn.app.base import BaseApplication
+import metrics
+import models
+
+
+def post_fork(server, worker):
+    """Create a new Mongo client in every worker; the inherited client is not fork-safe"""
+    metrics.reset_pid()
+    models.connect_database()
+
+
+def worker_exit(server, worker):
+    """Write the final metrics of the worker, they stay part of the merged metrics"""
+    metrics.flush(force=True)
+
+
+class ProductionServer(BaseApplication):
+    """Multi-process WSGI server running the application.
+
+    Workers serve requests with a thread pool each and connect to Mongo after
+    fork. Send SIGHUP to the master process to gracefully restart the workers.
+    The master process already imported the application, so restarted workers
+    run the same code. To deploy new code send SIGUSR2 to the master, which
+    starts a new master with new workers on the same sockets, then SIGWINCH to
+    stop the workers and SIGTERM to stop the old master.
+    """
+
+    def __init__(self, application, options=None):
+        self.application = application
+        self.options = options or {}
+        super(ProductionServer, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+        self.cfg.set('post_fork', post_fork)
+        self.cfg.set('worker_exit', worker_exit)
+
+    def load(self):
+        return self.application
+
+
+def serve(application, config, workers=None, threads=None):
+    """Start production server with settings from config"""
+    metrics.enable_multiprocess(
+        config.get('METRICS_MULTIPROCESS_DIR'),
+        flush_interval=config.get('METRICS_FLUSH_INTERVAL', 1.0),
+        )
+    ProductionServer(application, {
+        'bind': '%s:%s' % (config.get('HOST'), config.get('PORT')),
+        'workers': workers or config.get('SERVER_WORKERS'),
+        'threads': threads or config.get('SERVER_THREADS'),
+        'worker_class': 'gthread',
+        'keepalive': config.get('SERVER_KEEPALIVE'),
+        'graceful_timeout': config.get('SERVER_GRACEFUL_TIMEOUT'),
+    }).run()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Precomputed product stats per website and brand.
+
+Stats count the latest crawled version of every website sku. A refresh scans
+only the products of the imported website and stores a partial summary per
+brand sold on the website; brand stats merge the partial summaries of all
+websites, so other websites aren't scanned again. Prices are counted per
+distinct price, summaries merge without holding every price.
+"""
+from datetime import datetime
+import matching
+import models
+import utils
+
+
+PRICE_QUANTILES = (0, 10, 25, 50, 75, 90, 100)
+DISCOUNT_HISTOGRAM_BINS = range(0, 101, 10)
+
+
+class Summary(object):
+    """Mergeable summary of products with `price`, `on_sale` and `discount_percentage`"""
+
+    def __init__(self):
+        self.total = 0
+        self.on_sale = 0
+        self.price_counts = {}
+        self.histogram = [0] * (len(DISCOUNT_HISTOGRAM_BINS) - 1)
+
+    def add(self, doc):
+        self.total = self.total + 1
+        price = doc.get('price')
+        if price is not None:
+            self.price_counts[price] = self.price_counts.get(price, 0) + 1
+
+        if doc.get('on_sale'):
+            self.on_sale = self.on_sale + 1
+            discount = doc.get('discount_percentage') or 0.0
+            self.histogram[min(max(int(discount // 10), 0), len(self.histogram) - 1)] += 1
+
+    def merge(self, stats):
+        """Add a stored partial summary"""
+        self.total = self.total + stats.get('total', 0)
+        self.on_sale = self.on_sale + stats.get('on_sale', 0)
+        for price, count in stats.get('price_counts', []):
+            self.price_counts[price] = self.price_counts.get(price, 0) + count
+        for i, item in enumerate(stats.get('discount_histogram', [])):
+            self.histogram[i] += item['count']
+
+    def stats(self, partial=False):
+        """Stats document fields, partial summaries keep the price counts to merge"""
+        price_counts = sorted(self.price_counts.items())
+        stats = {
+            "total": self.total,
+            "on_sale": self.on_sale,
+            "on_sale_ratio": float(self.on_sale) / self.total if self.total else 0.0,
+            "price_quantiles": dict([
+                ("p%s" % (q), utils.calcCountedPercentile(price_counts, q)) for q in PRICE_QUANTILES
+            ]),
+            "discount_histogram": [
+                {"min": DISCOUNT_HISTOGRAM_BINS[i], "max": DISCOUNT_HISTOGRAM_BINS[i+1], "count": count}
+                for i, count in enumerate(self.histogram)
+            ],
+        }
+        if partial:
+            stats['price_counts'] = [[price, count] for price, count in price_counts]
+        return stats
+
+
+def summarize(cursor):
+    """Summarize stream of products with `price`, `on_sale` and `discount_percentage`"""
+    summary = Summary()
+    for doc in cursor:
+        summary.add(doc)
+    return summary.stats()
+
+
+def store_stats(scope, summary, website_pk=None, brand_pk=None):
+    """Replace stats document of scope with summary"""
+    stats = models.ProductStats(
+        scope=scope,
+        website=website_pk,
+        brand=brand_pk,
+        refreshed_at=datetime.utcnow(),
+        **summary.stats(partial=scope == models.ProductStats.SCOPE_WEBSITE_BRAND)
+        )
+    stats.full_clean()
+
+    models.ProductStats._mongometa.collection.replace_one(
+        {'scope': scope, 'website': website_pk, 'brand': brand_pk},
+        stats.to_son(),
+        upsert=True,
+        )
+
+
+def refresh_brand_stats(brand_pk):
+    """Rebuild stats of a brand from the partial summaries of all websites"""
+    collection = models.ProductStats._mongometa.collection
+    summary = Summary()
+    for partial in collection.find({'scope': models.ProductStats.SCOPE_WEBSITE_BRAND, 'brand': brand_pk}):
+        summary.merge(partial)
+
+    if not summary.total:
+        collection.delete_one({'scope': models.ProductStats.SCOPE_BRAND, 'website': None, 'brand': brand_pk})
+        return
+    store_stats(models.ProductStats.SCOPE_BRAND, summary, brand_pk=brand_pk)
+
+
+def refresh_website_stats(website_pk):
+    """Rebuild stats of a website and of all brands sold on the website"""
+    # -------------------------------------------------------------------------
+    # Summarize latest version of every website sku, per brand in one pass
+    # -------------------------------------------------------------------------
+    website_summary = Summary()
+    brand_summaries = {}
+    for doc in matching.latest_website_products(website_pk, fields=('brand', 'price', 'on_sale', 'discount_percentage')):
+        website_summary.add(doc)
+        brand_pk = doc.get('brand')
+        if brand_pk is not None:
+            brand_summaries.setdefault(brand_pk, Summary()).add(doc)
+
+    store_stats(models.ProductStats.SCOPE_WEBSITE, website_summary, website_pk=website_pk)
+
+    # -------------------------------------------------------------------------
+    # Replace partial summaries of the website, brands no longer sold on the
+    # website are refreshed without it
+    # -------------------------------------------------------------------------
+    collection = models.ProductStats._mongometa.collection
+    partial_query = {'scope': models.ProductStats.SCOPE_WEBSITE_BRAND, 'website': website_pk}
+    brands = set(collection.distinct('brand', partial_query)) | set(brand_summaries.keys())
+    collection.delete_many(dict(partial_query, brand={'$nin': list(brand_summaries.keys())}))
+    for brand_pk, summary in brand_summaries.iteritems():
+        store_stats(models.ProductStats.SCOPE_WEBSITE_BRAND, summary, website_pk=website_pk, brand_pk=brand_pk)
+
+    for brand_pk in brands:
+        refresh_brand_stats(brand_pk)
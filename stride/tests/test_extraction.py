@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import bs4 as BeautifulSoup
+from benchmarks import synthetic
+from benchmarks.extraction_plans import PROVIDERS, interpreted_provider, extract
+
+
+class ExtractionEquivalenceTest(unittest.TestCase):
+    """Compiled plans, interpreted plans and the structured data fast path extract the same data"""
+
+    def lines(self, name):
+        return list(synthetic.generate(name, products=24, listing_size=8, seed=3))
+
+    def parsed_entries(self, lines, page_type):
+        entries = []
+        for line in lines:
+            entry = json.loads(line)
+            if entry['page_type'] != page_type:
+                continue
+            entry['htmlx'] = BeautifulSoup.BeautifulSoup(entry['body'], 'lxml')
+            entry['_parser_error'] = False
+            entries.append(entry)
+        return entries
+
+    def assertPlansEqual(self, name):
+        lines = self.lines(name)
+        compiled = PROVIDERS[name](None)
+        interpreted = interpreted_provider(PROVIDERS[name], None)
+        for page_type in ('product_detail', 'product_listing'):
+            entries = self.parsed_entries(lines, page_type)
+            self.assertTrue(entries)
+            results = extract(compiled, page_type, entries)
+            self.assertTrue(all(results))
+            self.assertEqual(results, extract(interpreted, page_type, entries))
+
+    def assertFastPathEqual(self, name):
+        lines = [line for line in self.lines(name) if json.loads(line)['page_type'] == 'product_detail']
+        fast = PROVIDERS[name](None)
+        full = PROVIDERS[name](None)
+        full.structured_fast_path = False
+
+        fast_entries = [fast.extract_date_line(line) for line in lines]
+        full_entries = [full.extract_date_line(line) for line in lines]
+        self.assertEqual([e['extracted_data'] for e in fast_entries], [e['extracted_data'] for e in full_entries])
+        self.assertTrue([e for e in fast_entries if e['htmlx'] is None])
+
+    def test_zalando(self):
+        self.assertPlansEqual('zalando')
+        self.assertFastPathEqual('zalando')
+
+    def test_omoda(self):
+        self.assertPlansEqual('omoda')
+        self.assertFastPathEqual('omoda')
+
+    def test_ziengs(self):
+        self.assertPlansEqual('ziengs')
+        self.assertFastPathEqual('ziengs')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from providers.zalando.zalando import ZalandoProvider
+
+
+class ReleaseEntryTest(unittest.TestCase):
+    """Release of the parse tree and body of extracted entries"""
+
+    def entry(self, body):
+        provider = ZalandoProvider(None)
+        entry = provider.extract_date_line(json.dumps({
+            "page_type": "product_listing",
+            "page_url": "https://www.zalando.nl/damesschoenen/",
+            "crawled_at": "2016-05-30T23:14:36",
+            "body": body,
+        }))
+        return provider, entry
+
+    def assertReleased(self, body):
+        provider, entry = self.entry(body)
+        self.assertIsNotNone(entry['htmlx'])
+        provider.release_entry(entry)
+        self.assertIsNone(entry['htmlx'])
+        self.assertNotIn('body', entry)
+
+    def test_doctype(self):
+        self.assertReleased(u'<!DOCTYPE html><html><body><div class="x">a</div></body></html>')
+
+    def test_top_level_comment(self):
+        self.assertReleased(u'<!-- c --><html><body><p>a</p></body></html>')
+
+    def test_without_tree(self):
+        provider = ZalandoProvider(None)
+        entry = {"htmlx": None, "body": u''}
+        provider.release_entry(entry)
+        self.assertIsNone(entry['htmlx'])
+
+
+
+LISTING_ITEM = (u'<li class="catalogArticlesList_item"><div class="catalogArticlesList_content">'
+                u'<a class="catalogArticlesList_productBox" href="/p-%s.html">'
+                u'<div class="catalogArticlesList_brandName">Nike</div>'
+                u'<div class="catalogArticlesList_articleName">Name %s</div>'
+                u'<div class="catalogArticlesList_priceBox"><div class="catalogArticlesList_price">€ 60,00</div></div>'
+                u'</a></div></li>')
+
+
+class ReadEntryTest(unittest.TestCase):
+    """Lines failing to decode or extract are yielded instead of raised"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'crawl.jl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def line(self, page_type, body):
+        return json.dumps({
+            "page_type": page_type,
+            "page_url": "https://www.zalando.nl/damesschoenen/",
+            "crawled_at": "2016-05-30T23:14:36",
+            "body": body,
+        })
+
+    def read(self, lines):
+        with open(self.path, 'wb') as f:
+            f.write('\n'.join(lines) + '\n')
+        return list(ZalandoProvider(self.path).read_entry())
+
+    def test_truncated_line(self):
+        truncated = self.line("product_listing", u'<html></html>')[:20]
+        entries = self.read([truncated, self.line("product_listing", u'<html></html>')])
+        self.assertFalse(entries[0]['extract_ok'])
+        self.assertIsInstance(entries[0]['extract_error'], ValueError)
+        self.assertEqual(entries[0]['_line_offset'], 0)
+        self.assertTrue(entries[1]['extract_ok'])
+        self.assertEqual(entries[1]['_line_offset'], len(truncated) + 1)
+
+    def test_unknown_page_type(self):
+        entry, = self.read([self.line("homepage", u'<html></html>')])
+        self.assertFalse(entry['extract_ok'])
+        self.assertEqual(type(entry['extract_error']).__name__, 'UnknownPageTypeException')
+        self.assertEqual(entry['body'], u'<html></html>')
+
+    def test_failed_listing_item(self):
+        provider = ZalandoProvider(None)
+        parse_item = provider.parse_product_listing_item
+
+        def parse_product_listing_item(xitem):
+            if 'Name 2' in xitem.get_text():
+                raise ValueError("Broken item")
+            return parse_item(xitem=xitem)
+        provider.parse_product_listing_item = parse_product_listing_item
+
+        body = u'<html><body><ul class="catalogArticlesList">%s</ul></body></html>' % (
+            u''.join([LISTING_ITEM % (i, i) for i in range(1, 4)]))
+        entry = provider.extract_date_line(self.line("product_listing", body))
+        extracted_data = entry['extracted_data']
+        self.assertEqual([i['page_position'] for i in extracted_data['items']], [1, 3])
+        self.assertEqual(extracted_data['failed'], 1)
+        self.assertEqual(extracted_data['failed_items'][0]['page_position'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import datetime
+from flask import Flask
+import responses
+
+
+def create_app(data):
+    app = Flask(__name__)
+    responses.init_app(app)
+
+    @app.route('/data')
+    def get_data():
+        return responses.api_response(data)
+
+    @app.route('/large')
+    def get_large():
+        return 'x' * 5000
+
+    return app
+
+
+@unittest.skipIf(responses.msgpack is None, "msgpack is not installed")
+class MessagePackTest(unittest.TestCase):
+    """MessagePack responses decode to text keys and values"""
+
+    def test_str_packed_as_text(self):
+        app = create_app({'limit': 10, 'id': '5745ef0b1d41c8147e1b1d2f', 'items': [{'sku': 'AB-12'}]})
+        data = app.test_client().get('/data', headers={'Accept': responses.MSGPACK_MIMETYPE}).data
+        self.assertEqual(responses.msgpack.unpackb(data, raw=True), {
+            u'limit': 10, u'id': u'5745ef0b1d41c8147e1b1d2f', u'items': [{u'sku': u'AB-12'}],
+        })
+        self.assertNotIn('\xc4', data)
+
+    def test_datetime_as_http_date(self):
+        app = create_app({'crawled_at': datetime(2016, 5, 30, 23, 14, 36)})
+        data = app.test_client().get('/data', headers={'Accept': responses.MSGPACK_MIMETYPE}).data
+        self.assertEqual(responses.msgpack.unpackb(data, raw=False), {u'crawled_at': u'Mon, 30 May 2016 23:14:36 GMT'})
+
+
+class CompressResponseTest(unittest.TestCase):
+    """gzip is used when accepted with a quality above zero"""
+
+    def content_encoding(self, accept_encoding):
+        client = create_app({}).test_client()
+        return client.get('/large', headers={'Accept-Encoding': accept_encoding}).headers.get('Content-Encoding')
+
+    def test_accepted(self):
+        self.assertEqual(self.content_encoding('gzip, deflate'), 'gzip')
+
+    def test_refused(self):
+        self.assertIsNone(self.content_encoding('gzip;q=0'))
+        self.assertIsNone(self.content_encoding('deflate'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import unittest
+import utils
+
+
+class NormalizeProductValuesTest(unittest.TestCase):
+    """Normalization shared by `models.Product.clean` and `extract`"""
+
+    def test_discount_sets_on_sale(self):
+        values = utils.normalizeProductValues({"sku": "AB-12", "on_sale": False, "discount_percentage": 20.0})
+        self.assertTrue(values['on_sale'])
+        self.assertEqual(values['discount_percentage'], 20.0)
+
+    def test_not_on_sale_has_no_discount(self):
+        values = utils.normalizeSaleValues({"on_sale": False, "discount_percentage": 0})
+        self.assertEqual(values['discount_percentage'], 0.0)
+
+    def test_path_sku_key_and_search_text(self):
+        values = utils.normalizeProductValues({
+            "sku": "AB-12",
+            "url": "https://www.omoda.nl/dames/pumps-1.html?x=1",
+            "properties": {"color": u"rood", "size": 38},
+        }, brand_name=u"Nike")
+        self.assertEqual(values['path'], "/dames/pumps-1.html")
+        self.assertEqual(values['sku_key'], utils.cleanSKUForLookup("AB-12"))
+        self.assertEqual(values['search_text'], u"Nike rood")
+
+    def test_keeps_path(self):
+        values = utils.normalizeProductValues({"sku": "AB-12", "url": "https://omoda.nl/a", "path": "/b"})
+        self.assertEqual(values['path'], "/b")
+        self.assertNotIn('search_text', values)
+
+
+
+class CalcCountedPercentileTest(unittest.TestCase):
+    """Percentiles of counted values equal those of the values"""
+
+    def test_equals_calc_percentile(self):
+        values = [79.95, 12.5, 79.95, 120.0, 12.5, 12.5, 49.0, 200.0, 79.95]
+        counts = sorted([(value, values.count(value)) for value in set(values)])
+        for percentile in (0, 10, 25, 33, 50, 75, 90, 99, 100):
+            self.assertAlmostEqual(
+                utils.calcCountedPercentile(counts, percentile), utils.calcPercentile(values, percentile))
+
+    def test_empty(self):
+        self.assertIsNone(utils.calcCountedPercentile([], 50))
+        self.assertIsNone(utils.calcCountedPercentile([(10.0, 0)], 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
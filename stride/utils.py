@@ -1,15 +1,8 @@
 # -*- coding: utf-8 -*-
-import unicodedata
 import os.path
-import re
 from math import ceil
 from urlparse import urlparse
-
-# -------------------------------------------------------------------------
-# Pre-Compiled Regexp
-# -------------------------------------------------------------------------
-CLEAN_UID_REGEXP = re.compile(r'[^.\ a-zA-Z0-9_-]')
-CLEAN_DICT_KEY_REGEXP = re.compile(r'[^a-zA-Z0-9_-]')
+import normalize
 
 
 def validate_path(fpath):
@@ -21,16 +14,7 @@ def validate_path(fpath):
 
 def convert_html_price_to_float(value, default=None):
     """Convert value input into float"""
-    try:
-        if isinstance(value, basestring):
-            # -------------------------------------------------------------------------
-            # Remove all except [0-9,.]. Replace all comma's with dots. split once on 
-            # most right dot. join all entry and remove all remain dots
-            # -------------------------------------------------------------------------
-            value = ".".join([re.sub(r'[^0-9]','', n) for n in re.sub(r',', '.', re.sub(r'[^0-9.,]', '', value)).rsplit('.', 1)])
-        return float(value)
-    except:
-        return default
+    return normalize.convert_html_price_to_float(value, default=default)
 
 
 def convertConfigIntoMongoURI(config):
@@ -44,38 +28,19 @@ def convertConfigIntoMongoURI(config):
 
 def cleanStringForUID(value):
     """Clean string into lowercased string with nospecial characters"""
-    try:
-        # -------------------------------------------------------------------------
-        # Remove all exotic characters and if possible replace with ascii equivalent
-        # -------------------------------------------------------------------------
-        if not isinstance(value, unicode):
-            value = unicode(value, 'utf-8')
-        value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
-    except:
-        value = str(value)
-
-    # -------------------------------------------------------------------------
-    # Lower Case and remove multiple, leading and trailing spaces
-    # -------------------------------------------------------------------------
-    return re.sub(' +', ' ', CLEAN_UID_REGEXP.sub('', value.lower().strip()))
+    return normalize.clean_string_for_uid(value)
 
 
 def cleanKeyForDict(value):
     """Clean string into lowercased string with nospecial characters"""
-    try:
-        # -------------------------------------------------------------------------
-        # Remove all exotic characters and if possible replace with ascii equivalent
-        # -------------------------------------------------------------------------
-        if not isinstance(value, unicode):
-            value = unicode(value, 'utf-8')
-        value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore')
-    except:
-        value = str(value)
+    return normalize.clean_key_for_dict(value)
 
-    # -------------------------------------------------------------------------
-    # Lower Case and remove multiple, leading and trailing spaces
-    # -------------------------------------------------------------------------
-    return re.sub(' +', '', CLEAN_DICT_KEY_REGEXP.sub('', value.lower().strip()))
+
+def cleanSKUForLookup(value):
+    """Normalize SKU into key for case-insensitive exact lookups"""
+    if not isinstance(value, basestring):
+        return None
+    return value.strip().lower()
 
 
 def calcDiscountPercentage(new_price, old_price):
@@ -92,6 +57,38 @@ def calcDiscountPercentage(new_price, old_price):
     return 0.0
 
 
+def normalizeSaleValues(values):
+    """Normalize sale values in place: discounted is on sale, not on sale has no discount"""
+    discount_percentage = values.get('discount_percentage')
+    if discount_percentage and isinstance(discount_percentage, float) and discount_percentage > 0.0:
+        values['on_sale'] = True
+    if not values.get('on_sale'):
+        values['discount_percentage'] = 0.0
+    return values
+
+
+def normalizeProductValues(values, brand_name=None):
+    """Normalize product values in place like `models.Product.clean`.
+
+    Sale values, the path of the url, the sku key and, with `brand_name`,
+    the search text.
+    """
+    normalizeSaleValues(values)
+    if values.get('url') and not values.get('path'):
+        values['path'] = get_url_path(values['url'])
+    values['sku_key'] = cleanSKUForLookup(values.get('sku'))
+    if brand_name is not None:
+        values['search_text'] = build_search_text(brand_name, values.get('properties'))
+    return values
+
+
+def build_search_text(brand_name, properties):
+    """Join brand name and property values into searchable text"""
+    terms = [brand_name] if brand_name else []
+    terms.extend([v for v in (properties or {}).values() if isinstance(v, basestring) and v])
+    return u' '.join(terms)
+
+
 def removeNoneValuesFromDict(d):
     """Remove None values from dictionary"""
     return dict([(k, v) for k, v in d.items() if v is not None])
@@ -104,6 +101,38 @@ def calcPercentage(part, total, round_whole=False):
     return percentage
 
 
+def calcPercentile(values, percentile):
+    """Calculate percentile (0-100) of values with linear interpolation"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * (float(percentile) / 100.0)
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def calcCountedPercentile(counts, percentile):
+    """Calculate percentile (0-100) like `calcPercentile` of (value, count) pairs sorted by value"""
+    size = sum([count for _, count in counts])
+    if not size:
+        return None
+    rank = (size - 1) * (float(percentile) / 100.0)
+    lower = int(rank)
+    upper = min(lower + 1, size - 1)
+
+    lower_value = upper_value = None
+    seen = 0
+    for value, count in counts:
+        seen = seen + count
+        if lower_value is None and lower < seen:
+            lower_value = value
+        if upper < seen:
+            upper_value = value
+            break
+    return lower_value + (upper_value - lower_value) * (rank - lower)
+
+
 def get_url_path(url):
     """Get URL Path from url"""
     try: